@@ -4,8 +4,10 @@ This module is used to change the default admin user interface generated by Djan
 
 from core.models import DeviceInterface, Method, ScheduleAction, \
     ActionPreconditionMethod, ActionDevice, StateValue, Schedule, MethodParameter, \
-    StateValueArgument, Device, Interface, Trigger, Action, ActionParameter
+    StateValueArgument, Device, Interface, Trigger, Action, ActionParameter, \
+    load_proximity_mac_addresses
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 from registration.models import UserProfile
@@ -90,11 +92,23 @@ class InterfaceAdmin(admin.ModelAdmin):
     interface_file_url.short_description = 'Interface file'
 
 
+class DeviceChangeList(ChangeList):
+
+    def get_results(self, request):
+        super(DeviceChangeList, self).get_results(request)
+        # The proximity groups of the listed devices are loaded in a single
+        # request instead of one request per row
+        self.result_list = load_proximity_mac_addresses(self.result_list)
+
+
 class DeviceAdmin(admin.ModelAdmin):
     readonly_fields = ['proximity_device_list', 'id_string']
     inlines = [DeviceInterfaceInline, StateValueInline]
     list_display = ['mac_address', 'name', 'num_proximity_devices']
 
+    def get_changelist(self, request, **kwargs):
+        return DeviceChangeList
+
     def proximity_device_list(self, obj):
         mac_addresses = []
         for device in obj.proximity_device_group.order_by('mac_address'):
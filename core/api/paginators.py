@@ -0,0 +1,26 @@
+"""This module provides paginators for the API resources.
+
+Exported classes:
+    * :class:`ProximityPaginator`: A paginator that loads the proximity groups
+      of the listed devices.
+
+"""
+
+from core.models import load_proximity_mac_addresses
+from tastypie.paginator import Paginator
+
+
+class ProximityPaginator(Paginator):
+    """A paginator that loads the proximity groups of the listed devices.
+
+    The groups of the devices on the page are loaded in a single request to
+    the proximity server, so that dehydrating the devices does not send a
+    request per device.
+
+    """
+
+    def page(self):
+        """Get the page of devices with their proximity groups loaded."""
+        output = super(ProximityPaginator, self).page()
+        output['objects'] = load_proximity_mac_addresses(output['objects'])
+        return output
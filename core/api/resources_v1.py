@@ -2,6 +2,7 @@ from tastypie import fields
 from tastypie.authorization import Authorization
 from tastypie.resources import ModelResource
 from core.models import Device, Interface, StateValue, Method, DeviceInterface
+from core.api.paginators import ProximityPaginator
 from django.conf.urls.defaults import url
 from django.shortcuts import get_object_or_404
 
@@ -81,6 +82,7 @@ class DeviceResource(ModelResource):
         authorization = Authorization()
         excludes = ['id', 'created_at', 'updated_at']
         include_resource_uri = False
+        paginator_class = ProximityPaginator
     
     def save_m2m(self, bundle):
         for interface in bundle.data['interfaces']:
@@ -1,5 +1,6 @@
 from core.models import DeviceInterface, Device, Interface, StateValue, Method, \
     MethodParameter
+from core.api.paginators import ProximityPaginator
 from resource_validations import DeviceInterfaceResourceValidation, \
     DeviceResourceValidation, DeviceStateValueResourceValidation
 from django.conf.urls.defaults import url
@@ -169,6 +170,7 @@ class DeviceResource(ModelResource):
         list_allowed_methods = ['get', 'post']
         detail_allowed_methods = ['get', 'put', 'delete']
         validation = DeviceResourceValidation()
+        paginator_class = ProximityPaginator
     
     def override_urls(self):
         return [
@@ -0,0 +1,204 @@
+"""This module provides a result cache for the CaaS configuration answers.
+
+The same WCRL models and selections are sent to CaaS over and over, when
+the states of the devices have not changed, and every request costs a
+remote round-trip. The answers are cached by a digest of the request body,
+which contains the model name, the model and the selections, so a changed
+state value results in a different key.
+
+The entries expire after a time to live, and the least recently used
+entries are evicted, when the cache is full. The entries can also be stored
+in the configured Django cache backend, so that the processes share them.
+
+Exported classes:
+    * :class:`CaasResultCache`: A class for caching the configuration
+      answers of CaaS.
+
+Exported functions:
+    * get_caas_result_cache: Get the shared result cache, or None, if the
+      cache is disabled.
+
+"""
+
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+import copy
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL = 60
+KEY_PREFIX = 'core_caas_result_'
+
+
+class CaasResultCache(object):
+    """A class for caching the configuration answers of CaaS.
+
+    An answer is either a list of configurations or None, if CaaS found no
+    configurations. The answers are copied, when they are set and got, so
+    that the callers can modify them.
+
+    Instance attributes:
+        * max_entries: The maximum number of entries in the local cache.
+        * ttl: The time to live of the entries in seconds.
+        * backend: A Django cache backend, or None, if the entries are only
+          cached locally.
+
+    Public functions:
+        * make_key: Make the key of a request body.
+        * get: Get a cached answer.
+        * set: Set a cached answer.
+        * clear: Remove all locally cached answers.
+        * get_stats: Get the cache metrics.
+
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 backend=None):
+        """Initialize the CaasResultCache."""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'backend_hits': 0,
+                       'evictions': 0, 'expirations': 0}
+
+    def make_key(self, payload):
+        """Make the key of a request body.
+
+        Args:
+            * payload: The body of a WCRL configuration request.
+
+        Returns:
+            * A hexadecimal SHA-1 digest string.
+
+        """
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+        return hashlib.sha1(payload).hexdigest()
+
+    def get(self, key):
+        """Get a cached answer.
+
+        Args:
+            * key: The key of the request body.
+
+        Returns:
+            * A tuple of a boolean, which is True, if the answer was found,
+              and the answer.
+
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                if entry[0] > now:
+                    # Move the entry to the end as the most recently used
+                    self._entries[key] = entry
+                    self._stats['hits'] += 1
+                    return True, copy.deepcopy(entry[1])
+                self._stats['expirations'] += 1
+
+        if self.backend is not None:
+            value = self.backend.get(KEY_PREFIX + key)
+            if value is not None:
+                # The answer is wrapped in a list, because None is a valid
+                # answer
+                self._store(key, value[0], now)
+                with self._lock:
+                    self._stats['hits'] += 1
+                    self._stats['backend_hits'] += 1
+                return True, copy.deepcopy(value[0])
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return False, None
+
+    def _store(self, key, answer, now):
+        """Store an answer in the local cache."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl, answer)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def set(self, key, answer):
+        """Set a cached answer.
+
+        Args:
+            * key: The key of the request body.
+            * answer: A list of configurations or None.
+
+        """
+        answer = copy.deepcopy(answer)
+        self._store(key, answer, time.time())
+        if self.backend is not None:
+            self.backend.set(KEY_PREFIX + key, [answer], self.ttl)
+
+    def clear(self):
+        """Remove all locally cached answers."""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """Get the cache metrics.
+
+        Returns:
+            * A dictionary containing the number of hits, backend hits,
+              misses, evictions and expirations and the current number of
+              entries.
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_caas_result_cache():
+    """Get the shared result cache.
+
+    The result cache is created on the first call and configured with the
+    ``RESULT_CACHE`` key of the ``CAAS`` setting, for instance::
+
+        CAAS = {
+            ...
+            'RESULT_CACHE': {
+                'ENABLED': True,
+                'MAX_ENTRIES': 256,
+                'TTL': 60,
+                'USE_DJANGO_CACHE': False,
+            },
+        }
+
+    Returns:
+        * A :class:`CaasResultCache` object, or None, if the cache is
+          disabled.
+
+    """
+    global _result_cache
+
+    config = getattr(settings, 'CAAS', {}).get('RESULT_CACHE', {})
+    if not config.get('ENABLED', True):
+        return None
+
+    with _result_cache_lock:
+        if _result_cache is None:
+            backend = cache if config.get('USE_DJANGO_CACHE', False) else None
+            _result_cache = CaasResultCache(
+                    max_entries=config.get('MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+                    ttl=config.get('TTL', DEFAULT_TTL),
+                    backend=backend)
+
+        return _result_cache
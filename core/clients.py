@@ -1,7 +1,13 @@
 from django.conf import settings
-from django.template.loader import render_to_string
+from core.caas_cache import get_caas_result_cache
+from core.http_sessions import get_session_pool
+from core.proximity_connections import get_connection_pool
+from django.utils.html import escape
 from events.event import EventHandler
-from xml.dom import minidom
+from proximity.protocol import ProtocolError
+from cStringIO import StringIO
+from xml.etree.cElementTree import iterparse
+import copy
 import json
 import logging
 import requests
@@ -10,12 +16,32 @@ import socket
 logger = logging.getLogger(__name__)
 event_handler = EventHandler()
 
+# The number of bytes read from a streamed Caas reply at a time
+RESPONSE_CHUNK_SIZE = 16384
+# The replies with more configurations are not kept in the result cache
+DEFAULT_MAX_CACHED_CONFIGURATIONS = 1000
+
 class ProximityClient(object):
+    """A client of the proximity server.
+
+    By default, the requests are sent over the framed protocol through a
+    shared pool of persistent connections. If the PROTOCOL of the server
+    settings is 'text', every request opens a new connection and sends a
+    comma separated text command, which the servers that predate the framed
+    protocol understand.
+
+    """
     
     def __init__(self):
-        self.host = settings.PROXIMITY_SERVER['default']['HOST']
-        self.port = settings.PROXIMITY_SERVER['default']['PORT']
+        config = settings.PROXIMITY_SERVER['default']
+        self.host = config['HOST']
+        self.port = config['PORT']
+        self.protocol = config.get('PROTOCOL', 'framed')
         self.socket = None
+        if self.protocol == 'framed':
+            self.connection_pool = get_connection_pool(self.host, self.port, config)
+        else:
+            self.connection_pool = None
     
     def _connect(self):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -30,13 +56,37 @@ class ProximityClient(object):
     def _close(self):
         self.socket.close()
     
-    def _send_request(self, request):
+    def _send_text_request(self, request):
         if self._connect():
-            self.socket.send(request)
-            response = self.socket.recv(1024)
+            self.socket.sendall(request)
+            # The server closes the connection after the reply
+            chunks = []
+            chunk = self.socket.recv(4096)
+            while chunk:
+                chunks.append(chunk)
+                chunk = self.socket.recv(4096)
             self._close()
             
-            return response
+            return "".join(chunks)
+    
+    def _send_requests(self, requests):
+        if self.connection_pool is None:
+            return [self._send_text_request(request) for request in requests]
+        
+        try:
+            return self.connection_pool.request(requests)
+        except socket.error, e:
+            if e.errno == 111:
+                raise ProximityClientConnectionError("The connection to the proximity server at %s:%i was refused" % (self.host, self.port))
+            raise ProximityClientConnectionError("The connection to the proximity server at %s:%i failed: %s" % (self.host, self.port, e))
+        except ProtocolError, e:
+            raise ProximityClientConnectionError("The proximity server at %s:%i violated the protocol: %s" % (self.host, self.port, e))
+    
+    def _send_request(self, request):
+        return self._send_requests([request])[0]
+    
+    def _parse_group(self, response):
+        return ([], response.split(","))[response != "[]"]
         
     def add_device(self, mac_address):
         self._send_request("add_device, " + mac_address)
@@ -47,7 +97,46 @@ class ProximityClient(object):
     def get_group(self, mac_address):
         response = self._send_request("get_group, " + mac_address)
         
-        return ([], response.split(","))[response != "[]"]
+        return self._parse_group(response)
+    
+    def set_groups(self, groups):
+        """Set the neighbours of several devices in a single request.
+
+        Args:
+            * groups: A dictionary of the neighbours by the mac addresses,
+              e.g., {'aa:aa:aa:aa:aa:aa': ['bb:bb:bb:bb:bb:bb'],
+                     'cc:cc:cc:cc:cc:cc': []}
+
+        """
+        if not groups:
+            return
+        entries = [",".join([mac_address] + list(neighbours))
+                   for mac_address, neighbours in groups.items()]
+        self._send_request("multi_set_group, " + ";".join(entries))
+    
+    def get_groups(self, mac_addresses):
+        """Get the proximity groups of several devices in a single request.
+
+        The groups are taken from the same version of the groups.
+
+        Returns:
+            * A dictionary of the groups by the mac addresses, e.g.,
+              {'aa:aa:aa:aa:aa:aa': ['bb:bb:bb:bb:bb:bb'],
+               'bb:bb:bb:bb:bb:bb': ['aa:aa:aa:aa:aa:aa']}
+
+        """
+        mac_addresses = list(mac_addresses)
+        if not mac_addresses:
+            return {}
+        response = self._send_request("multi_get_group, " + ",".join(mac_addresses))
+        
+        return dict([(mac_address, self._parse_group(group))
+                     for mac_address, group in zip(mac_addresses, response.split(";"))])
+    
+    def get_version(self):
+        """Get the version of the proximity groups, which changes whenever
+        any group changes."""
+        return int(self._send_request("get_version"))
     
     def flush(self):
         self._send_request("flush")
@@ -69,10 +158,11 @@ class MirriClient(object):
         self.host = settings.MIRRI['HOST']
         self.port = settings.MIRRI['PORT']
         self.base_url = 'http://%s:%s' % (self.host, self.port)
+        self.session_pool = get_session_pool('mirri', settings.MIRRI)
     
     def _send_request(self, method, url, **kwargs):
         try:
-            response = requests.request(method, url, **kwargs)
+            response = self.session_pool.request(method, url, **kwargs)
         except requests.ConnectionError:
             raise MirriConnectionError('The connection to Mirri at %s failed' % url)
         except requests.Timeout:
@@ -127,16 +217,42 @@ class MirriNotFoundError(MirriError):
 
 
 
+class _ResponseReader(object):
+    """A file-like object that reads the decoded body of a streamed response.
+
+    The errors of the connection are raised as Caas errors.
+
+    """
+
+    def __init__(self, response, url):
+        self._chunks = response.iter_content(RESPONSE_CHUNK_SIZE)
+        self._url = url
+
+    def read(self, size=-1):
+        try:
+            # A decoder may produce empty chunks before the end of the body
+            for chunk in self._chunks:
+                if chunk:
+                    return chunk
+        except socket.timeout:
+            raise CaasTimeoutError('The reply of Caas at %s timed out' % self._url)
+        except (socket.error, requests.RequestException), e:
+            raise CaasConnectionError('The reply of Caas at %s failed: %s' % (self._url, e))
+        return ''
+
+
 class CaasClient(object):
     
     def __init__(self):
         self.host = settings.CAAS['HOST']
         self.port = settings.CAAS['PORT']
         self.base_url = 'http://%s:%s' % (self.host, self.port)
+        self.session_pool = get_session_pool('caas', settings.CAAS)
+        self.result_cache = get_caas_result_cache()
     
     def _send_request(self, method, url, **kwargs):
         try:
-            response = requests.request(method, url, **kwargs)
+            response = self.session_pool.request(method, url, **kwargs)
         except requests.ConnectionError:
             raise CaasConnectionError('The connection to Caas at %s failed' % url)
         except requests.Timeout:
@@ -146,40 +262,115 @@ class CaasClient(object):
                 raise CaasNotFoundError('Url %s not found for Caas' % url)
             return response
     
-    def _parse_caas_configuration(self, configuration_xml):
-        if configuration_xml == '':
-            logger.debug('CaaS WCRL configuration response was empty!')
-            return None
-                        
-        configurations = []
-        dom = minidom.parseString(configuration_xml)
-            
-        for config in dom.getElementsByTagName('Configuration'):
-                    
-            configuration = { 'roles': [] }
-            #configuration['roleCount'] = config.getAttribute('roleCount')
-
-            for action_node in config.getElementsByTagName('action'):
-                action_name = action_node.getAttribute('name')
-                if action_name != '':
-                    configuration['action_name'] = action_name
-                
-                else:
-                    logger.debug('empty action name in wcrl configuration response!')
-                    return None
-
-                for role_node in action_node.getElementsByTagName('role'):
+    def _iter_caas_configurations(self, configuration_xml):
+        """Parse the configurations of a Caas reply one at a time.
+
+        The reply is parsed incrementally, and the elements of a
+        configuration are discarded after it has been yielded, so the parser
+        uses constant memory regardless of the number of configurations, and
+        the caller can stop early.
+
+        Args:
+            * configuration_xml: The reply as a string or a file-like object.
+
+        Returns:
+            * A generator of configuration dictionaries, e.g.,
+              {'action_name': 'action_Dialog',
+               'roles': [{'role_Dialog_d1': 'id1'}, {'role_Dialog_d2': 'id2'}]}
+
+        Raises:
+            * :class:`CaasReplyParseError`, if the reply is not well-formed
+              or an action has no name.
+
+        """
+        if isinstance(configuration_xml, unicode):
+            configuration_xml = configuration_xml.encode('utf-8')
+        if isinstance(configuration_xml, str):
+            configuration_xml = StringIO(configuration_xml)
+
+        root = None
+        configuration = None
+        # The number of open action elements within the configuration
+        actions = 0
+        try:
+            for event, element in iterparse(configuration_xml, ('start', 'end')):
+                if root is None:
+                    root = element
+
+                if event == 'start':
+                    if element.tag == 'Configuration' and configuration is None:
+                        configuration = {'roles': []}
+                    elif element.tag == 'action' and configuration is not None:
+                        actions += 1
+                        action_name = element.get('name', '')
+                        if action_name == '':
+                            raise CaasReplyParseError('empty action name in wcrl configuration response!')
+                        configuration['action_name'] = unicode(action_name)
+
+                elif element.tag == 'role' and actions:
                     role = {}
-                    for node in role_node.childNodes:
-                        if node.nodeType == node.TEXT_NODE:
-                            role[role_node.getAttribute('name')] = role_node.firstChild.nodeValue
+                    if element.text is not None:
+                        role[unicode(element.get('name', ''))] = unicode(element.text)
                     configuration['roles'].append(role)
-            
-            configurations.append( configuration )
-        
-        return configurations
 
-    
+                elif element.tag == 'action' and actions:
+                    actions -= 1
+
+                elif element.tag == 'Configuration' and configuration is not None:
+                    yield configuration
+                    configuration = None
+                    # Discard the parsed configurations
+                    root.clear()
+
+        except SyntaxError, e:
+            # The parse errors of ElementTree are subclasses of SyntaxError
+            raise CaasReplyParseError('Caas reply is not well-formed: %s' % e)
+
+    def _iter_streamed_configurations(self, response, url, key):
+        """Parse the configurations of a streamed Caas reply one at a time.
+
+        The configurations are put in the result cache with the key, after
+        the reply has been read to the end, unless there are more than
+        CAAS['RESULT_CACHE']['MAX_CONFIGURATIONS'] of them. If the caller
+        stops early, the connection is closed instead of reading the rest of
+        the reply.
+
+        Args:
+            * response: A :class:`requests.Response` object, whose body has
+              not been read.
+            * url: The url of the request.
+            * key: The key of the result cache, or None.
+
+        """
+        if key is not None:
+            max_cached = (settings.CAAS.get('RESULT_CACHE', {})
+                                       .get('MAX_CONFIGURATIONS',
+                                            DEFAULT_MAX_CACHED_CONFIGURATIONS))
+            cached = []
+        else:
+            cached = None
+
+        completed = False
+        try:
+            for configuration in self._iter_caas_configurations(_ResponseReader(response, url)):
+                if cached is not None:
+                    if len(cached) < max_cached:
+                        # The caller may modify the configuration
+                        cached.append(copy.deepcopy(configuration))
+                    else:
+                        cached = None
+                yield configuration
+            completed = True
+        finally:
+            if not completed:
+                # A connection with an unread reply cannot be reused
+                original_response = getattr(response.raw, '_original_response', None)
+                if original_response is not None:
+                    original_response.close()
+
+        if cached is not None:
+            self.result_cache.set(key, cached)
+
     def get_configuration(self, model_name, selections):
         """ Format of selections:
             [{'name': u'isInProximity_aa_aa_aa_aa_aa_aa', 'value': 'yes'}, 
@@ -257,36 +448,80 @@ class CaasClient(object):
     def get_wcrl_configuration(self):
         pass
 
+    def _iter_wcrl_configuration_request(self, model_name, model_format,
+                                         model, selections):
+        # The model and the selections are either strings or iterables of
+        # string chunks. The chunks are escaped one by one, so that the model
+        # is copied only once, when the request body is joined.
+        if isinstance(model, basestring):
+            model = [model]
+        if isinstance(selections, basestring):
+            selections = [selections]
+
+        yield u'<xml>\n<model name="%s" modelFormat="%s">\n' % (escape(model_name),
+                                                             escape(model_format))
+        for chunk in model:
+            yield escape(chunk)
+        yield u'\n</model>\n\n<configuration>\n'
+        for chunk in selections:
+            yield escape(chunk)
+        yield u'\n</configuration>\n</xml>\n'
+
     def upload_and_get_wcrl_configuration(self, model_name, model, selections):
+        """Upload a WCRL model with selections and get the configurations.
+
+        Args:
+            * model_name: The name of the model.
+            * model: The model as a string or an iterable of string chunks.
+            * selections: The selections as a string or an iterable of
+              string chunks.
+
+        Returns:
+            * An iterator of configuration dictionaries, which parses the
+              reply while it is read, or None, if Caas found no
+              configurations. The iterator raises
+              :class:`CaasReplyParseError`, if the reply is empty or not
+              well-formed, and :class:`CaasTimeoutError` or
+              :class:`CaasConnectionError`, if reading the reply fails.
+
+        Raises:
+            * :class:`CaasError`, if the request failed.
+
+        """
         path = '/wcrl'
         url = self.base_url + path
         headers = {'content-type': 'application/xml'}
 
-        ctx_dict = {'model_name': model_name, 'model_format': 'wcrl_lparse', 
-                    'model': model, 'selections': selections}
-        payload = render_to_string('clients/caas/model_configuration_request.xml',
-                                   ctx_dict)
+        payload = u''.join(self._iter_wcrl_configuration_request(model_name,
+                                                                 'wcrl_lparse',
+                                                                 model,
+                                                                 selections))
+
+        # The same model and selections result in the same configurations
+        key = None
+        if self.result_cache is not None:
+            key = self.result_cache.make_key(payload)
+            found, configurations = self.result_cache.get(key)
+            if found:
+                logger.debug('WCRL configuration found in the result cache!')
+                return iter(configurations) if configurations is not None else None
 
         #logger.debug('WCRL configuration request: {0}'.format(payload))
-        # Send request
+        # Send request, the reply is read while it is parsed
         response = self._send_request('post', url, data=payload,
-                                      headers=headers, timeout=10)
+                                      headers=headers, timeout=10,
+                                      prefetch=False)
 
         event_handler.add_event('WCRL configuration request sent to Caas!')
         logger.debug('WCRL configuration request sent to Caas!')
 
         if response.status_code == 200:
-            configurations = self._parse_caas_configuration( response.content )
-
-            if configurations:
-                return configurations
-
-            else:
-                logger.error( "Caas configuration reply could not be parsed.")
-                raise CaasReplyParseError(response.content)
+            return self._iter_streamed_configurations(response, url, key)
 
         elif response.status_code == 204:
             logger.debug( 'No configurations could be found for request' )
+            if self.result_cache is not None:
+                self.result_cache.set(key, None)
             return None
 
         else:
@@ -4,18 +4,125 @@ New classes can be implemented for any configuration models that need
 to be supported.
 
 Exported classes:
+    * :class:`KumbangFragmentCache`: A class for caching the fragments of
+      Kumbang models.
     * :class:`KumbangModelGenerator`: A class for generating Kumbang models.
+    * :class:`WcrlRuleCache`: A class for caching the rules of actions in WCRL
+      models.
+    * :class:`WcrlModelGenerator`: A class for generating WCRL models.
+
+Exported functions:
+    * get_wcrl_rules_version: Get the version of the action definitions.
+    * invalidate_wcrl_rules: Invalidate the cached rules of all actions.
 
 """
 
-from django.db.models import Count
-from django.template.loader import render_to_string
+from django.core.cache import cache
+from django.utils.html import escape
 from itertools import combinations
 import logging
 import re
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+WCRL_RULES_VERSION_KEY = 'core_wcrl_rules_version'
+# The longest relative expiration time memcached supports
+WCRL_RULES_VERSION_TIMEOUT = 60 * 60 * 24 * 30
+# The maximum number of device ids in a query
+DEVICE_QUERY_BATCH_SIZE = 500
+
+
+class KumbangFragmentCache(object):
+    """A class for caching the fragments of Kumbang models.
+
+    A Kumbang model consists of fragments that depend only on the schedule
+    definition, i.e., the header and the action components, and fragments
+    that depend on a single device, i.e., the attributes, constraints,
+    implementations and component of the device. The schedule fragments are
+    cached with the signature of the schedule definition they were rendered
+    from and the device fragments with a key of the mac address of the device
+    and the interfaces it implements. Thus, only new or changed devices have
+    to be rendered, when a model is regenerated.
+
+    Public functions:
+        * get: Get the cached fragments of a schedule.
+        * set: Set the cached fragments of a schedule.
+        * clear: Remove all cached fragments.
+        * get_stats: Get the cache metrics.
+
+    """
+
+    def __init__(self):
+        """Initialize the KumbangFragmentCache."""
+        self._schedules = {}
+        self._lock = threading.Lock()
+        self._stats = {'schedule_hits': 0, 'schedule_misses': 0,
+                       'device_hits': 0, 'device_misses': 0}
+
+    def get(self, schedule_id, signature):
+        """Get the cached fragments of a schedule.
+
+        Args:
+            * schedule_id: The primary key of the schedule.
+            * signature: The signature of the current schedule definition.
+
+        Returns:
+            * A tuple of the schedule fragments and a dictionary of device ids
+              and (device key, device fragments) tuples, or None, if no
+              fragments have been cached for the schedule definition.
+
+        """
+        with self._lock:
+            entry = self._schedules.get(schedule_id)
+            if entry is None or entry[0] != signature:
+                self._stats['schedule_misses'] += 1
+                return None
+            self._stats['schedule_hits'] += 1
+            return entry[1], entry[2]
+
+    def set(self, schedule_id, signature, schedule_fragments,
+            device_fragments, device_hits=0):
+        """Set the cached fragments of a schedule.
+
+        The device fragments replace the previously cached ones, so that the
+        fragments of removed devices are dropped.
+
+        Args:
+            * schedule_id: The primary key of the schedule.
+            * signature: The signature of the schedule definition.
+            * schedule_fragments: A dictionary of schedule fragments.
+            * device_fragments: A dictionary of device ids and (device key,
+              device fragments) tuples.
+            * device_hits: The number of device fragments that were reused.
+
+        """
+        with self._lock:
+            self._schedules[schedule_id] = (signature, schedule_fragments,
+                                            device_fragments)
+            self._stats['device_hits'] += device_hits
+            self._stats['device_misses'] += len(device_fragments) - device_hits
+
+    def clear(self):
+        """Remove all cached fragments."""
+        with self._lock:
+            self._schedules = {}
+
+    def get_stats(self):
+        """Get the cache metrics.
+
+        Returns:
+            * A dictionary containing the number of schedule and device
+              fragment hits and misses.
+
+        """
+        with self._lock:
+            return dict(self._stats)
+
+# The fragment cache shared by all Kumbang model generators
+kumbang_fragment_cache = KumbangFragmentCache()
+
 
 class KumbangModelGenerator(object):
     """A class for generating Kumbang models.
@@ -30,17 +137,22 @@ class KumbangModelGenerator(object):
         * indentation: An integer count of the current indentation level in
           the model.
         * result: A list of strings representing the configuration model.
+        * fragment_cache: The :class:`KumbangFragmentCache` object used to
+          cache the model fragments.
 
     Public functions:
         * generate_configuration_model: Generate a Kumbang configuration model.
 
     """
 
-    def __init__(self):
+    def __init__(self, fragment_cache=None):
         """Initialize the KumbangModelGenerator."""
         self.indent_with = ' ' * 4
         self.indentation = 0
         self.result = []
+        if fragment_cache is None:
+            fragment_cache = kumbang_fragment_cache
+        self.fragment_cache = fragment_cache
 
     def _write(self, string):
         """Append a string to the end of the configuration model.
@@ -55,6 +167,27 @@ class KumbangModelGenerator(object):
             self.result.append(self.indent_with * self.indentation)
         self.result.append(string)
 
+    def _render(self, indentation, func, *args):
+        """Render a fragment of the configuration model.
+
+        Args:
+            * indentation: The indentation level of the fragment.
+            * func: The method that writes the fragment.
+            * args: Positional arguments for the method.
+
+        Returns:
+            * The fragment as a string.
+
+        """
+        result, self.result = self.result, []
+        old_indentation, self.indentation = self.indentation, indentation
+        try:
+            func(*args)
+            return ''.join(self.result)
+        finally:
+            self.result = result
+            self.indentation = old_indentation
+
     def _convert_mac_address(self, mac_address):
         """Convert a mac address to a format that can be used in Kumbang
         models.
@@ -70,7 +203,154 @@ class KumbangModelGenerator(object):
         """
         return mac_address.replace(":", "_")
 
-    def _append_header(self, schedule):
+    def _get_schedule_definition(self, schedule):
+        """Get the definition of a schedule with a constant number of queries.
+
+        Args:
+            * schedule: The :class:`Schedule` object for which the
+              configuration model is generated.
+
+        Returns:
+            * A dictionary containing the actions of the schedule, the lists
+              of interfaces required by the action devices, the precondition
+              methods of the actions, the ids of the methods tested for the
+              trigger devices and for the other devices, and a signature that
+              changes whenever any of them changes.
+
+        """
+        schedule_actions = list(models.ScheduleAction.objects
+                                      .filter(schedule=schedule)
+                                      .order_by('id')
+                                      .values_list('action_id', 'action__name',
+                                                   'trigger_device_id',
+                                                   'trigger_device__parameter_position'))
+        action_ids = [schedule_action[0] for schedule_action in schedule_actions]
+        action_devices = list(models.ActionDevice.objects
+                                    .filter(action__in=action_ids)
+                                    .order_by('id')
+                                    .values_list('id', 'action_id',
+                                                 'parameter_position'))
+        action_device_interfaces = list(models.ActionDeviceInterface.objects
+                                              .filter(action_device__action__in=action_ids)
+                                              .order_by('interface__name')
+                                              .values_list('action_device_id',
+                                                           'interface_id',
+                                                           'interface__name'))
+        precondition_methods = list(models.ActionPreconditionMethod.objects
+                                          .filter(action__in=action_ids)
+                                          .order_by('id')
+                                          .values_list('action_id',
+                                                       'action_device_id',
+                                                       'method_id',
+                                                       'method__name',
+                                                       'method__interface_id'))
+
+        interfaces_by_action_device = {}
+        for action_device_id, interface_id, interface_name in action_device_interfaces:
+            (interfaces_by_action_device.setdefault(action_device_id, [])
+                                        .append((interface_id, interface_name)))
+
+        trigger_device_ids = set()
+        actions = []
+        for (action_id, action_name,
+             trigger_device_id, trigger_position) in schedule_actions:
+            trigger_device_ids.add(trigger_device_id)
+            actions.append({'id': action_id,
+                            'name': action_name,
+                            'trigger_position': trigger_position,
+                            'action_devices': []})
+        actions_by_id = dict([(action['id'], action) for action in actions])
+        for action_device_id, action_id, parameter_position in action_devices:
+            actions_by_id[action_id]['action_devices'].append({
+                    'id': action_device_id,
+                    'parameter_position': parameter_position,
+                    'interfaces': interfaces_by_action_device.get(action_device_id, [])})
+
+        interfaces = []
+        action_methods = []
+        action_method_ids = set()
+        trigger_method_ids = set()
+        devices_method_ids = set()
+        for action in actions:
+            # Get all the interfaces of the devices in the action
+            # precondition parameters and append the list of interfaces to a
+            # list of interface lists
+            for action_device in action['action_devices']:
+                if not action_device['interfaces'] in interfaces:
+                    interfaces.append(action_device['interfaces'])
+
+            # Get all precondition methods that are used in the actions
+            for (precondition_action_id, action_device_id, method_id,
+                 method_name, interface_id) in precondition_methods:
+                if precondition_action_id != action['id']:
+                    continue
+                if not method_id in action_method_ids:
+                    action_method_ids.add(method_id)
+                    action_methods.append((method_id, method_name,
+                                           interface_id))
+                if action_device_id in trigger_device_ids:
+                    trigger_method_ids.add(method_id)
+                else:
+                    devices_method_ids.add(method_id)
+
+        signature = (schedule.name, tuple(schedule_actions),
+                     tuple(action_devices), tuple(action_device_interfaces),
+                     tuple(precondition_methods))
+
+        return {'actions': actions,
+                'interfaces': interfaces,
+                'action_methods': action_methods,
+                'trigger_method_ids': trigger_method_ids,
+                'devices_method_ids': devices_method_ids,
+                'signature': signature}
+
+    def _get_devices(self, interface_lists):
+        """Get the devices that implement any of the interface lists.
+
+        The devices are resolved from the membership matrix in one pass and
+        ordered by the first interface list they implement and then by their
+        primary key.
+
+        Args:
+            * interface_lists: A list of lists of (interface id, interface
+              name) tuples required by the action devices.
+
+        Returns:
+            * A tuple of a list of (device id, mac address) tuples and a
+              dictionary of device ids and sets of the ids of the interfaces
+              in the interface lists that the devices implement.
+
+        """
+        membership_matrix = get_membership_matrix()
+        device_ids, candidates = membership_matrix.resolve_devices(
+                [[interface_id for interface_id, name in interface_list]
+                 for interface_list in interface_lists])
+
+        # Only the mac addresses of the resolved devices are fetched, in
+        # batches that stay below the query parameter limit of SQLite
+        mac_addresses = {}
+        for start in range(0, len(device_ids), DEVICE_QUERY_BATCH_SIZE):
+            mac_addresses.update(models.Device.objects
+                    .filter(id__in=device_ids[start:start + DEVICE_QUERY_BATCH_SIZE])
+                    .values_list('id', 'mac_address'))
+
+        interface_ids = set()
+        for interface_list in interface_lists:
+            for interface_id, name in interface_list:
+                interface_ids.add(interface_id)
+
+        devices = []
+        device_interfaces = {}
+        for device_id in device_ids:
+            if device_id not in mac_addresses:
+                continue
+            devices.append((device_id, mac_addresses[device_id]))
+            device_interfaces[device_id] = (interface_ids &
+                    set(membership_matrix.get_interface_ids(device_id)))
+
+        return devices, device_interfaces
+
+    def _append_header(self, schedule_name):
         """Generate the header of a Kumbang configuration model.
 
         An example of the generated header::
@@ -80,17 +360,17 @@ class KumbangModelGenerator(object):
                 root feature Status
 
         Args:
-            * schedule: The :class:`Schedule` object for which the
+            * schedule_name: The name of the schedule for which the
               configuration model is generated.
 
         """
-        self._write('Kumbang model schedule_%s\n' % schedule.name)
+        self._write('Kumbang model schedule_%s\n' % schedule_name)
         self.indentation += 1
         self._write('root component Schedule\n')
         self._write('root feature Status\n\n\n')
         self.indentation -= 1
 
-    def _append_attributes(self, devices):
+    def _append_attributes(self, device_fragments):
         """Generate the attributes of a Kumbang configuration model.
 
         An example of the generated attributes::
@@ -101,50 +381,48 @@ class KumbangModelGenerator(object):
                                   Trigger_00_00_00_00_00_03 }
 
         Args:
-            * devices: A list of :class:`Device` objects that implement
-              the interfaces used in the actions of the schedule.
+            * device_fragments: A list of the fragment dictionaries of the
+              devices that implement the interfaces used in the actions of
+              the schedule.
 
         """
         self._write('// --- attributes ----------------------------\n\n')
         self._write('attribute type Boolean = { true, false }\n')
 
         device_list = []
-        for device in devices:
-            mac_address = self._convert_mac_address(device.mac_address)
-            device_list.append('Trigger_%s' % mac_address)
+        for fragments in device_fragments:
+            device_list.append(fragments['id'])
         self._write('attribute type ID = { %s }\n\n\n' %
                     ', '.join(device_list))
 
-    def _append_features(self, schedule, devices, action_methods):
+    def _append_features(self, action_methods, device_fragments):
         """Generate the features of a Kumbang configuration model.
 
-        This method only generates the root feature type and calls other
-        methods in order to generate the attributes, constraints and
-        implementations.
+        This method only generates the root feature type and splices in the
+        attributes, constraints and implementations of the devices.
 
         Args:
-            * schedule: The :class:`Schedule` object for which the
-              configuration model is generated.
-            * devices: A list of :class:`Device` objects that implement
-              the interfaces used in the actions of the schedule.
-            * action_methods: A list of :class:`Method` objects used in
-              the actions of the schedule.
+            * action_methods: A list of (method id, method name, interface
+              id) tuples of the methods used in the actions of the schedule.
+            * device_fragments: A list of the fragment dictionaries of the
+              devices that implement the interfaces used in the actions of
+              the schedule.
 
         """
         self._write('// --- features ------------------------------\n\n')
         self._write('feature type Status {\n')
         self.indentation += 1
 
-        self._append_feature_attributes(devices, action_methods)
+        self._append_feature_attributes(device_fragments)
         self.indentation -= 1
-        self._append_feature_constraints(devices)
+        self._append_feature_constraints(device_fragments)
         self.indentation -= 1
-        self._append_feature_implementations(schedule, devices, action_methods)
+        self._append_feature_implementations(action_methods, device_fragments)
 
         self.indentation -= 2
         self._write('}\n\n\n')
 
-    def _append_feature_attributes(self, devices, action_methods):
+    def _append_feature_attributes(self, device_fragments):
         """Generate the feature attributes of a Kumbang configuration model.
 
         An example of the generated feature attributes::
@@ -162,10 +440,9 @@ class KumbangModelGenerator(object):
                 Boolean isInProximity_00_00_00_00_00_01;
 
         Args:
-            * devices: A list of :class:`Device` objects that implement
-              the interfaces used in the actions of the schedule.
-            * action_methods: A list of :class:`Method` objects used in
-              the actions of the schedule.
+            * device_fragments: A list of the fragment dictionaries of the
+              devices that implement the interfaces used in the actions of
+              the schedule.
 
         """
         self._write('attributes\n')
@@ -173,18 +450,30 @@ class KumbangModelGenerator(object):
         self._write('// triggering device\n')
         self._write('ID trigger;\n')
 
-        for device in devices:
-            mac_address = self._convert_mac_address(device.mac_address)
-            self._write('// device %s\n' % mac_address)
+        for fragments in device_fragments:
+            self.result.append(fragments['attributes'])
+
+    def _append_device_attributes(self, mac_address, interface_ids,
+                                  action_methods):
+        """Generate the feature attributes of a single device.
 
-            for method in action_methods:
-                if device.interfaces.filter(pk=method.interface.id).exists():
-                    self._write('Boolean %s_%s;\n' % (method.name,
-                                                      mac_address))
+        Args:
+            * mac_address: The converted mac address of the device.
+            * interface_ids: A set of the ids of the interfaces the device
+              implements.
+            * action_methods: A list of (method id, method name, interface
+              id) tuples of the methods used in the actions of the schedule.
+
+        """
+        self._write('// device %s\n' % mac_address)
 
-            self._write('Boolean isInProximity_%s;\n' % mac_address)
+        for method_id, method_name, interface_id in action_methods:
+            if interface_id in interface_ids:
+                self._write('Boolean %s_%s;\n' % (method_name, mac_address))
 
-    def _append_feature_constraints(self, devices):
+        self._write('Boolean isInProximity_%s;\n' % mac_address)
+
+    def _append_feature_constraints(self, device_fragments):
         """Generate the feature constraints of a Kumbang configuration model.
 
         An example of the generated feature constraints::
@@ -201,22 +490,31 @@ class KumbangModelGenerator(object):
                     not has_instances(Device_00_00_00_00_00_06);
 
         Args:
-            * devices: A list of :class:`Device` objects that implement
-              the interfaces used in the actions of the schedule.
+            * device_fragments: A list of the fragment dictionaries of the
+              devices that implement the interfaces used in the actions of
+              the schedule.
 
         """
         self._write('constraints\n')
         self.indentation += 1
         self._write('// proximities\n')
 
-        for device in devices:
-            mac_address = self._convert_mac_address(device.mac_address)
-            self._write('value(isInProximity_%s) = false => '
-                        'not has_instances(Device_%s);\n' %
-                        (mac_address, mac_address))
+        for fragments in device_fragments:
+            self.result.append(fragments['constraint'])
+
+    def _append_device_constraint(self, mac_address):
+        """Generate the feature constraint of a single device.
+
+        Args:
+            * mac_address: The converted mac address of the device.
+
+        """
+        self._write('value(isInProximity_%s) = false => '
+                    'not has_instances(Device_%s);\n' %
+                    (mac_address, mac_address))
 
-    def _append_feature_implementations(self, schedule,
-                                        devices, action_methods):
+    def _append_feature_implementations(self, action_methods,
+                                        device_fragments):
         """Generate the feature implementations of a Kumbang configuration
         model.
 
@@ -243,97 +541,97 @@ class KumbangModelGenerator(object):
                                     Device_ee_ee_ee_ee_ee_ee);
 
         Args:
-            * schedule: The :class:`Schedule` object for which the
-              configuration model is generated.
-            * devices: A list of :class:`Device` objects that implement
-              the interfaces used in the actions of the schedule.
-            * action_methods: A list of :class:`Method` objects used in
-              the actions of the schedule.
+            * action_methods: A list of (method id, method name, interface
+              id) tuples of the methods used in the actions of the schedule.
+            * device_fragments: A list of the fragment dictionaries of the
+              devices that implement the interfaces used in the actions of
+              the schedule.
 
         """
         self._write('implementation\n')
         self.indentation += 1
 
-        trigger_methods = []
-        devices_methods = []
-
-        # Get the action devices that are the triggers for the actions
-        trigger_devices = []
-        schedule_actions = (models.ScheduleAction
-                                  .objects
-                                  .filter(schedule=schedule))
-        for schedule_action in schedule_actions:
-            trigger_devices.append(schedule_action.trigger_device)
+        for method_id, method_name, interface_id in action_methods:
+            self._write('// status %s\n' % method_name)
 
-        # Get all actions of the schedule
-        actions = schedule.actions.all()
-        for action in actions:
-            # Get all action devices that are listed in the action precondition
-            # as parameters
-            action_devices = action.actiondevice_set.all()
-            for action_device in action_devices:
-                if action_device in trigger_devices:
-                    precondition_methods = (action_device
-                                            .actionpreconditionmethod_set
-                                            .exclude(method__in=trigger_methods))
-                    for precondition_method in precondition_methods:
-                        trigger_methods.append(precondition_method.method)
-                else:
-                    precondition_methods = (action_device
-                                            .actionpreconditionmethod_set
-                                            .exclude(method__in=devices_methods))
-                    for precondition_method in precondition_methods:
-                        devices_methods.append(precondition_method.method)
-
-        for method in action_methods:
-            self._write('// status %s\n' % method.name)
-
-            for device in devices:
-                if device.interfaces.filter(pk=method.interface.id).exists():
-                    mac_address = self._convert_mac_address(device.mac_address)
-                    consequents = []
-                    if method in devices_methods:
-                        consequents.append('not instance_of('
-                                           'component-root.action.devices, '
-                                           'Device_%s)' % mac_address)
-                    if method in trigger_methods:
-                        consequents.append('not instance_of('
-                                           'component-root.action.trigger, '
-                                           'Device_%s)' % mac_address)
-
-                    self._write('not (value(%s_%s) = true) => %s;\n' %
-                                (method.name, mac_address,
-                                 ' and '.join(consequents)))
+            for fragments in device_fragments:
+                if method_id in fragments['implementations']:
+                    self.result.append(fragments['implementations'][method_id])
 
         self._write('// trigger\n')
-        for device in devices:
-            mac_address = self._convert_mac_address(device.mac_address)
-            self._write('value(trigger) = Trigger_%(mac_address)s => '
-                        'instance_of(component-root.action.trigger, '
-                        'Device_%(mac_address)s) and '
-                        'not instance_of(component-root.action.devices, '
-                        'Device_%(mac_address)s);\n' %
-                        {'mac_address': mac_address})
-
-    def _append_components(self, schedule, devices, actions, interfaces):
+        for fragments in device_fragments:
+            self.result.append(fragments['trigger'])
+
+    def _append_device_implementation(self, mac_address, method_name,
+                                      trigger_method, devices_method):
+        """Generate the feature implementation of a method of a single device.
+
+        Args:
+            * mac_address: The converted mac address of the device.
+            * method_name: The name of the method.
+            * trigger_method: True, if the method is tested for a trigger
+              device.
+            * devices_method: True, if the method is tested for other than
+              trigger devices.
+
+        """
+        consequents = []
+        if devices_method:
+            consequents.append('not instance_of('
+                               'component-root.action.devices, '
+                               'Device_%s)' % mac_address)
+        if trigger_method:
+            consequents.append('not instance_of('
+                               'component-root.action.trigger, '
+                               'Device_%s)' % mac_address)
+
+        self._write('not (value(%s_%s) = true) => %s;\n' %
+                    (method_name, mac_address, ' and '.join(consequents)))
+
+    def _append_device_trigger(self, mac_address):
+        """Generate the trigger implementation of a single device.
+
+        Args:
+            * mac_address: The converted mac address of the device.
+
+        """
+        self._write('value(trigger) = Trigger_%(mac_address)s => '
+                    'instance_of(component-root.action.trigger, '
+                    'Device_%(mac_address)s) and '
+                    'not instance_of(component-root.action.devices, '
+                    'Device_%(mac_address)s);\n' %
+                    {'mac_address': mac_address})
+
+    def _append_components(self, schedule_fragments, device_fragments):
         """Generate the components of a Kumbang configuration model.
 
         Args:
-            * schedule: The :class:`Schedule` object for which the
-              configuration model is generated.
-            * devices: A list of :class:`Device` objects that implement
-              the interfaces used in the actions of the schedule.
-            * actions: A list of :class:`Action` objects that are declared
-              in the schedule.
-            * interfaces: A list of :class:`Interface` objects used in
-              the actions of the schedule.
+            * schedule_fragments: A dictionary of the fragments of the
+              schedule.
+            * device_fragments: A list of the fragment dictionaries of the
+              devices that implement the interfaces used in the actions of
+              the schedule.
+
+        """
+        self.result.append(schedule_fragments['components'])
+        for fragments in device_fragments:
+            self.result.append(fragments['component'])
+
+    def _append_schedule_components(self, actions, interfaces):
+        """Generate the components of a Kumbang configuration model that
+        depend only on the schedule.
+
+        Args:
+            * actions: A list of action dictionaries of the actions that are
+              declared in the schedule.
+            * interfaces: A list of lists of (interface id, interface name)
+              tuples used in the actions of the schedule.
 
         """
         self._write('// --- components ----------------------------\n\n')
         self._append_component_root(actions)
-        self._append_component_actions(schedule, actions)
+        self._append_component_actions(actions)
         self._append_component_interfaces(interfaces)
-        self._append_component_devices(devices, interfaces)
 
     def _append_component_root(self, actions):
         """Generate the root component of a Kumbang configuration model.
@@ -347,8 +645,8 @@ class KumbangModelGenerator(object):
             }
 
         Args:
-            * actions: A list of :class:`Action` objects that are declared
-              in the schedule.
+            * actions: A list of action dictionaries of the actions that are
+              declared in the schedule.
 
         """
         self._write('component type Schedule {\n')
@@ -358,13 +656,13 @@ class KumbangModelGenerator(object):
 
         action_names = []
         for action in actions:
-            action_names.append('%s' % action.name)
+            action_names.append('%s' % action['name'])
 
         self._write('(%s) action;\n' % ', '.join(action_names))
         self.indentation -= 2
         self._write('}\n\n')
 
-    def _append_component_actions(self, schedule, actions):
+    def _append_component_actions(self, actions):
         """Generate the subcomponents of a Kumbang configuration model.
 
         In this case, the subcomponents are the actions of a schedule. For
@@ -379,42 +677,31 @@ class KumbangModelGenerator(object):
             }
 
         Args:
-            * schedule: The :class:`Schedule` object for which the
-              configuration model is generated.
-            * actions: A list of :class:`Action` objects that are declared
-              in the schedule.
+            * actions: A list of action dictionaries of the actions that are
+              declared in the schedule.
 
         """
         for action in actions:
-            self._write('component type %s {\n' % action.name)
+            self._write('component type %s {\n' % action['name'])
             self.indentation += 1
             self._write('contains\n')
             self.indentation += 1
 
-            # try else
-            schedule_action = (models.ScheduleAction
-                                     .objects
-                                     .get(schedule=schedule, action=action))
-
-            action_devices = (action.actiondevice_set
-                                    .all()
-                                    .order_by('parameter_position'))
+            action_devices = sorted(action['action_devices'],
+                                    key=lambda action_device:
+                                        action_device['parameter_position'])
             component_action_devices = {}
             for action_device in action_devices:
-                action_device_interfaces = (action_device.interfaces
-                                                         .all()
-                                                         .order_by('name'))
                 component_interface_list = []
                 component_interface_name = ''
-                for action_device_interface in action_device_interfaces:
-                    component_interface_list.append(action_device_interface
-                                                    .name)
-                    component_interface_name += action_device_interface.name
+                for interface_id, interface_name in action_device['interfaces']:
+                    component_interface_list.append(interface_name)
+                    component_interface_name += interface_name
 
                 component_name = ''
                 # If the action device is the trigger
-                if (schedule_action.trigger_device.parameter_position ==
-                    action_device.parameter_position):
+                if (action['trigger_position'] ==
+                    action_device['parameter_position']):
                     component_name = 'trigger'
                 else:
                     component_name = 'devices'
@@ -465,52 +752,103 @@ class KumbangModelGenerator(object):
             abstract component type TalkingDevice {}
 
         Args:
-            * interfaces: A list of :class:`Interface` objects used in
-              the actions of the schedule.
+            * interface_lists: A list of lists of (interface id, interface
+              name) tuples used in the actions of the schedule.
 
         """
         defined_interfaces = []
         for interface_list in interface_lists:
-            for interface in interface_list:
-                if interface.name not in defined_interfaces:
+            for interface_id, interface_name in interface_list:
+                if interface_name not in defined_interfaces:
                     self._write('abstract component type %s {}\n' %
-                                interface.name)
-                    defined_interfaces.append(interface.name)
+                                interface_name)
+                    defined_interfaces.append(interface_name)
         self._write('\n')
 
-    def _append_component_devices(self, devices, interface_lists):
-        """Generate the components for the devices.
+    def _append_component_device(self, mac_address, interface_ids,
+                                 interface_lists):
+        """Generate the component for a single device.
 
         An example of the generated device components::
 
             component type Device_ff_ff_ff_ff_ff_ff extends
                 (CalendarSource, TalkingDevice) {}
-            component type Device_ee_ee_ee_ee_ee_ee extends
-                (CalendarSource, TalkingDevice) {}
             component type Device_00_00_00_00_00_01 extends TalkingDevice {}
-            component type Device_00_00_00_00_00_06 extends TalkingDevice {}
 
         Args:
-            * devices: A list of :class:`Device` objects that implement
-              the interfaces used in the actions of the schedule.
-            * interface_lists: A list of :class:`Interface` objects used in
-              the actions of the schedule.
+            * mac_address: The converted mac address of the device.
+            * interface_ids: A set of the ids of the interfaces the device
+              implements.
+            * interface_lists: A list of lists of (interface id, interface
+              name) tuples used in the actions of the schedule.
 
         """
-        for device in devices:
-            mac_address = self._convert_mac_address(device.mac_address)
-
-            device_interfaces = []
-            for interface_list in interface_lists:
-                for interface in interface_list:
-                    if (interface.name not in device_interfaces and
-                        device.interfaces.filter(pk=interface.id).exists()):
-                        device_interfaces.append(interface.name)
-            device_interface_name = ', '.join(device_interfaces)
-            if len(device_interfaces) > 1:
-                device_interface_name = '(%s)' % device_interface_name
-            self._write('component type Device_%s extends %s {}\n' %
-                        (mac_address, device_interface_name))
+        device_interfaces = []
+        for interface_list in interface_lists:
+            for interface_id, interface_name in interface_list:
+                if (interface_name not in device_interfaces and
+                    interface_id in interface_ids):
+                    device_interfaces.append(interface_name)
+        device_interface_name = ', '.join(device_interfaces)
+        if len(device_interfaces) > 1:
+            device_interface_name = '(%s)' % device_interface_name
+        self._write('component type Device_%s extends %s {}\n' %
+                    (mac_address, device_interface_name))
+
+    def _render_schedule_fragments(self, schedule, definition):
+        """Render the fragments of a model that depend only on the schedule.
+
+        Args:
+            * schedule: The :class:`Schedule` object for which the
+              configuration model is generated.
+            * definition: The schedule definition dictionary.
+
+        Returns:
+            * A dictionary of the header and the schedule components.
+
+        """
+        return {'header': self._render(0, self._append_header, schedule.name),
+                'components': self._render(0, self._append_schedule_components,
+                                           definition['actions'],
+                                           definition['interfaces'])}
+
+    def _render_device_fragments(self, mac_address, interface_ids,
+                                 definition):
+        """Render the fragments of a model that depend on a single device.
+
+        Args:
+            * mac_address: The mac address of the device.
+            * interface_ids: A set of the ids of the interfaces in the
+              schedule definition that the device implements.
+            * definition: The schedule definition dictionary.
+
+        Returns:
+            * A dictionary of the fragments of the device.
+
+        """
+        mac_address = self._convert_mac_address(mac_address)
+
+        implementations = {}
+        for method_id, method_name, interface_id in definition['action_methods']:
+            if interface_id in interface_ids:
+                implementations[method_id] = self._render(
+                        2, self._append_device_implementation, mac_address,
+                        method_name,
+                        method_id in definition['trigger_method_ids'],
+                        method_id in definition['devices_method_ids'])
+
+        return {'id': 'Trigger_%s' % mac_address,
+                'attributes': self._render(2, self._append_device_attributes,
+                                           mac_address, interface_ids,
+                                           definition['action_methods']),
+                'constraint': self._render(2, self._append_device_constraint,
+                                           mac_address),
+                'implementations': implementations,
+                'trigger': self._render(2, self._append_device_trigger,
+                                        mac_address),
+                'component': self._render(0, self._append_component_device,
+                                          mac_address, interface_ids,
+                                          definition['interfaces'])}
 
     def generate_configuration_model(self, schedule):
         """Generate a Kumbang configuration model.
@@ -519,6 +857,10 @@ class KumbangModelGenerator(object):
         given as argument. The configuration model contains all devices
         that implement interfaces present in the actions of the schedule.
 
+        The fragments of the schedule and the devices are taken from the
+        fragment cache, if the schedule definition, the mac address of the
+        device and the interfaces it implements have not changed.
+
         Args:
             * schedule: The :class:`Schedule` object for which the
               configuration model is generated.
@@ -527,85 +869,163 @@ class KumbangModelGenerator(object):
             * A Kumbang model as a string encoded in UTF-8.
 
         """
-        interfaces = []
-        action_methods = []
-        action_method_ids = []
+        definition = self._get_schedule_definition(schedule)
+        devices, device_interfaces = self._get_devices(definition['interfaces'])
+
+        cached = self.fragment_cache.get(schedule.id, definition['signature'])
+        if cached is None:
+            schedule_fragments = self._render_schedule_fragments(schedule,
+                                                                 definition)
+            cached_devices = {}
+        else:
+            schedule_fragments, cached_devices = cached
+
+        device_fragments = []
+        new_cached_devices = {}
+        device_hits = 0
+        for device_id, mac_address in devices:
+            device_key = (mac_address, frozenset(device_interfaces[device_id]))
+            cached_device = cached_devices.get(device_id)
+            if cached_device is not None and cached_device[0] == device_key:
+                fragments = cached_device[1]
+                device_hits += 1
+            else:
+                fragments = self._render_device_fragments(
+                        mac_address, device_interfaces[device_id], definition)
+            new_cached_devices[device_id] = (device_key, fragments)
+            device_fragments.append(fragments)
 
-        # Get all actions of the schedule
-        actions = schedule.actions.all()
-        for action in actions:
-            # Get all action devices that are listed in the action precondition
-            # as parameters
-            action_devices = action.actiondevice_set.all()
-            for action_device in action_devices:
-                # Get all the interfaces of the devices in the action
-                # precondition parameters
-                action_device_interfaces = list(action_device.interfaces
-                                                             .all()
-                                                             .order_by('name'))
-
-                # Append the list of interfaces to a list of interface lists
-                if not action_device_interfaces in interfaces:
-                    interfaces.append(action_device_interfaces)
-#                # Get all the interfaces of the devices in the action
-#                # precondition parameters
-#                # that are not already in the interfaces list
-#                action_device_interfaces = (action_device.interfaces.
-#                                            exclude(name__in=interfaces.keys()))
-#                for action_device_interface in action_device_interfaces:
-#                    interface_name = action_device_interface.name
-#                    interfaces[interface_name] = action_device_interface
+        self.fragment_cache.set(schedule.id, definition['signature'],
+                                schedule_fragments, new_cached_devices,
+                                device_hits)
 
-            # Get all precondition methods that are used in the actions
-            precondition_methods = (action.actionpreconditionmethod_set
-                                          .exclude(method__id__in=action_method_ids))
-            for precondition_method in precondition_methods:
-                if not precondition_method.method.id in action_method_ids:
-                    action_method_ids.append(precondition_method.method.id)
-                    action_methods.append(precondition_method.method)
-            # Get all precondition methods that are used in the actions
-#            precondition_methods = (action.actionpreconditionmethod_set.
-#                                    exclude(method__id__in=action_methods.keys()))
-#            for precondition_method in precondition_methods:
-#                if precondition_method.method.id not in action_methods:
-#                    method_id = precondition_method.method.id
-#                    action_methods[method_id] = precondition_method.method
-
-        device_ids = []
-        devices = []
-        for interface_list in interfaces:
-            # TODO the devices could be given as a parameter to the method
-            devices_tmp = (models.Device
-                                 .objects
-                                 .filter(interfaces__in=interface_list)
-                                 .annotate(num_interfaces=Count('id'))
-                                 .filter(num_interfaces=len(interface_list))
-                                 .exclude(id__in=device_ids))
-            device_ids += devices_tmp.values_list('id', flat=True)
-            devices += list(devices_tmp)
-
-        self._append_header(schedule)
-        self._append_attributes(devices)
-        self._append_features(schedule, devices, action_methods)
-        self._append_components(schedule, devices, actions, interfaces)
-
-        #devices.append({'devices': list(devices_tmp),
-        #                'interfaces': interface_list})
-        # Fetch all devices that implement all the interfaces in the actions of
-        # the schedule
-        # Note that this does not count distinct values
-        #devices = (models.Device.objects.
-        #           filter(interfaces__name__in=interfaces.keys()).
-        #           annotate(num_interfaces=Count('id')).
-        #           filter(num_interfaces=len(interfaces)))
+        self.result.append(schedule_fragments['header'])
+        self._append_attributes(device_fragments)
+        self._append_features(definition['action_methods'], device_fragments)
+        self._append_components(schedule_fragments, device_fragments)
 
         kumbang_model = ''.join(self.result).encode('UTF-8')
-        
+
         return kumbang_model
 
 
+class WcrlRuleCache(object):
+    """A class for caching the rules of actions in WCRL models.
+
+    The rules of an action depend only on the :class:`Action`,
+    :class:`ActionDevice`, :class:`ActionDeviceInterface` and
+    :class:`ActionPreconditionMethod` objects and the names of the methods and
+    interfaces they refer to. The rules are cached with the version of the
+    action definitions, which is incremented, whenever any of these objects
+    is saved or deleted.
+
+    Public functions:
+        * get: Get the cached rules of an action.
+        * set: Set the cached rules of an action.
+        * clear: Remove all cached rules.
+        * get_stats: Get the cache metrics.
+
+    """
+
+    def __init__(self):
+        """Initialize the WcrlRuleCache."""
+        self._rules = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def get(self, action_name, version):
+        """Get the cached rules of an action.
+
+        Args:
+            * action_name: The name of the action.
+            * version: The current version of the action definitions.
+
+        Returns:
+            * A dictionary of the rules of the action, or None, if the rules
+              have not been cached with the version.
+
+        """
+        with self._lock:
+            entry = self._rules.get(action_name)
+            if entry is None or entry[0] != version:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            return entry[1]
+
+    def set(self, action_name, version, rules):
+        """Set the cached rules of an action.
+
+        Args:
+            * action_name: The name of the action.
+            * version: The version of the action definitions the rules were
+              generated from.
+            * rules: A dictionary of the rules of the action.
+
+        """
+        with self._lock:
+            self._rules[action_name] = (version, rules)
+
+    def clear(self):
+        """Remove all cached rules."""
+        with self._lock:
+            self._rules = {}
+
+    def get_stats(self):
+        """Get the cache metrics.
+
+        Returns:
+            * A dictionary containing the number of hits and misses.
+
+        """
+        with self._lock:
+            return dict(self._stats)
+
+# The rule cache shared by all WCRL model generators
+wcrl_rule_cache = WcrlRuleCache()
+
+
+def get_wcrl_rules_version():
+    """Get the version of the action definitions.
+
+    The version is kept in the Django cache, so that a change in one process
+    invalidates the cached rules of the other processes as well.
+
+    Returns:
+        * An integer version.
+
+    """
+    version = cache.get(WCRL_RULES_VERSION_KEY)
+    if version is None:
+        # The version has been evicted or never set, so any cached rules may
+        # be stale
+        version = int(time.time() * 1000)
+        cache.set(WCRL_RULES_VERSION_KEY, version, WCRL_RULES_VERSION_TIMEOUT)
+    return version
+
+
+def invalidate_wcrl_rules(sender=None, **kwargs):
+    """Invalidate the cached rules of all actions.
+
+    This function is connected to the post save and post delete signals of
+    the models the action definitions consist of.
+
+    """
+    try:
+        cache.incr(WCRL_RULES_VERSION_KEY)
+    except ValueError:
+        cache.set(WCRL_RULES_VERSION_KEY, int(time.time() * 1000),
+                  WCRL_RULES_VERSION_TIMEOUT)
+
+
 class WcrlModelGenerator(object):
-    
+
+    def __init__(self, rule_cache=None):
+        """Initialize the WcrlModelGenerator."""
+        if rule_cache is None:
+            rule_cache = wcrl_rule_cache
+        self.rule_cache = rule_cache
+
     def _convert_mac_address(self, mac_address):
         """Convert a mac address to a format that can be used in Wcrl
         models.
@@ -651,209 +1071,547 @@ class WcrlModelGenerator(object):
         return None
     
     
+    def _get_action_input(self, action_name):
+        """Get the roles and preconditions of an action.
+
+        Args:
+            * action_name: The name of the action.
+
+        Returns:
+            * An action dictionary, or None, if the action does not exist.
+
+        """
+        action_dict = {'name': '', 'roles': []}
+
+        try:
+            action = (models.Action
+                      .objects
+                      .get(name=action_name))
+        except models.Action.DoesNotExist:
+            logger.debug('Action {0} does not exist.'
+                         .format(action_name))
+            return None
+
+        action_dict['name'] = action.name
+
+        action_roles = (action.actiondevice_set
+                        .all()
+                        .order_by('parameter_position'))
+        for role in action_roles:
+            role_dict = {'name': '', 'interfaces': [],
+                         'preconditions': []}
+            role_dict['name'] = role.name
+            # Get a list of interface names that the role requires
+            role_dict['interfaces'] = (role.interfaces
+                                       .values_list('name', flat=True))
+
+            preconditions = (role.actionpreconditionmethod_set.all()
+                             .order_by('expression_position'))
+            for precondition in preconditions:
+                precondition_dict = {'interface': '', 'method': '',
+                                     'value': ''}
+                precondition_dict['interface'] = (precondition.method
+                                                  .interface.name)
+                precondition_dict['method'] = (precondition.method
+                                               .name)
+                # TODO: this has to be done better, change the database
+                # structure to allow a value in the precondition table
+                precondition_dict['value'] = 'true'
+
+                role_dict['preconditions'].append(precondition_dict)
+
+            action_dict['roles'].append(role_dict)
+
+        # add device singularity constraints
+        action_dict['constr'] = list( combinations( [i['name'] for i in action_dict['roles']], 2 ) )
+
+        return action_dict
+
+    def _get_device_input(self, configurable_actions):
+        """Get the interfaces of the devices of configurable actions.
+
+        Args:
+            * configurable_actions: A list of configurable action
+              dictionaries.
+
+        Returns:
+            * A list of device dictionaries in the order the devices first
+              appear in the actions.
+
+        """
+        devices = []
+        device_ids = set()
+        membership_matrix = get_membership_matrix()
+        for caction in configurable_actions:
+            for device_id in caction['devices']:
+                if device_id in device_ids:
+                    continue
+                device_ids.add(device_id)
+                device_dict = {}
+                device_dict['id'] = device_id
+                device_dict['interfaces'] = membership_matrix.get_interface_names(device_id)
+                devices.append( device_dict )
+
+        return devices
+
     def _get_model_input(self, configurable_actions):
         model_input = {'actions': [], 'devices':[]}
 
         # bit of a hack to enable support for action-wise configuration
         if type(configurable_actions) != type(list()):
             configurable_actions = [configurable_actions]
-        
 
         for configurable_action in configurable_actions:
-            action_dict = {'name': '', 'roles': []}
-
-            try:
-                action = (models.Action
-                          .objects
-                          .get(name=configurable_action['action']))
-            except models.Action.DoesNotExist:
-                logger.debug('Action {0} does not exist.'
-                             .format(configurable_action['action']))
+            action_dict = self._get_action_input(configurable_action['action'])
+            if action_dict is None:
                 return None
-            else:
-                action_dict['name'] = action.name
-
-                action_roles = (action.actiondevice_set
-                                .all()
-                                .order_by('parameter_position'))
-                for role in action_roles:
-                    role_dict = {'name': '', 'interfaces': [],
-                                 'preconditions': []}
-                    role_dict['name'] = role.name
-                    # Get a list of interface names that the role requires
-                    role_dict['interfaces'] = (role.interfaces
-                                               .values_list('name', flat=True))
-
-                    preconditions = (role.actionpreconditionmethod_set.all()
-                                     .order_by('expression_position'))
-                    for precondition in preconditions:
-                        precondition_dict = {'interface': '', 'method': '',
-                                             'value': ''}
-                        precondition_dict['interface'] = (precondition.method
-                                                          .interface.name)
-                        precondition_dict['method'] = (precondition.method
-                                                       .name)
-                        # TODO: this has to be done better, change the database
-                        # structure to allow a value in the precondition table
-                        precondition_dict['value'] = 'true'
-
-                        role_dict['preconditions'].append(precondition_dict)
-
-                    action_dict['roles'].append(role_dict)
-
-                # add device singularity constraints
-                action_dict['constr'] = list( combinations( [i['name'] for i in action_dict['roles']], 2 ) )
-
-                model_input['actions'].append(action_dict)
-        
-        
-    
+            model_input['actions'].append(action_dict)
+
         # append devices and interfaces
-        for caction in configurable_actions:
-            for device_id in caction['devices']:
-                if filter( lambda x: device_id in x.values(), model_input['devices'] ):
-                    continue
-                else:
-                    device_dict = {}
-                    device_dict['id'] = device_id
-                    device_dict['interfaces'] = models.Device.objects.get(pk=device_id).interfaces.values_list('name', flat=True)
-                    model_input['devices'].append( device_dict )
-    
+        model_input['devices'] = self._get_device_input(configurable_actions)
+
         #logger.debug('model ctx generation, model_input: {0}'.format( model_input ))
 
-        
         return model_input
 
+    def _get_selection_roles(self, action_name):
+        """Get the roles of an action for the configuration selections.
+
+        Args:
+            * action_name: The name of the action.
+
+        Returns:
+            * A list of role dictionaries ordered by the parameter position,
+              or None, if the action does not exist. A role dictionary
+              contains the keys ``name``, ``parameter_position``,
+              ``interfaces`` and ``preconditions``, which is a list of
+              (method id, method name) tuples.
+
+        """
+        try:
+            action = (models.Action
+                      .objects
+                      .get(name=action_name))
+        except models.Action.DoesNotExist:
+            logger.debug('Action {0} does not exist.'
+                         .format(action_name))
+            return None
+
+        roles = []
+        roles_by_id = {}
+        action_roles = (action.actiondevice_set
+                        .order_by('parameter_position')
+                        .values_list('id', 'name', 'parameter_position'))
+        for role_id, name, parameter_position in action_roles:
+            role = {'name': name, 'parameter_position': parameter_position,
+                    'interfaces': [], 'preconditions': []}
+            roles.append(role)
+            roles_by_id[role_id] = role
+
+        role_interfaces = (models.ActionDeviceInterface.objects
+                                 .filter(action_device__action=action)
+                                 .order_by('id')
+                                 .values_list('action_device_id',
+                                              'interface__name'))
+        for role_id, interface_name in role_interfaces:
+            roles_by_id[role_id]['interfaces'].append(interface_name)
+
+        role_preconditions = (models.ActionPreconditionMethod.objects
+                                    .filter(action_device__action=action)
+                                    .order_by('id')
+                                    .values_list('action_device_id',
+                                                 'method_id', 'method__name'))
+        for role_id, method_id, method_name in role_preconditions:
+            roles_by_id[role_id]['preconditions'].append((method_id,
+                                                          method_name))
+
+        return roles
+
     def _get_selection_input(self, configurable_actions):
         selection_input = {'devices': []}
         
         # bit of a hack to enable support for action-wise configuration
         if type(configurable_actions) != type(list()):
             configurable_actions = [configurable_actions]
-        
+
+        # The roles of all actions are fetched first, so that the state values
+        # of all devices can be loaded at once
+        action_roles = []
+        device_ids = set()
+        method_ids = set()
         for configurable_action in configurable_actions:
-            # check for extra parameters, that may or may not affect the state value
-            check_params = False
-            if 'parameters' in configurable_action.keys():
-                check_params = True
+            roles = self._get_selection_roles(configurable_action['action'])
+            if roles is None:
+                return None
+            action_roles.append(roles)
 
+            for device_id in configurable_action['devices']:
+                if device_id not in configurable_action['roles']:
+                    device_ids.add(device_id)
+            for role in roles:
+                for method_id, method_name in role['preconditions']:
+                    method_ids.add(method_id)
+
+        state_values = load_state_value_index(list(device_ids),
+                                              list(method_ids))
+
+        # The candidate devices by their primary keys
+        candidates = {}
+        for configurable_action, roles in zip(configurable_actions,
+                                              action_roles):
             # The devices in the action configuration that have not been
             # assigned to any roles
             unassigned_devices = []
             for device_id in configurable_action['devices']:
                 if device_id not in configurable_action['roles']:
                     unassigned_devices.append(device_id)
-            #logger.debug('Unassigned devices: {0}'.format(unassigned_devices))
-            try:
-                action = (models.Action
-                          .objects
-                          .get(name=configurable_action['action']))
-            except models.Action.DoesNotExist:
-                logger.debug('Action {0} does not exist.'
-                             .format(configurable_action['action']))
-                return None
-            else:
-                action_roles = (action.actiondevice_set
-                                .all()
-                                .order_by('parameter_position'))
-                for role in action_roles:
-                    role_interfaces = (role.interfaces
-                                       .values_list('name', flat=True))
-                            
-                    if not role_interfaces or not role.actionpreconditionmethod_set.exists():
-                        continue
-                    
-                    logger.debug( 'role_interfaces: {0}'.format(role_interfaces) )
-
-                    if configurable_action['roles'][role.parameter_position] != '_anyvalue_':
-                        device_dict = {'role':'role_'+configurable_action['action']+'_'+role.name}
-                        device_dict['id'] = configurable_action['roles'][role.parameter_position]
-                        
-                        logger.debug( 'setting pre-matched role {0} for role: {1}'.format( device_dict['role'], role.name ) )
-                        #device_dict['interfaces'] = role.interfaces.values_list('name',flat=True)
-                        #device = models.Device.objects.get(pk=device_dict['id'])
-                        #state_struct = list(device.statevalue_set
-                        #                    .filter(method__interface__name__in=device_dict['interfaces'])
-                        #                    .values_list('method__name', 'value'))
-                        #device_dict['stateValues'] = map( lambda i: dict(zip(('method','value'),i)),state_struct )
+
+            for role in roles:
+                if not role['interfaces'] or not role['preconditions']:
+                    continue
+
+                logger.debug( 'role_interfaces: {0}'.format(role['interfaces']) )
+
+                if configurable_action['roles'][role['parameter_position']] != '_anyvalue_':
+                    device_dict = {'role':'role_'+configurable_action['action']+'_'+role['name']}
+                    device_dict['id'] = configurable_action['roles'][role['parameter_position']]
+
+                    logger.debug( 'setting pre-matched role {0} for role: {1}'.format( device_dict['role'], role['name'] ) )
+                    selection_input['devices'].append(device_dict)
+                    continue
+
+                for device_id in unassigned_devices:
+                    #already a candidate for different role?
+                    device_dict = candidates.get(device_id)
+                    if device_dict is None:
+                        device_dict = {'id': device_id, 'interfaces': [],
+                                       'stateValues': []}
+                        candidates[device_id] = device_dict
                         selection_input['devices'].append(device_dict)
-                    else:
-                        for device_id in unassigned_devices:
-                            #logger.debug( 'dev_id in unassigned devs: {0}'.format(device_id) )
-                            
-                            device_dict = {'id': '', 'interfaces': [], 'stateValues': []}
-                            update_only = False
-                            
-                            state_struct = []
-                            #already a candidate for different role?
-                            for item in selection_input['devices']:
-                                if device_id in item.values():
-                                    device_dict = item
-                                    update_only = True
-
-                            role_preconditions = role.actionpreconditionmethod_set.all()
-                            device = models.Device.objects.get(pk=device_id)
-                            
-                            for apm in role_preconditions:
-                                try:
-                                    statevalue = device.statevalue_set.get(method__name=apm.method.name,
-                                                                           method__interface__name=apm.method.interface.name)
-                                    
-                                    sv_args = statevalue.statevalueargument_set.values_list('method_parameter__name', 'value')
-                                    
-                                    if sv_args:
-                                        if set(sv_args).issubset(set(configurable_action['parameters'].items())):
-                                            state_struct.append( dict([('method',apm.method.name),('value',statevalue.value)]) )
-                                        else:
-                                            state_struct.append( dict([('method',apm.method.name),('value','false')]) )
-                                    else:
-                                        state_struct.append( dict([('method',apm.method.name),('value',statevalue.value)]) )
-                                except Exception: 
-                                    continue
-                            
-                            
-                            device_dict['stateValues'] += state_struct
-                            
-                            #remove duplicates
-                            device_dict['stateValues'] = [dict(t) for t in set([tuple(d.items()) for d in device_dict['stateValues']])]
-
-                            device_dict['interfaces'] += role_interfaces
-                            device_dict['interfaces'] = list( set(device_dict['interfaces']) )
-                            
-                            device_dict['id'] = device_id
-
-                            if not update_only:
-                                selection_input['devices'].append(device_dict)
-        
+
+                    for method_id, method_name in role['preconditions']:
+                        state_value = state_values.get(device_id, method_id)
+                        if state_value is None:
+                            continue
+
+                        value, arguments = state_value
+                        if arguments:
+                            # A state value with arguments is only true for
+                            # the parameters of the configuration request
+                            if 'parameters' not in configurable_action:
+                                continue
+                            if not set(arguments).issubset(set(configurable_action['parameters'].items())):
+                                value = 'false'
+
+                        state = {'method': method_name, 'value': value}
+                        if state not in device_dict['stateValues']:
+                            device_dict['stateValues'].append(state)
+
+                    for interface_name in role['interfaces']:
+                        if interface_name not in device_dict['interfaces']:
+                            device_dict['interfaces'].append(interface_name)
+
         #logger.debug( 'Selection input: {0}'.format( selection_input ) )
                 
         return selection_input
 
 
-    def generate_configuration_model(self, configurable_actions):
-        ctx_dict = self._get_model_input(configurable_actions)
-        wcrl_model = render_to_string('model_templates/wcrl_model.lp',
-                                      ctx_dict)
-
-        # Fix the indentation caused by django's templates
-        wcrl_model = re.sub(r'^[^\S\n]+', '', wcrl_model, flags=re.MULTILINE)
-        wcrl_model = re.sub(r'\n{2}', '\n', wcrl_model, flags=re.MULTILINE)
-        wcrl_model = re.sub(r'^\n{2,}', '\n', wcrl_model, flags=re.MULTILINE)
-        
-        return wcrl_model
+    def _collapse_blank_lines(self, lines):
+        """Join lines and collapse the runs of blank lines between them.
 
-    def generate_configuration_selections(self, configurable_actions):
+        The runs are collapsed the same way as the indentation of the Django
+        templates, which were earlier used to render the models, was fixed:
+        every pair of newlines is replaced with one newline and then three or
+        more newlines in a row with two newlines (or two or more newlines at
+        the beginning with one newline).
 
-        ctx_dict = self._get_selection_input(configurable_actions)
-        configuration_selections = render_to_string('model_templates/wcrl_selections.lp',
-                                                    ctx_dict)
+        Args:
+            * lines: An iterable of lines without newlines and indentation.
+              An empty string is a blank line.
 
-        # Fix the indentation caused by django's templates
-        configuration_selections = re.sub(r'^[^\S\n]+', '', configuration_selections, flags=re.MULTILINE)
-        configuration_selections = re.sub(r'\n{2}', '\n', configuration_selections, flags=re.MULTILINE)
-        configuration_selections = re.sub(r'^\n{2,}', '\n', configuration_selections, flags=re.MULTILINE)
+        Returns:
+            * A generator of strings, which joined together form the text.
 
-        return configuration_selections
+        """
+        blank_lines = 0
+        started = False
+        for line in lines:
+            if not line:
+                blank_lines += 1
+                continue
+
+            if started:
+                yield '\n' * min((blank_lines + 2) // 2, 2)
+            else:
+                yield '\n' * min((blank_lines + 1) // 2, 1)
+                started = True
+            yield line
+            blank_lines = 0
+
+        if started:
+            yield '\n' * min((blank_lines + 1) // 2, 2)
+        else:
+            yield '\n' * min(blank_lines // 2, 1)
+
+    def _get_action_rules(self, action):
+        """Get the rules of an action in a WCRL model.
+
+        The rules of an action are spread over four sections of the model:
+        the shown roles, the shown predications, the list of actions and the
+        implementation of the action. The lines, including the blank ones,
+        are the lines of the former ``wcrl_model.lp`` template without the
+        indentation, and the values are escaped the same way as in the
+        template.
+
+        Args:
+            * action: An action dictionary as returned by
+              :func:`_get_action_input`.
+
+        Returns:
+            * A dictionary of the sections and lists of lines without
+              newlines.
+
+        """
+        action_name = escape(action['name'])
+        roles = []
+        for role in action['roles']:
+            preconditions = [(escape(precondition['method']),
+                              escape(precondition['value']),
+                              escape(precondition['interface']))
+                             for precondition in role['preconditions']]
+            roles.append((escape(role['name']),
+                          [escape(interface) for interface
+                           in role['interfaces']],
+                          preconditions))
+        pairs = [[escape(name) for name in pair]
+                 for pair in action['constr']]
+
+        show_roles = ['']
+        for role_name, interfaces, preconditions in roles:
+            show_roles.append('')
+            show_roles.append('#show role_%s_%s(X).' % (action_name, role_name))
+        show_roles.append('')
+
+        show_predications = ['']
+        for role_name, interfaces, preconditions in roles:
+            show_predications.append('')
+            for method, value, interface in preconditions:
+                show_predications.append('')
+                show_predications.append('#show %s(X,bl).' % method)
+            show_predications.append('')
+        show_predications.append('')
+
+        actions_list = ['', 'action(action_%s).' % action_name]
+
+        implementation = ['']
+        implementation.append('%%%% %s %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%' % action_name)
+        implementation.append('%%%% there must be %i devices.' % len(roles))
+        for role_name, interfaces, preconditions in roles:
+            implementation.append('')
+            implementation.append('role_%s_%s_device(D) :- %s.' %
+                                  (action_name, role_name,
+                                   ', '.join(['device_%s(D)' % interface
+                                              for interface in interfaces])))
+            implementation.append('1 { role_%(action)s_%(role)s(D) : '
+                                  'role_%(action)s_%(role)s_device(D) } 1 :- '
+                                  'selected(action_%(action)s).\t' %
+                                  {'action': action_name, 'role': role_name})
+        implementation.append('')
+        implementation.append('%% all of the roles must be assigned to '
+                              'different devices')
+        for pair in pairs:
+            implementation.append('')
+            implementation.append(':-%s.' %
+                                  ', '.join(['role_%(action)s_%(role)s(D), '
+                                             'role_%(action)s_%(role)s_device(D)' %
+                                             {'action': action_name,
+                                              'role': role_name}
+                                             for role_name in pair]))
+        implementation.append('')
+        implementation.append('%% predications%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%')
+        for role_name, interfaces, preconditions in roles:
+            implementation.append('')
+            for method, value, interface in preconditions:
+                names = {'action': action_name, 'role': role_name,
+                         'method': method, 'value': value,
+                         'interface': interface}
+                implementation.append('')
+                implementation.append('%(method)s(X,%(value)s) :- '
+                                      'role_%(action)s_%(role)s(X), '
+                                      'device_%(interface)s(X), '
+                                      'selected(action_%(action)s).' % names)
+                implementation.append('')
+                implementation.append(':- %(method)s(X,false), '
+                                      'role_%(action)s_%(role)s(X), '
+                                      'device_%(interface)s(X), '
+                                      'selected(action_%(action)s).' % names)
+                implementation.append('')
+                implementation.append('%(method)s(X,true) :- '
+                                      'not %(method)s(X,false), '
+                                      'device_%(interface)s(X).' % names)
+                implementation.append('%(method)s(X,false) :- '
+                                      'not %(method)s(X,true), '
+                                      'device_%(interface)s(X).' % names)
+            implementation.append('')
+        implementation.append('')
+
+        return {'show_roles': show_roles,
+                'show_predications': show_predications,
+                'actions_list': actions_list,
+                'implementation': implementation}
+
+    def _iter_model_lines(self, action_rules, devices):
+        """Generate the lines of a WCRL model.
+
+        Args:
+            * action_rules: A list of the rule dictionaries of the actions as
+              returned by :func:`_get_action_rules`.
+            * devices: A list of device dictionaries as returned by
+              :func:`_get_device_input`.
+
+        Returns:
+            * A generator of lines without newlines.
+
+        """
+        yield '#hide.'
+        yield '%%action.'
+        yield '#show selected(X).'
+        yield '%%roles.'
+        for rules in action_rules:
+            for line in rules['show_roles']:
+                yield line
+        yield ''
+        yield '%%predications.'
+        for rules in action_rules:
+            for line in rules['show_predications']:
+                yield line
+        yield ''
+        yield ''
+        yield ''
+
+        for rules in action_rules:
+            for line in rules['actions_list']:
+                yield line
+        yield ''
+        yield '%% there must be one selected action'
+        yield '1 { selected(A) : action(A) } 1.'
+        yield ''
+        yield ''
+
+        for rules in action_rules:
+            for line in rules['implementation']:
+                yield line
+        yield ''
+        yield ''
+        yield ''
+
+        for device in devices:
+            device_id = escape(device['id'])
+            yield ''
+            for interface in device['interfaces']:
+                yield ''
+                yield 'device_%s(id%s).' % (escape(interface), device_id)
+            yield ''
+        yield ''
+        yield ''
+        yield ''
+
+    def _iter_selections(self, ctx_dict):
+        """Generate the configuration selections of a WCRL model.
+
+        The selections are the same as rendered with the former
+        ``wcrl_selections.lp`` template.
+
+        Args:
+            * ctx_dict: A dictionary of devices as returned by
+              :func:`_get_selection_input`.
+
+        Returns:
+            * A generator of strings, which joined together form the
+              selections.
+
+        """
+        yield 'compute { '
+        devices = ctx_dict['devices']
+        for i, device in enumerate(devices):
+            device_id = escape(device['id'])
+            if device.get('role'):
+                yield '%s(id%s)' % (escape(device['role']), device_id)
+                if i < len(devices) - 1:
+                    yield ', '
+            else:
+                state_values = device.get('stateValues', [])
+                for j, state in enumerate(state_values):
+                    yield '%s(id%s,%s)' % (escape(state['method']), device_id,
+                                           escape(state['value']))
+                    if j < len(state_values) - 1:
+                        yield ', '
+                if i < len(devices) - 1:
+                    yield ', '
+        yield ' }.\n'
+
+    def iter_configuration_model(self, configurable_actions):
+        """Generate a WCRL configuration model in chunks.
+
+        The rules of the actions are taken from the rule cache, if the
+        action definitions have not changed since they were cached, so that
+        only the device facts are generated for every model.
+
+        Args:
+            * configurable_actions: A configurable action dictionary or a
+              list of them.
+
+        Returns:
+            * A generator of strings, which joined together form the model.
+
+        """
+        # bit of a hack to enable support for action-wise configuration
+        if type(configurable_actions) != type(list()):
+            configurable_actions = [configurable_actions]
+
+        version = get_wcrl_rules_version()
+        action_rules = []
+        for configurable_action in configurable_actions:
+            action_name = configurable_action['action']
+            rules = self.rule_cache.get(action_name, version)
+            if rules is None:
+                action = self._get_action_input(action_name)
+                if action is None:
+                    # An action that does not exist results in a model
+                    # without actions
+                    return self._collapse_blank_lines(
+                            self._iter_model_lines([], []))
+                rules = self._get_action_rules(action)
+                self.rule_cache.set(action_name, version, rules)
+            action_rules.append(rules)
+
+        devices = self._get_device_input(configurable_actions)
+        return self._collapse_blank_lines(self._iter_model_lines(action_rules,
+                                                                 devices))
+
+    def iter_configuration_selections(self, configurable_actions):
+        """Generate the WCRL configuration selections in chunks.
+
+        Args:
+            * configurable_actions: A configurable action dictionary or a
+              list of them.
+
+        Returns:
+            * A generator of strings, which joined together form the
+              selections.
+
+        """
+        ctx_dict = (self._get_selection_input(configurable_actions) or
+                    {'devices': []})
+        return self._iter_selections(ctx_dict)
+
+    def generate_configuration_model(self, configurable_actions):
+        return u''.join(self.iter_configuration_model(configurable_actions))
+
+    def generate_configuration_selections(self, configurable_actions):
+        return u''.join(self.iter_configuration_selections(configurable_actions))
 
-# This has been put here to break a circular import
+# These have been put here to break a circular import
+from core.membership import get_membership_matrix
+from core.snapshots import load_state_value_index
 import models
@@ -0,0 +1,176 @@
+"""This module provides pooled keep-alive HTTP sessions for the upstreams.
+
+The clients in :mod:`core.clients` send every request to CaaS and Mirri
+through a session pool of the upstream instead of calling
+:func:`requests.request`, which opens a new TCP connection for every
+request. A session pool keeps at most ``pool_size`` persistent connections
+to the upstream and lets at most as many requests use them at a time, so
+that the connections are reused instead of new ones being opened for the
+requests that exceed the pool. A request that finds all connections in use
+waits for a free one.
+
+The session pools are shared by all threads in a process.
+
+Exported classes:
+    * :class:`HttpSessionPool`: A class for pooled keep-alive HTTP sessions.
+
+Exported functions:
+    * get_session_pool: Get a shared session pool by the upstream name.
+
+"""
+
+import logging
+import requests
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_TIMEOUT = 10
+DEFAULT_KEEP_ALIVE = True
+
+
+class HttpSessionPool(object):
+    """A class for pooled keep-alive HTTP sessions.
+
+    The response content is read before a request returns, so that the
+    connection is released back to the pool right away.
+
+    Instance attributes:
+        * name: The name of the upstream.
+        * pool_size: The maximum number of connections to the upstream.
+        * timeout: The default timeout of the requests in seconds.
+        * keep_alive: If True, the connections are reused.
+        * session: The :class:`requests.Session` object of the pool.
+
+    Public functions:
+        * request: Send a request through the pool.
+        * get_stats: Get the connection metrics of the pool.
+
+    """
+
+    def __init__(self, name, pool_size=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_TIMEOUT, keep_alive=DEFAULT_KEEP_ALIVE):
+        """Initialize the HttpSessionPool."""
+        self.name = name
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        # The bodies are prefetched by request, see request
+        self.session = requests.session(timeout=timeout,
+                                        config={'pool_maxsize': pool_size,
+                                                'keep_alive': keep_alive})
+        self._slots = threading.Semaphore(pool_size)
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'failed': 0, 'total_wait': 0.0,
+                       'max_wait': 0.0}
+
+    def _record(self, wait, failed):
+        """Record the metrics of a request."""
+        with self._lock:
+            self._stats['requests'] += 1
+            if failed:
+                self._stats['failed'] += 1
+            self._stats['total_wait'] += wait
+            self._stats['max_wait'] = max(self._stats['max_wait'], wait)
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the pool.
+
+        Args:
+            * method: The HTTP method, e.g., 'post'.
+            * url: The url of the request.
+            * kwargs: The keyword arguments of :func:`requests.request`. The
+              timeout of the pool is used, unless a timeout is given. The
+              body is read before the request returns, unless prefetch is
+              False. A streamed body keeps its connection busy, until it has
+              been read to the end, but it does not count against the
+              requests the pool lets run at a time.
+
+        Returns:
+            * A :class:`requests.Response` object.
+
+        Raises:
+            * The exceptions of :func:`requests.request`.
+
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('prefetch', True)
+
+        started_at = time.time()
+        self._slots.acquire()
+        wait = time.time() - started_at
+
+        failed = True
+        try:
+            response = self.session.request(method, url, **kwargs)
+            failed = False
+            return response
+        finally:
+            self._slots.release()
+            self._record(wait, failed)
+
+    def get_stats(self):
+        """Get the connection metrics of the pool.
+
+        Returns:
+            * A dictionary containing the number of requests, failed requests
+              and opened connections, the ratio of the requests that reused a
+              connection, and the total, average and maximum time in seconds
+              the requests waited for a free connection.
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+
+        connections = 0
+        for pool in list(self.session.poolmanager.pools.values()):
+            connections += pool.num_connections
+        stats['connections'] = connections
+
+        requests_sent = stats['requests']
+        stats['reuse_ratio'] = (max(requests_sent - connections, 0) /
+                                float(requests_sent) if requests_sent else 0.0)
+        stats['avg_wait'] = (stats['total_wait'] / requests_sent
+                             if requests_sent else 0.0)
+
+        return stats
+
+
+_session_pools = {}
+_session_pools_lock = threading.Lock()
+
+
+def get_session_pool(name, config=None):
+    """Get a shared session pool by the upstream name.
+
+    The session pool is created on the first call and configured with the
+    settings of the upstream, for instance::
+
+        CAAS = {
+            'HOST': 'localhost',
+            'PORT': 80,
+            'POOL_SIZE': 4,
+            'TIMEOUT': 10,
+            'KEEP_ALIVE': True,
+        }
+
+    Args:
+        * name: The name of the upstream, e.g., 'caas'.
+        * config: The settings dictionary of the upstream.
+
+    Returns:
+        * A :class:`HttpSessionPool` object.
+
+    """
+    with _session_pools_lock:
+        if name not in _session_pools:
+            config = config or {}
+            _session_pools[name] = HttpSessionPool(
+                    name,
+                    pool_size=config.get('POOL_SIZE', DEFAULT_POOL_SIZE),
+                    timeout=config.get('TIMEOUT', DEFAULT_TIMEOUT),
+                    keep_alive=config.get('KEEP_ALIVE', DEFAULT_KEEP_ALIVE))
+
+        return _session_pools[name]
@@ -0,0 +1,89 @@
+from core.membership import MembershipMatrix
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+import random
+import time
+
+def resolve_devices_per_list(device_interfaces, interface_lists):
+    # The previous resolution, which ran one query per interface list and
+    # excluded the devices found with the earlier lists
+    device_ids = []
+    for interface_list in interface_lists:
+        required = set(interface_list)
+        for device_id in sorted(device_interfaces.keys()):
+            if required.issubset(device_interfaces[device_id]) and device_id not in device_ids:
+                device_ids.append(device_id)
+    return device_ids
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+            make_option('--devices',
+                        '-d',
+                        action='store',
+                        type=int,
+                        dest='devices',
+                        default=10000,
+                        help='number of synthetic devices (default 10000)'),
+            make_option('--interfaces',
+                        '-i',
+                        action='store',
+                        type=int,
+                        dest='interfaces',
+                        default=20,
+                        help='number of synthetic interfaces (default 20)'),
+            make_option('--roles',
+                        '-r',
+                        action='store',
+                        type=int,
+                        dest='roles',
+                        default=10,
+                        help='number of synthetic roles (default 10)'),
+            make_option('--seed',
+                        '-s',
+                        action='store',
+                        type=int,
+                        dest='seed',
+                        default=0,
+                        help='random seed of the synthetic data (default 0)'),
+            )
+    help = "Benchmarks the resolution of the candidate devices of roles over synthetic devices."
+    can_import_settings = True
+    
+    def handle(self, *args, **options):
+        num_devices = options.get('devices')
+        num_interfaces = options.get('interfaces')
+        num_roles = options.get('roles')
+        if num_devices < 1 or num_interfaces < 1 or num_roles < 1:
+            raise CommandError('The numbers of devices, interfaces and roles must be positive.')
+        
+        generator = random.Random(options.get('seed'))
+        interface_ids = range(1, num_interfaces + 1)
+        device_interfaces = {}
+        pairs = []
+        for device_id in range(1, num_devices + 1):
+            device_interfaces[device_id] = set(generator.sample(interface_ids, generator.randint(1, min(4, num_interfaces))))
+            for interface_id in device_interfaces[device_id]:
+                pairs.append((device_id, interface_id))
+        interface_lists = [generator.sample(interface_ids, generator.randint(1, min(2, num_interfaces)))
+                           for i in range(num_roles)]
+        
+        self.stdout.write('%i devices, %i device interfaces, %i roles\n' % (num_devices, len(pairs), num_roles))
+        
+        start_time = time.time()
+        matrix = MembershipMatrix.from_pairs(pairs)
+        build_time = time.time() - start_time
+        self.stdout.write('Membership matrix built in %.3f s\n' % build_time)
+        
+        start_time = time.time()
+        device_ids, candidates = matrix.resolve_devices(interface_lists)
+        resolve_time = time.time() - start_time
+        self.stdout.write('Set-algebra resolution: %i devices in %.3f s\n' % (len(device_ids), resolve_time))
+        
+        start_time = time.time()
+        expected_device_ids = resolve_devices_per_list(device_interfaces, interface_lists)
+        per_list_time = time.time() - start_time
+        self.stdout.write('Per interface list resolution: %i devices in %.3f s\n' % (len(expected_device_ids), per_list_time))
+        
+        if device_ids != expected_device_ids:
+            raise CommandError('The resolutions returned different devices.')
+        self.stdout.write('Speedup %.1fx\n' % (per_list_time / max(resolve_time, 1e-6)))
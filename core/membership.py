@@ -0,0 +1,365 @@
+"""This module provides a membership matrix of devices and interfaces.
+
+The configuration model generators have to know repeatedly, whether a device
+implements an interface. Instead of querying the relationships device by
+device, the matrix loads all of them with one query into a boolean NumPy
+array, which has a row for each device and a column for each interface.
+
+The matrix is shared by all generators in a process and cached until a
+:class:`DeviceInterface` object is saved or deleted, an :class:`Interface`
+object is saved or deleted, or a :class:`Device` object is deleted. The
+version of the matrix is kept in the Django cache, so that a change in one
+process invalidates the matrices of the other processes as well.
+
+A change made in a managed transaction may still be rolled back, and the
+other processes may load the matrix before the change is committed. So a
+thread with uncommitted changes does not cache the matrix it loads, and the
+matrix is invalidated once more when the transaction has ended, at the end
+of the request or on the next call of :func:`get_membership_matrix`.
+
+Exported classes:
+    * :class:`MembershipMatrix`: A class for the membership matrix of devices
+      and interfaces.
+
+Exported functions:
+    * get_membership_matrix: Get the shared membership matrix.
+    * invalidate_membership_matrix: Invalidate the shared membership matrix.
+    * invalidate_membership_matrix_after_transaction: Invalidate the shared
+      membership matrix again after a transaction with changes has ended.
+
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+import logging
+import numpy
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'core_membership_matrix_version'
+# The longest relative expiration time memcached supports
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+
+class MembershipMatrix(object):
+    """A class for the membership matrix of devices and interfaces.
+
+    The devices and the interfaces are indexed in the order of their primary
+    keys, so the lookups that return devices return them in a stable order.
+    The interface names of a device are kept in the order of the pairs the
+    matrix was created from.
+
+    Instance attributes:
+        * device_ids: A list of the primary keys of the devices.
+        * interface_ids: A list of the primary keys of the interfaces.
+        * interface_names: A dictionary of interface ids and names.
+        * matrix: A boolean NumPy array of the size
+          ``len(device_ids) x len(interface_ids)``.
+
+    Public functions:
+        * from_pairs: Create a matrix from device-interface pairs.
+        * implements: Check, whether a device implements an interface.
+        * get_interface_ids: Get the interfaces of a device.
+        * get_interface_names: Get the interface names of a device.
+        * get_devices: Get the devices that implement all of the interfaces.
+        * filter_devices: Filter the candidate devices of a role.
+        * resolve_devices: Resolve the candidate devices of all roles.
+
+    """
+
+    def __init__(self, device_ids, interface_ids, matrix,
+                 interface_names=None, device_interfaces=None):
+        """Initialize the MembershipMatrix."""
+        self.device_ids = device_ids
+        self.interface_ids = interface_ids
+        self.interface_names = interface_names or {}
+        self.matrix = matrix
+        self._device_interfaces = device_interfaces or {}
+        self._device_index = dict([(device_id, i) for i, device_id
+                                   in enumerate(device_ids)])
+        self._interface_index = dict([(interface_id, i) for i, interface_id
+                                      in enumerate(interface_ids)])
+        self._device_id_array = numpy.array(device_ids, dtype=numpy.int64)
+
+    @classmethod
+    def from_pairs(cls, pairs, interface_names=None):
+        """Create a matrix from device-interface pairs.
+
+        Args:
+            * pairs: An iterable of (device id, interface id) tuples in the
+              order the interfaces of a device are listed.
+            * interface_names: A dictionary of interface ids and names.
+
+        Returns:
+            * A :class:`MembershipMatrix` object.
+
+        """
+        pairs = list(pairs)
+        device_ids = sorted(set([device_id for device_id, i in pairs]))
+        interface_ids = sorted(set([interface_id for d, interface_id in pairs]))
+        matrix = numpy.zeros((len(device_ids), len(interface_ids)),
+                             dtype=numpy.bool_)
+        device_interfaces = {}
+        for device_id, interface_id in pairs:
+            device_interfaces.setdefault(device_id, []).append(interface_id)
+
+        if pairs:
+            device_index = dict([(device_id, i) for i, device_id
+                                 in enumerate(device_ids)])
+            interface_index = dict([(interface_id, i) for i, interface_id
+                                    in enumerate(interface_ids)])
+            rows = [device_index[device_id] for device_id, i in pairs]
+            columns = [interface_index[interface_id] for d, interface_id
+                       in pairs]
+            matrix[rows, columns] = True
+
+        return cls(device_ids, interface_ids, matrix, interface_names,
+                   device_interfaces)
+
+    def _get_columns(self, interface_ids):
+        """Get the column indexes of interfaces.
+
+        Returns:
+            * A list of column indexes, or None, if any of the interfaces is
+              not implemented by any device.
+
+        """
+        columns = []
+        for interface_id in interface_ids:
+            column = self._interface_index.get(interface_id)
+            if column is None:
+                return None
+            columns.append(column)
+        return columns
+
+    def implements(self, device_id, interface_id):
+        """Check, whether a device implements an interface.
+
+        Args:
+            * device_id: The primary key of the device.
+            * interface_id: The primary key of the interface.
+
+        Returns:
+            * True, if the device implements the interface, otherwise False.
+
+        """
+        row = self._device_index.get(device_id)
+        column = self._interface_index.get(interface_id)
+        if row is None or column is None:
+            return False
+        return bool(self.matrix[row, column])
+
+    def get_interface_ids(self, device_id):
+        """Get the interfaces of a device.
+
+        Args:
+            * device_id: The primary key of the device.
+
+        Returns:
+            * A list of the primary keys of the interfaces the device
+              implements ordered by the primary key.
+
+        """
+        row = self._device_index.get(device_id)
+        if row is None:
+            return []
+        return [self.interface_ids[column] for column
+                in numpy.flatnonzero(self.matrix[row])]
+
+    def get_interface_names(self, device_id):
+        """Get the interface names of a device.
+
+        Args:
+            * device_id: The primary key of the device.
+
+        Returns:
+            * A list of the names of the interfaces the device implements
+              in the order of the pairs, i.e., the order the interfaces were
+              added to the device.
+
+        """
+        return [self.interface_names[interface_id] for interface_id
+                in self._device_interfaces.get(device_id, [])]
+
+    def get_devices(self, interface_ids):
+        """Get the devices that implement all of the interfaces.
+
+        Args:
+            * interface_ids: An iterable of the primary keys of the
+              interfaces.
+
+        Returns:
+            * A list of the primary keys of the devices ordered by the
+              primary key. If no interfaces are given, all devices with at
+              least one interface are returned.
+
+        """
+        columns = self._get_columns(interface_ids)
+        if columns is None:
+            return []
+        mask = self.matrix[:, columns].all(axis=1)
+        return self._device_id_array[mask].tolist()
+
+    def filter_devices(self, device_ids, interface_ids):
+        """Filter the candidate devices of a role.
+
+        Args:
+            * device_ids: A list of the primary keys of the candidate
+              devices.
+            * interface_ids: An iterable of the primary keys of the
+              interfaces the role requires.
+
+        Returns:
+            * A list of the candidate devices that implement all of the
+              interfaces in the order of the candidates.
+
+        """
+        columns = self._get_columns(interface_ids)
+        if columns is None:
+            return []
+
+        # Devices without any interfaces have no row in the matrix
+        rows = numpy.array([self._device_index.get(device_id, -1)
+                            for device_id in device_ids], dtype=numpy.int64)
+        known = rows >= 0
+        mask = numpy.zeros(len(rows), dtype=numpy.bool_)
+        mask[known] = self.matrix[rows[known]][:, columns].all(axis=1)
+        return [device_id for device_id, member in zip(device_ids, mask)
+                if member]
+
+    def resolve_devices(self, interface_lists):
+        """Resolve the candidate devices of all roles at once.
+
+        A device belongs to the candidates of a role, if it implements all
+        of the interfaces the role requires. A role without interfaces has no
+        candidates.
+
+        Args:
+            * interface_lists: A list of lists of the primary keys of the
+              interfaces the roles require.
+
+        Returns:
+            * A tuple of a list of the primary keys of all candidate devices
+              and a list of the candidate lists of the roles. The devices are
+              ordered by the first role they are a candidate of and then by
+              the primary key, the candidates of a role by the primary key.
+
+        """
+        masks = numpy.zeros((len(interface_lists), len(self.device_ids)),
+                            dtype=numpy.bool_)
+        for i, interface_ids in enumerate(interface_lists):
+            columns = self._get_columns(interface_ids)
+            if columns:
+                masks[i] = self.matrix[:, columns].all(axis=1)
+
+        candidates = [self._device_id_array[mask].tolist() for mask in masks]
+        if not len(interface_lists):
+            return [], candidates
+
+        # The index of the first role of every device, which is only
+        # meaningful for the devices that are a candidate of any role
+        first_roles = masks.argmax(axis=0)
+        order = numpy.lexsort((self._device_id_array, first_roles))
+        order = order[masks.any(axis=0)[order]]
+
+        return self._device_id_array[order].tolist(), candidates
+
+
+_matrix = None
+_matrix_version = None
+_matrix_lock = threading.Lock()
+# Whether the thread has changed the memberships in a managed transaction
+_pending = threading.local()
+
+
+def _load_membership_matrix():
+    """Load the membership matrix from the database with one query."""
+    pairs = []
+    interface_names = {}
+    # The interfaces of a device are listed in the order they were added
+    rows = (models.DeviceInterface.objects
+                  .order_by('pk')
+                  .values_list('device_id', 'interface_id', 'interface__name'))
+    for device_id, interface_id, interface_name in rows:
+        pairs.append((device_id, interface_id))
+        interface_names[interface_id] = interface_name
+
+    return MembershipMatrix.from_pairs(pairs, interface_names)
+
+
+def get_membership_matrix():
+    """Get the shared membership matrix.
+
+    The matrix is loaded again, if it has been invalidated after it was
+    loaded.
+
+    Returns:
+        * A :class:`MembershipMatrix` object.
+
+    """
+    global _matrix, _matrix_version
+
+    if getattr(_pending, 'invalidated', False):
+        if transaction.is_managed() and transaction.is_dirty():
+            # The changes of the thread are not committed yet, so the matrix
+            # is loaded for this thread only
+            return _load_membership_matrix()
+        invalidate_membership_matrix_after_transaction()
+
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # The version has been evicted or never set, so any loaded matrix
+        # may be stale
+        version = int(time.time() * 1000)
+        cache.set(VERSION_KEY, version, VERSION_TIMEOUT)
+
+    with _matrix_lock:
+        if _matrix is None or _matrix_version != version:
+            logger.debug('Loading the membership matrix version %s' % version)
+            _matrix = _load_membership_matrix()
+            _matrix_version = version
+        return _matrix
+
+
+def _increment_version():
+    global _matrix
+
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time.time() * 1000), VERSION_TIMEOUT)
+
+    with _matrix_lock:
+        _matrix = None
+
+
+def invalidate_membership_matrix(sender=None, **kwargs):
+    """Invalidate the shared membership matrix.
+
+    This function is connected to the post save and post delete signals of
+    :class:`DeviceInterface` and :class:`Interface` and the post delete
+    signal of :class:`Device`.
+
+    """
+    _increment_version()
+    if transaction.is_managed():
+        _pending.invalidated = True
+
+
+def invalidate_membership_matrix_after_transaction(sender=None, **kwargs):
+    """Invalidate the shared membership matrix again after a transaction with
+    changes has ended.
+
+    The matrices loaded by the other processes before the transaction was
+    committed or by this thread before it was rolled back are dropped. This
+    function is connected to the request finished signal.
+
+    """
+    if getattr(_pending, 'invalidated', False):
+        _pending.invalidated = False
+        _increment_version()
+
+# This has been put here to break a circular import
+import models
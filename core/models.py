@@ -27,12 +27,22 @@ Exported classes:
     * :class:`ActionPreconditionMethod`: A model class for precondition methods
       defined in actions.
 
+Exported functions:
+    * load_proximity_mac_addresses: Get the proximity groups of devices in a
+      single request.
+    * set_proximity_groups: Set the proximity devices of devices in a single
+      request.
+
 """
 
 from core import signals
 from core.clients import ProximityClient, ProximityClientConnectionError
+from core.configuration_models import invalidate_wcrl_rules
+from core.membership import invalidate_membership_matrix, \
+    invalidate_membership_matrix_after_transaction
+from django.core.signals import request_finished
 from django.db import models, transaction
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, post_save
 from events.event import EventHandler
 from django.contrib.auth.models import User
 import logging
@@ -209,6 +219,9 @@ class Device(Base):
             logger.error(e)
             event_handler.add_event(e)
         else:
+            # The loaded group is outdated
+            self.__dict__.pop('_proximity_mac_addresses', None)
+
             true_neighbour_devices = (Device.objects
                                             .filter(mac_address__in=neighbours))
             true_neighbours = []
@@ -216,10 +229,12 @@ class Device(Base):
                 neighbours.remove(device.mac_address)
                 true_neighbours.append(device.mac_address)
 
-            event_handler.add_event(u'%s updated its proximity devices: %r - %r' %
-                                    (self.mac_address,
-                                     true_neighbours,
-                                     neighbours))
+            event_handler.emit('proximity',
+                               u'%s updated its proximity devices: %r - %r',
+                               self.mac_address,
+                               true_neighbours,
+                               neighbours,
+                               device=self.mac_address)
 
     def get_proximity_mac_addresses(self):
         """Get the mac addresses of the proximity devices.
@@ -230,6 +245,10 @@ class Device(Base):
             * None, if the connection to the proximity server failed.
 
         """
+        # The group may have been loaded with the groups of other devices
+        if '_proximity_mac_addresses' in self.__dict__:
+            return self._proximity_mac_addresses
+
         client = ProximityClient()
         try:
             mac_addresses = client.get_group(self.mac_address)
@@ -281,16 +300,82 @@ class Device(Base):
         if not self.id:
             is_new = True
         elif Device.objects.get(id=self.id).is_reserved != self.is_reserved:
-            event_handler.add_event('Device %s set %s' %
-                                    (self.mac_address,
-                                     ('Available', 'Reserved')[self.is_reserved]))
+            event_handler.emit('device',
+                               'Device %s set %s',
+                               self.mac_address,
+                               ('Available', 'Reserved')[self.is_reserved],
+                               device=self.mac_address)
 
         super(Device, self).save(*args, **kwargs)
 
         if is_new:
             self.register_proximity_device()
-            event_handler.add_event(u'%s registered to Kurre' %
-                                    self.mac_address)
+            event_handler.emit('device',
+                               u'%s registered to Kurre',
+                               self.mac_address,
+                               device=self.mac_address)
+
+
+def load_proximity_mac_addresses(devices):
+    """Get the proximity groups of devices in a single request.
+
+    The mac addresses of the proximity devices are stored in the devices, so
+    that their :meth:`Device.get_proximity_mac_addresses`,
+    ``proximity_device_group`` and ``num_proximity_devices`` do not send a
+    request each, e.g., when a list of devices is rendered.
+
+    Args:
+        * devices: An iterable of :class:`Device` objects.
+
+    Returns:
+        * A list of the :class:`Device` objects.
+
+    """
+    devices = list(devices)
+    if not devices:
+        return devices
+
+    client = ProximityClient()
+    try:
+        groups = client.get_groups([device.mac_address for device in devices])
+    except ProximityClientConnectionError, e:
+        logger.error(e)
+        event_handler.add_event(e)
+        groups = {}
+
+    for device in devices:
+        # The devices get None, if the connection failed
+        device._proximity_mac_addresses = groups.get(device.mac_address)
+
+    return devices
+
+
+def set_proximity_groups(groups):
+    """Set the proximity devices of devices in a single request.
+
+    Args:
+        * groups: A dictionary of the neighbouring mac addresses by the mac
+          addresses of the devices, e.g.,
+          {'aa:aa:aa:aa:aa:aa': ['bb:bb:bb:bb:bb:bb'],
+           'cc:cc:cc:cc:cc:cc': []}
+
+    Returns:
+        * True, if the proximity devices were set.
+        * False, if the connection to the proximity server failed.
+
+    """
+    client = ProximityClient()
+    try:
+        client.set_groups(groups)
+    except ProximityClientConnectionError, e:
+        logger.error(e)
+        event_handler.add_event(e)
+        return False
+    else:
+        event_handler.emit('proximity',
+                           u'%i devices updated their proximity devices',
+                           len(groups))
+        return True
 
 
 class DeviceInterface(models.Model):
@@ -343,6 +428,23 @@ class DeviceInterface(models.Model):
 post_delete.connect(signals.update_configuration_models,
                     sender=DeviceInterface)
 
+# Connect the post save and post delete signals of DeviceInterface and
+# Interface and the post delete signal of Device with the invalidation of the
+# membership matrix
+post_save.connect(invalidate_membership_matrix,
+                  sender=DeviceInterface)
+post_delete.connect(invalidate_membership_matrix,
+                    sender=DeviceInterface)
+post_save.connect(invalidate_membership_matrix,
+                  sender=Interface)
+post_delete.connect(invalidate_membership_matrix,
+                    sender=Interface)
+post_delete.connect(invalidate_membership_matrix,
+                    sender=Device)
+# The membership matrix is invalidated again after the transactions of a
+# request have ended
+request_finished.connect(invalidate_membership_matrix_after_transaction)
+
 
 class DataType(Base):
     """A Django model class for data types.
@@ -546,22 +648,29 @@ class StateValue(Base):
             method = u'%s()' % self.method.name
 
         if is_new:
-            event_handler.add_event(u'%s initialized the state value of %s - %s to %s' %
-                                    (self.device.mac_address,
-                                     self.method.interface.name,
-                                     method,
-                                     self.value))
+            event_handler.emit('state_value',
+                               u'%s initialized the state value of %s - %s to %s',
+                               self.device.mac_address,
+                               self.method.interface.name,
+                               method,
+                               self.value,
+                               device=self.device.mac_address)
         else:
-            event_handler.add_event(u'%s updated the state value of %s - %s to %s' %
-                                    (self.device.mac_address,
-                                     self.method.interface.name,
-                                     method,
-                                     self.value))
+            event_handler.emit('state_value',
+                               u'%s updated the state value of %s - %s to %s',
+                               self.device.mac_address,
+                               self.method.interface.name,
+                               method,
+                               self.value,
+                               device=self.device.mac_address)
 
         schedules = self._is_triggering()
         if schedules:
-            event_handler.add_event('Device %s triggered configuration' %
-                                    self.device.mac_address)
+            event_handler.emit('configuration',
+                               'Device %s triggered configuration',
+                               self.device.mac_address,
+                               device=self.device.mac_address,
+                               schedule=','.join([schedule.name for schedule in schedules]))
             logger.debug('Device %s triggered configuration' %
                          self.device.mac_address)
             signals.state_triggered.send(sender=self,
@@ -708,6 +817,9 @@ class Schedule(Base):
         * configuration_model_file: A Django `FileField
           <django.db.models.FileField>` object for storing the configuration
           model file that contains the configuration model for the schedule.
+        * configuration_model_digest: A Django `CharField
+          <django.db.models.CharField>` object for storing the SHA-1 digest of
+          the configuration model last sent to Caas.
         * schedule_file: A Django `FileField
           <django.db.models.FileField>` object for storing the schedule file
           that defines the schedule.
@@ -725,6 +837,8 @@ class Schedule(Base):
                                                 max_length=100,
                                                 null=True,
                                                 blank=True)
+    configuration_model_digest = models.CharField(max_length=40, blank=True,
+                                                  editable=False)
     schedule_file = models.FileField(upload_to='schedules',
                                      max_length=100,
                                      null=True,
@@ -961,3 +1075,10 @@ class ActionParameter(Base):
     def __unicode__(self):
         return u"{0} - {1}".format(self.action.name,
                                    self.name)
+
+# Connect the post save and post delete signals of the models the action
+# definitions consist of with the invalidation of the cached WCRL rules
+for sender in (Interface, Method, Action, ActionDevice, ActionDeviceInterface,
+               ActionPreconditionMethod):
+    post_save.connect(invalidate_wcrl_rules, sender=sender)
+    post_delete.connect(invalidate_wcrl_rules, sender=sender)
@@ -0,0 +1,280 @@
+"""This module provides pooled persistent connections to the proximity server.
+
+The :class:`core.clients.ProximityClient` sends the requests over the framed
+protocol of :mod:`proximity.protocol` through a connection pool of the
+server instead of opening a new TCP connection for every request. A
+connection pool keeps at most ``pool_size`` persistent connections to the
+server and lets at most as many requests use them at a time. A request that
+finds all connections in use waits for a free one. Several requests can be
+pipelined over a connection, so that they take a single round trip.
+
+The connection pools are shared by all threads in a process.
+
+Exported classes:
+    * :class:`ProximityConnection`: A class for framed proximity server
+      connections.
+    * :class:`ProximityConnectionPool`: A class for pooled proximity server
+      connections.
+
+Exported functions:
+    * get_connection_pool: Get a shared connection pool by the server
+      address.
+
+"""
+
+from proximity.protocol import (HANDSHAKE_SIZE, VERSION, FrameDecoder,
+                                ProtocolError, encode_frame, make_handshake,
+                                parse_handshake)
+import socket
+import threading
+import time
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_TIMEOUT = 10
+RECV_SIZE = 65536
+
+
+class ProximityConnection(object):
+    """A class for framed proximity server connections.
+
+    Instance attributes:
+        * host: The host of the proximity server.
+        * port: The port of the proximity server.
+        * timeout: The timeout of the socket operations in seconds.
+        * requests: The number of requests sent over the connection.
+
+    Public functions:
+        * connect: Connect and handshake with the server.
+        * request: Send pipelined requests and receive their replies.
+        * close: Close the connection.
+
+    """
+
+    def __init__(self, host, port, timeout=DEFAULT_TIMEOUT):
+        """Initialize the ProximityConnection."""
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.requests = 0
+        self._socket = None
+        self._decoder = FrameDecoder()
+
+    def connect(self):
+        """Connect and handshake with the server.
+
+        Raises:
+            * :class:`socket.error`, if the connection failed.
+            * :class:`proximity.protocol.ProtocolError`, if the server does
+              not support the protocol version.
+
+        """
+        self._socket = socket.create_connection((self.host, self.port),
+                                                self.timeout)
+        self._socket.sendall(make_handshake())
+        data = ''
+        while len(data) < HANDSHAKE_SIZE:
+            chunk = self._socket.recv(HANDSHAKE_SIZE - len(data))
+            if not chunk:
+                raise ProtocolError('The server closed the connection during the handshake')
+            data += chunk
+        version = parse_handshake(data)
+        if version != VERSION:
+            raise ProtocolError('The server does not support the protocol version %i' % VERSION)
+
+    def request(self, payloads):
+        """Send pipelined requests and receive their replies.
+
+        Args:
+            * payloads: A list of the requests as strings.
+
+        Returns:
+            * A list of the replies as strings in the order of the requests.
+
+        Raises:
+            * :class:`socket.error`, if the connection failed.
+            * :class:`proximity.protocol.ProtocolError`, if the server closed
+              the connection before replying.
+
+        """
+        self._socket.sendall(''.join([encode_frame(payload) for payload in payloads]))
+        self.requests += len(payloads)
+
+        replies = []
+        while len(replies) < len(payloads):
+            data = self._socket.recv(RECV_SIZE)
+            if not data:
+                raise ProtocolError('The server closed the connection before replying')
+            replies.extend(self._decoder.feed(data))
+        return replies
+
+    def close(self):
+        """Close the connection."""
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class ProximityConnectionPool(object):
+    """A class for pooled proximity server connections.
+
+    A connection that fails is closed instead of being returned to the pool.
+    If a reused connection fails, e.g., because the server was restarted,
+    the requests are retried once over a new connection.
+
+    Instance attributes:
+        * host: The host of the proximity server.
+        * port: The port of the proximity server.
+        * pool_size: The maximum number of connections to the server.
+        * timeout: The timeout of the socket operations in seconds.
+
+    Public functions:
+        * request: Send pipelined requests through the pool.
+        * get_stats: Get the connection metrics of the pool.
+
+    """
+
+    def __init__(self, host, port, pool_size=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_TIMEOUT):
+        """Initialize the ProximityConnectionPool."""
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle = []
+        self._slots = threading.Semaphore(pool_size)
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'failed': 0, 'connections': 0,
+                       'total_wait': 0.0, 'max_wait': 0.0}
+
+    def _record(self, requests, wait, failed):
+        """Record the metrics of pipelined requests."""
+        with self._lock:
+            self._stats['requests'] += requests
+            if failed:
+                self._stats['failed'] += requests
+            self._stats['total_wait'] += wait
+            self._stats['max_wait'] = max(self._stats['max_wait'], wait)
+
+    def _new_connection(self):
+        connection = ProximityConnection(self.host, self.port, self.timeout)
+        try:
+            connection.connect()
+        except (socket.error, ProtocolError):
+            connection.close()
+            raise
+        with self._lock:
+            self._stats['connections'] += 1
+        return connection
+
+    def _request(self, connection, payloads):
+        try:
+            replies = connection.request(payloads)
+        except (socket.error, ProtocolError):
+            connection.close()
+            raise
+        with self._lock:
+            self._idle.append(connection)
+        return replies
+
+    def request(self, payloads):
+        """Send pipelined requests through the pool.
+
+        Args:
+            * payloads: A list of the requests as strings.
+
+        Returns:
+            * A list of the replies as strings in the order of the requests.
+
+        Raises:
+            * :class:`socket.error`, if the connection failed.
+            * :class:`proximity.protocol.ProtocolError`, if the server
+              violated the protocol.
+
+        """
+        started_at = time.time()
+        self._slots.acquire()
+        wait = time.time() - started_at
+
+        failed = True
+        try:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+
+            if connection is not None:
+                try:
+                    replies = self._request(connection, payloads)
+                    failed = False
+                    return replies
+                except socket.timeout:
+                    # The server may still be executing the requests
+                    raise
+                except (socket.error, ProtocolError):
+                    pass
+
+            replies = self._request(self._new_connection(), payloads)
+            failed = False
+            return replies
+        finally:
+            self._slots.release()
+            self._record(len(payloads), wait, failed)
+
+    def get_stats(self):
+        """Get the connection metrics of the pool.
+
+        Returns:
+            * A dictionary containing the number of requests, failed requests
+              and opened connections, the ratio of the requests that reused a
+              connection, and the total, average and maximum time in seconds
+              the requests waited for a free connection.
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+
+        requests_sent = stats['requests']
+        stats['reuse_ratio'] = (max(requests_sent - stats['connections'], 0) /
+                                float(requests_sent) if requests_sent else 0.0)
+        stats['avg_wait'] = (stats['total_wait'] / requests_sent
+                             if requests_sent else 0.0)
+
+        return stats
+
+
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(host, port, config=None):
+    """Get a shared connection pool by the server address.
+
+    The connection pool is created on the first call and configured with the
+    settings of the server, for instance::
+
+        PROXIMITY_SERVER = {
+            'default': {
+                'HOST': 'localhost',
+                'PORT': 50007,
+                'PROTOCOL': 'framed',
+                'POOL_SIZE': 4,
+                'TIMEOUT': 10,
+            },
+        }
+
+    Args:
+        * host: The host of the proximity server.
+        * port: The port of the proximity server.
+        * config: The settings dictionary of the server.
+
+    Returns:
+        * A :class:`ProximityConnectionPool` object.
+
+    """
+    with _connection_pools_lock:
+        if (host, port) not in _connection_pools:
+            config = config or {}
+            _connection_pools[(host, port)] = ProximityConnectionPool(
+                    host, port,
+                    pool_size=config.get('POOL_SIZE', DEFAULT_POOL_SIZE),
+                    timeout=config.get('TIMEOUT', DEFAULT_TIMEOUT))
+
+        return _connection_pools[(host, port)]
@@ -1,45 +1,251 @@
+"""This module provides recommenders for choosing among configurations.
+
+A recommender consumes the configurations of a Caas reply as an iterator
+and ranks each of them with a policy as it arrives. The best configuration
+is chosen at random among the ones with the highest rank in a single pass
+with reservoir sampling, and the K best configurations are kept in a heap,
+so neither needs the configurations sorted or held in memory.
+
+Exported classes:
+    * :class:`Recommender`: A class for recommending configurations.
+    * :class:`DefaultPolicy`: A policy that ranks configurations by the
+      number of roles.
+    * :class:`WeightedPolicy`: A policy that ranks configurations by a
+      weighted sum of criteria.
+    * :class:`ProximityCriterion`: A criterion for the share of the role
+      devices in the proximity of the triggering device.
+    * :class:`RecentUsageCriterion`: A criterion for the recent usage of the
+      action of a configuration.
+
+Exported functions:
+    * role_count: A criterion for the number of roles of a configuration.
+
+"""
+
+import heapq
 import logging
 import random
 logging.getLogger(__name__)
 
 
 class Recommender:
+    """A class for recommending configurations.
+
+    Instance attributes:
+        * policy: The policy that ranks the configurations.
+        * selector: The way the recommended configuration is chosen among
+          the configurations with the highest rank.
+        * random: The random number generator used by the selector.
+
+    Public functions:
+        * recommend: Recommend a configuration.
+        * recommend_top: Get the configurations with the highest ranks.
+        * getPolicy: Get the policy of the recommender.
+
+    """
     RANDOM_SELECT = 1
-    
-    def __init__(self, policy=None, selector=None):
-        self.policy = policy or DefaultPolicy()   
+
+    def __init__(self, policy=None, selector=None, random_state=None):
+        self.policy = policy or DefaultPolicy()
         self.selector = selector or self.RANDOM_SELECT
-        
-    def recommend( self, configurations ):
-        if self.policy:
-            ranked = self.policy.evaluate(configurations)
+        self.random = random_state or random
 
-            if self.selector == Recommender.RANDOM_SELECT:
-                max_rank = ranked[0]['rank']
-                return random.choice( [conf for conf in ranked if conf['rank']==max_rank] )
-        else:
+    def _iter_ranked(self, configurations):
+        """Rank the configurations one at a time.
+
+        The rank is stored in the ``rank`` key of the configuration.
+
+        """
+        if not self.policy:
             raise RecommenderException('Recommender has no policy')
-        
+
+        for configuration in configurations:
+            configuration['rank'] = self.policy.score(configuration)
+            yield configuration
+
+    def recommend( self, configurations ):
+        """Recommend a configuration.
+
+        The configuration is chosen at random among the configurations with
+        the highest rank in O(N) time and constant memory.
+
+        Args:
+            * configurations: An iterable of configuration dictionaries.
+
+        Returns:
+            * The recommended configuration dictionary.
+
+        Raises:
+            * :class:`RecommenderException`, if the recommender has no policy
+              or there are no configurations.
+
+        """
+        if self.selector != Recommender.RANDOM_SELECT:
+            raise RecommenderException('Unknown selector {0}'.format(self.selector))
+
+        selected = None
+        max_rank = None
+        ties = 0
+        for configuration in self._iter_ranked(configurations):
+            rank = configuration['rank']
+            if max_rank is None or rank > max_rank:
+                selected = configuration
+                max_rank = rank
+                ties = 1
+            elif rank == max_rank:
+                # Reservoir sampling keeps every tie selected with the
+                # probability 1 / ties
+                ties += 1
+                if self.random.randint(1, ties) == 1:
+                    selected = configuration
+
+        if selected is None:
+            raise RecommenderException('No configurations to recommend')
+        return selected
+
+    def recommend_top( self, configurations, k ):
+        """Get the configurations with the highest ranks.
+
+        The configurations are kept in a heap of size K, which takes
+        O(N log K) time and O(K) memory. The configurations with the same
+        rank are kept in the order they arrived in.
+
+        Args:
+            * configurations: An iterable of configuration dictionaries.
+            * k: The maximum number of configurations to return.
+
+        Returns:
+            * A list of at most K configuration dictionaries ordered by the
+              rank from the highest, or an empty list, if K is not positive.
+
+        """
+        if k <= 0:
+            return []
+
+        heap = []
+        for i, configuration in enumerate(self._iter_ranked(configurations)):
+            # The earlier of equally ranked configurations wins
+            item = (configuration['rank'], -i, configuration)
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, item)
+
+        return [configuration for rank, i, configuration
+                in sorted(heap, key=lambda item: item[:2], reverse=True)]
+
     def getPolicy( self ):
         if self.policy:
             return self.policy
         else:
             raise RecommenderException('Recommender has no policy')
-        
+
 class RecommenderException(Exception):
     pass
-    
+
+
+def role_count(configuration):
+    """A criterion for the number of roles of a configuration."""
+    return len(configuration.get('roles', []))
+
+
 class DefaultPolicy:
     def __init__(self):
         pass
 
     def _order_by_rank( self, configurations ):
         return sorted( configurations, key = lambda c: c['rank'], reverse=True )
-    
+
+    def score(self, configuration):
+        return role_count(configuration)
+
     def evaluate(self, configurations):
-        
+
         for configuration in configurations:
             if 'roles' in configuration.keys():
-                configuration['rank'] = len(configuration['roles'])
-        
+                configuration['rank'] = self.score(configuration)
+
         return self._order_by_rank( configurations )
+
+
+class WeightedPolicy(DefaultPolicy):
+    """A policy that ranks configurations by a weighted sum of criteria.
+
+    A criterion is a callable that takes a configuration dictionary and
+    returns a number. A negative weight prefers the configurations with a
+    low value of the criterion.
+
+    Instance attributes:
+        * criteria: A list of (weight, criterion) tuples.
+
+    Public functions:
+        * score: Get the rank of a configuration.
+
+    """
+
+    def __init__(self, criteria):
+        self.criteria = criteria
+
+    def score(self, configuration):
+        """Get the rank of a configuration.
+
+        Args:
+            * configuration: A configuration dictionary.
+
+        Returns:
+            * The weighted sum of the criteria.
+
+        """
+        return sum([weight * criterion(configuration)
+                    for weight, criterion in self.criteria])
+
+
+def _get_role_device_ids(configuration):
+    """Get the primary keys of the devices assigned to the roles."""
+    device_ids = []
+    for role in configuration.get('roles', []):
+        for value in role.values():
+            try:
+                device_ids.append(int(value.replace('id', '')))
+            except (AttributeError, ValueError):
+                pass
+    return device_ids
+
+
+class ProximityCriterion(object):
+    """A criterion for the share of the role devices in the proximity of the
+    triggering device.
+
+    Instance attributes:
+        * device_ids: A set of the primary keys of the devices in the
+          proximity.
+
+    """
+
+    def __init__(self, device_ids):
+        self.device_ids = set(device_ids)
+
+    def __call__(self, configuration):
+        device_ids = _get_role_device_ids(configuration)
+        if not device_ids:
+            return 0.0
+        in_proximity = [device_id for device_id in device_ids
+                        if device_id in self.device_ids]
+        return len(in_proximity) / float(len(device_ids))
+
+
+class RecentUsageCriterion(object):
+    """A criterion for the recent usage of the action of a configuration.
+
+    Instance attributes:
+        * usage: A dictionary of action names, e.g., 'Dialog', and the number
+          of times the action has been used recently.
+
+    """
+
+    def __init__(self, usage):
+        self.usage = usage
+
+    def __call__(self, configuration):
+        action_name = configuration.get('action_name', '').replace('action_', '')
+        return self.usage.get(action_name, 0)
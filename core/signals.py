@@ -1,11 +1,16 @@
-from core.tasks import generate_model, start_configuration_task
+from core.tasks import generate_model, regenerate_model, \
+    start_configuration_task
+from core.workers import get_worker_pool, WorkerPoolFullError, \
+    CoalescingScheduler
+from django.conf import settings
 from django.db import transaction
 from django.dispatch import Signal
+from events.event import EventHandler
 import core.models
 import logging
-import threading
 
 logger = logging.getLogger(__name__)
+event_handler = EventHandler()
 
 state_triggered = Signal(providing_args=["device", "schedules"])
 schedule_added = Signal(providing_args=["schedule"])
@@ -14,24 +19,41 @@ schedule_added = Signal(providing_args=["schedule"])
 device_interface_added = Signal(providing_args=["device", "interface"])
 #device_interface_deleted = Signal(providing_args=["device", "interface"])
 
+# Collapses the model regenerations caused by device interface changes
+model_regeneration_scheduler = CoalescingScheduler(
+        getattr(settings, 'CONFIGURATION_MODELS', {}).get('REGENERATION_WINDOW', 10))
+
+
+def _submit_task(task, *args):
+    """Submit a task from :mod:`core.tasks` to the shared worker pool."""
+    try:
+        get_worker_pool().submit(task, *args)
+    except WorkerPoolFullError, e:
+        logger.error(e)
+        event_handler.add_event(u'Task was not started: %s' % e)
 
 def start_configuration(sender, **kwargs):
-    t = threading.Thread(target=start_configuration_task, args=(kwargs['device'], kwargs['schedules'],))
-    t.start()
+    _submit_task(start_configuration_task, kwargs['device'], kwargs['schedules'])
 
 def generate_configuration_model(sender, **kwargs):
-    t = threading.Thread(target=generate_model, args=(kwargs['schedule'],))
-    t.start()
-    #GenerateConfigurationModelThread(kwargs['schedule']).start()
+    _submit_task(generate_model, kwargs['schedule'])
 
 def update_configuration_models(sender, **kwargs):
-    # A new thread could also be done for the update of all models...
-    schedules = core.models.Schedule.objects.all()
+    # Sent either by device_interface_added or by the post delete signal of
+    # DeviceInterface
+    if 'interface' in kwargs:
+        interface_id = kwargs['interface'].id
+    else:
+        interface_id = kwargs['instance'].interface_id
+    
+    # Only the schedules with actions that use the interface are affected
+    schedule_ids = (core.models.Schedule.objects
+                    .filter(actions__actiondevice__interfaces__id=interface_id)
+                    .distinct()
+                    .values_list('id', flat=True))
     
-    for schedule in schedules:
-        t = threading.Thread(target=generate_model, args=(schedule,))
-        t.start()
-        #GenerateConfigurationModelThread(schedule).start()
+    for schedule_id in schedule_ids:
+        model_regeneration_scheduler.schedule(schedule_id, regenerate_model, schedule_id)
 
 def delete_files(sender, instance, **kwargs):
     if isinstance(instance, core.models.Interface):
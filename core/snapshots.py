@@ -0,0 +1,333 @@
+"""This module provides snapshots of the data needed for configurations.
+
+A configuration of a schedule needs the actions of the schedule, the action
+devices and their interfaces, the precondition methods and their parameters,
+and the state values and state value arguments of all candidate devices.
+Instead of querying these row by row while the configuration selections are
+built, a snapshot loads them with a constant number of bulk queries and
+indexes them in dictionaries.
+
+Exported classes:
+    * :class:`ConfigurationSnapshot`: A class for the in-memory snapshot of
+      the configuration data of schedules.
+    * :class:`StateValueIndex`: A class for the in-memory index of the state
+      values of devices.
+
+Exported functions:
+    * load_configuration_snapshot: Load a configuration snapshot for a list
+      of schedules.
+    * load_state_value_index: Load the state values of devices.
+
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigurationSnapshot(object):
+    """A class for the in-memory snapshot of the configuration data of
+    schedules.
+
+    Instance attributes:
+        * methods: A dictionary of interface names and lists of the ids of the
+          precondition methods of the interface used in the actions. An
+          interface without precondition methods has an empty list.
+        * method_names: A dictionary of method ids and method names.
+        * devices: A list of :class:`Device` objects that implement any of
+          the interfaces in ``methods``.
+        * action_devices: A dictionary of action names and lists of action
+          device dictionaries ordered by parameter position. An action device
+          dictionary contains the keys ``id``, ``name``, ``is_trigger``,
+          ``interfaces`` and ``precondition_method_ids``.
+        * method_parameters: A dictionary of method ids and lists of the ids
+          of their method parameters.
+        * true_state_values: A set of (device id, method id) tuples, for
+          which the state value is True.
+        * state_value_arguments: A dictionary of (device id, method parameter
+          id) tuples and state value argument values.
+
+    Public functions:
+        * get_device: Get a snapshot device by its mac address.
+        * get_action_devices: Get the action devices of an action.
+        * get_selections: Get the configuration selections.
+        * get_argument_values: Get the state value arguments of a device.
+
+    """
+
+    def __init__(self):
+        """Initialize the ConfigurationSnapshot."""
+        self.methods = {}
+        self.method_names = {}
+        self.devices = []
+        self.action_devices = {}
+        self.method_parameters = {}
+        self.true_state_values = set()
+        self.state_value_arguments = {}
+        self._devices_by_mac_address = {}
+
+    def get_device(self, mac_address):
+        """Get a snapshot device by its mac address.
+
+        Args:
+            * mac_address: A mac address string, e.g., aa:bb:cc:dd:ee:ff.
+
+        Returns:
+            * A :class:`Device` object, or None if the device is not in the
+              snapshot.
+
+        """
+        return self._devices_by_mac_address.get(mac_address)
+
+    def get_action_devices(self, action_name):
+        """Get the action devices of an action ordered by parameter position.
+
+        Args:
+            * action_name: The name of the action.
+
+        Returns:
+            * A list of action device dictionaries.
+
+        """
+        return self.action_devices.get(action_name, [])
+
+    def get_selections(self, proximity_devices):
+        """Get the configuration selections of the snapshot devices.
+
+        Args:
+            * proximity_devices: A list of :class:`Device` objects that are in
+              the proximity of the triggering device, including itself.
+
+        Returns:
+            * A list of selection dictionaries, e.g.,
+              [{'name': 'isInProximity_aa_aa_aa_aa_aa_aa', 'value': 'true'},
+               {'name': 'isWilling_aa_aa_aa_aa_aa_aa', 'value': 'false'}]
+
+        """
+        proximity_device_ids = set([device.id for device in proximity_devices])
+
+        selections = []
+        for device in self.devices:
+            mac_address = device.mac_address.replace(":", "_")
+            attribute_name = 'isInProximity_%s' % mac_address
+            value = "true" if device.id in proximity_device_ids else "false"
+            selections.append({'name': attribute_name, 'value': value})
+
+            for interface in self.methods.keys():
+                for m in self.methods[interface]:
+                    attribute_name = '%s_%s' % (self.method_names[m],
+                                                mac_address)
+                    value = ("true" if (device.id, m) in self.true_state_values
+                             else "false")
+                    selections.append({'name': attribute_name,
+                                       'value': value})
+
+        return selections
+
+    def get_argument_values(self, action_device, device):
+        """Get the state value arguments of a device for an action device.
+
+        The arguments are ordered by the expression position of the
+        precondition methods of the action device.
+
+        Args:
+            * action_device: An action device dictionary.
+            * device: The :class:`Device` object assigned to the action
+              device.
+
+        Returns:
+            * A list of state value argument values.
+
+        """
+        argument_values = []
+        for method_id in action_device['precondition_method_ids']:
+            for parameter_id in self.method_parameters.get(method_id, []):
+                try:
+                    argument_values.append(
+                            self.state_value_arguments[(device.id,
+                                                        parameter_id)])
+                except KeyError:
+                    logger.error('State value argument for method parameter '
+                                 '%i does not exist for device %s' %
+                                 (parameter_id, device.mac_address))
+
+        return argument_values
+
+
+def load_configuration_snapshot(schedules):
+    """Load a configuration snapshot for a list of schedules.
+
+    The snapshot is loaded with at most nine queries regardless of the number
+    of schedules, actions, methods or devices.
+
+    Args:
+        * schedules: A list of :class:`Schedule` objects.
+
+    Returns:
+        * A :class:`ConfigurationSnapshot` object.
+
+    """
+    snapshot = ConfigurationSnapshot()
+    schedule_ids = [schedule.id for schedule in schedules]
+
+    action_ids = set(models.ScheduleAction.objects
+                           .filter(schedule__in=schedule_ids)
+                           .values_list('action_id', flat=True))
+
+    action_device_rows = (models.ActionDevice.objects
+                                .filter(action__in=action_ids)
+                                .order_by('action', 'parameter_position')
+                                .values_list('id', 'name', 'action__name'))
+    action_devices = {}
+    for action_device_id, name, action_name in action_device_rows:
+        action_device = {'id': action_device_id, 'name': name,
+                         'is_trigger': False, 'interfaces': [],
+                         'precondition_method_ids': []}
+        action_devices[action_device_id] = action_device
+        snapshot.action_devices.setdefault(action_name, []).append(action_device)
+
+    # An action device that is the trigger of any schedule action
+    trigger_device_ids = (models.ScheduleAction.objects
+                                .filter(trigger_device__in=action_devices.keys())
+                                .values_list('trigger_device_id', flat=True))
+    for action_device_id in trigger_device_ids:
+        action_devices[action_device_id]['is_trigger'] = True
+
+    action_device_interfaces = (models.ActionDeviceInterface.objects
+                                      .filter(action_device__in=action_devices.keys())
+                                      .order_by('interface__name')
+                                      .values_list('action_device_id',
+                                                   'interface__name'))
+    for action_device_id, interface_name in action_device_interfaces:
+        action_devices[action_device_id]['interfaces'].append(interface_name)
+
+    precondition_methods = (models.ActionPreconditionMethod.objects
+                                  .filter(action__in=action_ids)
+                                  .order_by('action', 'expression_position')
+                                  .values_list('action_device_id', 'method_id',
+                                               'method__name',
+                                               'method__interface__name'))
+    for (action_device_id, method_id,
+         method_name, interface_name) in precondition_methods:
+        action_devices[action_device_id]['precondition_method_ids'].append(method_id)
+        snapshot.method_names[method_id] = method_name
+        interface_methods = snapshot.methods.setdefault(interface_name, [])
+        if method_id not in interface_methods:
+            interface_methods.append(method_id)
+
+    # Fill with interfaces, which have no precondition methods
+    for action_device in action_devices.values():
+        for interface_name in action_device['interfaces']:
+            if interface_name not in snapshot.methods:
+                logger.debug('appending empty (no precond. methods interface '
+                             'with name: %s to the methods structure' %
+                             interface_name)
+                snapshot.methods[interface_name] = []
+
+    method_ids = snapshot.method_names.keys()
+    method_parameters = (models.MethodParameter.objects
+                               .filter(method__in=method_ids)
+                               .order_by('id')
+                               .values_list('id', 'method_id'))
+    for parameter_id, method_id in method_parameters:
+        snapshot.method_parameters.setdefault(method_id, []).append(parameter_id)
+
+    snapshot.devices = list(models.Device.objects
+                                  .filter(interfaces__name__in=snapshot.methods.keys())
+                                  .distinct()
+                                  .order_by('id'))
+    device_ids = []
+    for device in snapshot.devices:
+        device_ids.append(device.id)
+        snapshot._devices_by_mac_address[device.mac_address] = device
+
+    snapshot.true_state_values = set(models.StateValue.objects
+                                           .filter(device__in=device_ids,
+                                                   method__in=method_ids,
+                                                   value="True")
+                                           .values_list('device_id',
+                                                        'method_id'))
+
+    parameter_ids = []
+    for parameters in snapshot.method_parameters.values():
+        parameter_ids.extend(parameters)
+    state_value_arguments = (models.StateValueArgument.objects
+                                   .filter(state_value__device__in=device_ids,
+                                           method_parameter__in=parameter_ids)
+                                   .values_list('state_value__device_id',
+                                                'method_parameter_id',
+                                                'value'))
+    for device_id, parameter_id, value in state_value_arguments:
+        snapshot.state_value_arguments[(device_id, parameter_id)] = value
+
+    return snapshot
+
+
+class StateValueIndex(object):
+    """A class for the in-memory index of the state values of devices.
+
+    Public functions:
+        * get: Get the state value of a device for a method.
+
+    """
+
+    def __init__(self):
+        """Initialize the StateValueIndex."""
+        self._state_values = {}
+
+    def get(self, device_id, method_id):
+        """Get the state value of a device for a method.
+
+        Args:
+            * device_id: The primary key of the device.
+            * method_id: The primary key of the method.
+
+        Returns:
+            * A tuple of the value and a list of (method parameter name,
+              value) tuples of the state value arguments, or None, if the
+              device has no state value for the method.
+
+        """
+        return self._state_values.get((device_id, method_id))
+
+
+def load_state_value_index(device_ids, method_ids):
+    """Load the state values of devices.
+
+    The state values and their arguments are loaded with two queries
+    regardless of the number of devices and methods.
+
+    Args:
+        * device_ids: A list of the primary keys of the devices.
+        * method_ids: A list of the primary keys of the methods.
+
+    Returns:
+        * A :class:`StateValueIndex` object.
+
+    """
+    index = StateValueIndex()
+    if not device_ids or not method_ids:
+        return index
+
+    state_values = (models.StateValue.objects
+                          .filter(device__in=device_ids, method__in=method_ids)
+                          .values_list('id', 'device_id', 'method_id', 'value'))
+    state_value_keys = {}
+    for state_value_id, device_id, method_id, value in state_values:
+        index._state_values[(device_id, method_id)] = (value, [])
+        state_value_keys[state_value_id] = (device_id, method_id)
+
+    if state_value_keys:
+        arguments = (models.StateValueArgument.objects
+                           .filter(state_value__in=state_value_keys.keys())
+                           .order_by('id')
+                           .values_list('state_value_id',
+                                        'method_parameter__name', 'value'))
+        for state_value_id, parameter_name, value in arguments:
+            key = state_value_keys[state_value_id]
+            index._state_values[key][1].append((parameter_name, value))
+
+    return index
+
+# This has been put here to break a circular import
+import models
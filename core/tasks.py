@@ -2,16 +2,45 @@ from core.clients import MirriClient, MirriConnectionError, MirriTimeoutError, \
     MirriNotFoundError, CaasClient, CaasConnectionError, CaasTimeoutError, \
     CaasNotFoundError, CaasInternalServerError
 from core.configuration_models import KumbangModelGenerator, WcrlModelGenerator
+from core.snapshots import load_configuration_snapshot
 from django.core.files.base import ContentFile
 from events.event import EventHandler
 from profiler.decorators import profile
 from kurre.settings import *
+import hashlib
 import logging
 import models
+import string
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 event_handler = EventHandler()
 
+# The numbers of configuration models sent to Caas and of the unchanged ones
+# that were skipped
+_model_upload_stats = {'sent': 0, 'skipped': 0}
+_model_upload_stats_lock = threading.Lock()
+
+
+def get_model_upload_stats():
+    """Get the numbers of sent and skipped configuration model uploads.
+
+    Returns:
+        * A dictionary containing the number of configuration models sent to
+          Caas and the number of unchanged ones that were skipped.
+
+    """
+    with _model_upload_stats_lock:
+        return dict(_model_upload_stats)
+
+
+def _count_model_upload(result):
+    """Count a sent or skipped configuration model upload."""
+    with _model_upload_stats_lock:
+        _model_upload_stats[result] += 1
+
+
 @profile
 def start_kumbang_configuration_task(device, schedules):
     logger.debug( "Starting configuration: self.schedules: %r" % (schedules) )
@@ -23,34 +52,15 @@ def start_kumbang_configuration_task(device, schedules):
     #for sched in self.schedules:
     #    kbser.generateModel( sched )
 
-    # Get the precondition methods that are related to the actions in the schedules        
-    # Requires optimization
-    methods = {}               
-    for sched in schedules:          
-        actions = sched.actions.all() #scheduleaction_set.filter(schedule=sched) #models.ScheduleAction.objects.filter( schedule = sched )
-        for act in actions:
-            apm = models.ActionPreconditionMethod.objects.filter(action = act)
-
-            for a in apm:
-                if not a.method.interface.name in methods:
-                    methods[a.method.interface.name] = [a.method.id]
-                elif not a.method.id in methods[a.method.interface.name]:
-                    methods[a.method.interface.name].append(a.method.id)
-        
-        for act in actions:
-            #fill with interfaces, which have no precondition methods
-            action_devices = act.actiondevice_set.all()
-            for action_device in action_devices:
-                action_device_interfaces = list(action_device.interfaces.all())
-                for adi in action_device_interfaces:
-                    if not adi.name in methods.keys():
-                        logger.debug("appending empty (no precond. methods interface with nane: %s to the methods structure" %adi.name)
-                        methods[adi.name] = []
+    # Load everything the configuration needs with a constant number of
+    # queries
+    snapshot = load_configuration_snapshot(schedules)
+    methods = snapshot.methods
     
     event_handler.add_event(u'Configuration methods %s' % (str(methods)))
     logger.debug(u'Aquired configuration methods: %r' % str(methods))
 
-    devices = list(set(models.Device.objects.filter(interfaces__name__in=methods.keys()))) #.annotate(num_interfaces=Count('id')).filter(num_interfaces<=len(methods.keys()))
+    devices = snapshot.devices
 
     event_handler.add_event(u'Configuration devices: %s' % str(devices))
     logger.debug(u'Configuration devices: %r' % devices)
@@ -63,32 +73,33 @@ def start_kumbang_configuration_task(device, schedules):
     
     # Get the selections for the configuration
     configuration_model_name = ''
-    selections = []
     
     for schedule in schedules:
         configuration_model_name += schedule.configuration_model_name
     
-    for device in devices:
-        mac_address = device.mac_address.replace(":", "_")
-        attribute_name = 'isInProximity_%s' % mac_address
-        value = "true" if device in prox_devices else "false"
-        selections.append({'name': attribute_name, 'value': value})
-        
-        for interface in methods.keys():
-            for m in methods[interface]:
-                attribute_name = '%s_%s' % (models.Method.objects.get(id=m).name, mac_address)
-                value = "true" if models.StateValue.objects.filter(device=device.id, method=m, value="True").exists() else "false"
-                selections.append({'name': attribute_name, 'value': value})
+    selections = snapshot.get_selections(prox_devices)
+    
+    # The loops below reuse the name of the triggering device
+    trigger_mac_address = device.mac_address
     
     # Send configuration selections to Caas
     client = CaasClient()
+    started_at = time.time()
     try:
         response = client.get_configuration(configuration_model_name, selections)
     except (CaasConnectionError, CaasTimeoutError, CaasNotFoundError, CaasInternalServerError), e:
         logger.error('The request to Caas failed: %s' % e)
-        event_handler.add_event('The request to Caas failed: %s' % e)
+        event_handler.add_event('The request to Caas failed: %s' % e,
+                                category='configuration',
+                                device=trigger_mac_address,
+                                schedule=configuration_model_name,
+                                duration=time.time() - started_at)
     else:
-        event_handler.add_event('Configuration request for model %s with selections %r sent to Caas' % (configuration_model_name, selections))
+        event_handler.add_event('Configuration request for model %s with selections %r sent to Caas' % (configuration_model_name, selections),
+                                category='configuration',
+                                device=trigger_mac_address,
+                                schedule=configuration_model_name,
+                                duration=time.time() - started_at)
         configuration = response
     
         logger.debug(configuration)
@@ -100,28 +111,20 @@ def start_kumbang_configuration_task(device, schedules):
         
         device_list = []
         for device in configuration['devices']:
-            try:
-                device_obj = models.Device.objects.get(mac_address=device['mac_address'])
-            except models.Device.DoesNotExist:
-                logger.error('Device %s does not exist' % mac_address)
+            device_obj = snapshot.get_device(device['mac_address'])
+            if device_obj is None:
+                logger.error('Device %s does not exist' % device['mac_address'])
             else:
                 device_list.append({'device_obj': device_obj, 'interfaces': device['interfaces'], 'trigger': device['trigger']})
         
-        action_devices = models.ActionDevice.objects.filter(action__name=action_name).order_by('parameter_position')
-        for action_device in action_devices:
-            trigger_device = False
-            action_device_interfaces = None
-            
-            if action_device.scheduleaction_set.all().exists():
-                trigger_device = True
-            else:
-                action_device_interfaces = action_device.interfaces.all()
+        for action_device in snapshot.get_action_devices(action_name):
+            trigger_device = action_device['is_trigger']
                 
             for i, device in enumerate(device_list):
                 implements_all_interfaces = True
                 if not trigger_device:
-                    for action_device_interface in action_device_interfaces:
-                        if action_device_interface.name not in device['interfaces']:
+                    for action_device_interface in action_device['interfaces']:
+                        if action_device_interface not in device['interfaces']:
                             implements_all_interfaces = False
                             break
                         
@@ -135,21 +138,8 @@ def start_kumbang_configuration_task(device, schedules):
                         device_interfaces.append(interface_name)
                     mirri_payload.append({'deviceIdentity': device_obj.mac_address, 'deviceName': device_obj.name, 'interfaceNames': device_interfaces})
                     
-                    parameters = []
                     # Fetch possible state value parameters
-                    precondition_methods = action_device.actionpreconditionmethod_set.all().order_by('expression_position')
-                    for precondition_method in precondition_methods:
-                        method_parameters = precondition_method.method.methodparameter_set.all()
-                        for method_parameter in method_parameters:
-                            parameters.append(method_parameter)
-                    
-                    for parameter in parameters:
-                        try:
-                            state_value_argument = models.StateValueArgument.objects.get(method_parameter=parameter, state_value__device=device_obj)
-                        except models.StateValueArgument.DoesNotExist, e:
-                            logger.error(e)
-                        else:
-                            argument_values.append(state_value_argument.value)
+                    argument_values.extend(snapshot.get_argument_values(action_device, device_obj))
                     break
         
         mirri_payload.extend(argument_values)
@@ -163,21 +153,32 @@ def start_kumbang_configuration_task(device, schedules):
             
             # Send post to Mirri
             client = MirriClient()
+            started_at = time.time()
             try:
                 response = client.start_action(action_name, init_parameters, body_parameters)
             except (MirriConnectionError, MirriTimeoutError, MirriNotFoundError), e:
                 logger.error('The request to Mirri failed: %s' % e)
-                event_handler.add_event('The request to Mirri failed: %s' % e)
+                event_handler.add_event('The request to Mirri failed: %s' % e,
+                                        category='action',
+                                        device=trigger_mac_address,
+                                        action=action_name,
+                                        duration=time.time() - started_at)
             else:
                 #set devices as reseved
 #                action_devices = models.Device.objects.filter(mac_address__in=mirri_payload['device_ids'].keys())
 #                for dev in action_devices:
 #                    dev.is_reserved = True
 #                    dev.save()
-                event_handler.add_event('Action %s sent to Mirri' % action_name)
+                event_handler.add_event('Action %s sent to Mirri' % action_name,
+                                        category='action',
+                                        device=trigger_mac_address,
+                                        action=action_name,
+                                        duration=time.time() - started_at)
                 logger.debug(response)
         else:
-            event_handler.add_event(u'No action was started' )
+            event_handler.add_event(u'No action was started',
+                                    category='action',
+                                    device=trigger_mac_address)
             logger.debug('No action was started')
 
     logger.debug( 'Configuration thread done' )
@@ -192,7 +193,7 @@ def start_configuration_task(device, schedules):
     if clang == 'wcrl':
         logger.error( 'NOT IMPLEMENTED')
     else:
-        start_kumbang_configuration_task(device, schedule)
+        start_kumbang_configuration_task(device, schedules)
         
             
             
@@ -216,12 +217,23 @@ def generate_model(schedule):
     except Exception, e:
         logger.error(e)
     else:
+        # Neither the file is written nor the model sent, if the model is
+        # identical to the one last sent to Caas
+        digest = hashlib.sha1(model.encode('utf-8') if isinstance(model, unicode)
+                              else model).hexdigest()
+        if digest == schedule.configuration_model_digest and schedule.configuration_model_file:
+            logger.debug('Configuration model %s has not changed' % schedule.name)
+            _count_model_upload('skipped')
+            return
+
         try:
             schedule.configuration_model_file.save('%s%s' % (schedule.name, model_suffix), ContentFile(model))
             schedule.configuration_model_name = schedule.name
             schedule.save()
             
-            event_handler.add_event(u'%s model generated for schedule %s' % (string.capitalize(clang), schedule.name))
+            event_handler.add_event(u'%s model generated for schedule %s' % (string.capitalize(clang), schedule.name),
+                                    category='schedule',
+                                    schedule=schedule.name)
         except Exception, e:
             logger.error(e)
         else:
@@ -231,6 +243,36 @@ def generate_model(schedule):
                 client.upload_configuration_model(schedule.name, model)
             except (CaasConnectionError, CaasTimeoutError, CaasNotFoundError, CaasInternalServerError), e:
                 logger.error('The request to Caas failed: %s' % e)
-                event_handler.add_event('The request to Caas failed: %s' % e)
+                event_handler.add_event('The request to Caas failed: %s' % e,
+                                        category='schedule',
+                                        schedule=schedule.name)
             else:
                 logger.debug('Configuration model %s sent to Caas' % schedule.name)
+                _count_model_upload('sent')
+
+                # The digest is stored only after Caas has received the model,
+                # so that a failed upload is retried with the same model. The
+                # update does not send the signals of the schedule.
+                schedule.configuration_model_digest = digest
+                (models.Schedule.objects
+                       .filter(pk=schedule.pk)
+                       .update(configuration_model_digest=digest))
+
+
+
+def regenerate_model(schedule_id):
+    """Regenerate the configuration model of a schedule.
+
+    The schedule is fetched from the database, so that the model is generated
+    from its current state, even if the regeneration has been delayed.
+
+    Args:
+        * schedule_id: The primary key of the :class:`Schedule` object.
+
+    """
+    try:
+        schedule = models.Schedule.objects.get(pk=schedule_id)
+    except models.Schedule.DoesNotExist:
+        logger.debug('Schedule %i no longer exists' % schedule_id)
+    else:
+        generate_model(schedule)
@@ -5,4 +5,23 @@ from core.tests.device_statevalue_api import *
 from core.tests.proximity_client import *
 from core.tests.interface_file_api import *
 from core.tests.action_file_api import *
-from core.tests.schedule_file_api import *
\ No newline at end of file
+from core.tests.schedule_file_api import *
+from core.tests.worker_pool import *
+from core.tests.model_regeneration import *
+from core.tests.configuration_snapshot import *
+from core.tests.kumbang_model import *
+from core.tests.membership_matrix import *
+from core.tests.wcrl_emitter import *
+from core.tests.wcrl_rule_cache import *
+from core.tests.selection_input import *
+from core.tests.http_sessions import *
+from core.tests.configuration_fanout import *
+from core.tests.caas_result_cache import *
+from core.tests.model_upload import *
+from core.tests.caas_reply_parser import *
+from core.tests.recommender import *
+from core.tests.proximity_registry import *
+from core.tests.proximity_groups import *
+from core.tests.proximity_protocol import *
+from core.tests.proximity_batch import *
+from core.tests.proximity_eventloop import *
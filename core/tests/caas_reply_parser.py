@@ -0,0 +1,83 @@
+from core.clients import CaasClient, CaasReplyParseError
+from django.test import TestCase
+from xml.dom import minidom
+import random
+
+def parse_with_minidom(configuration_xml):
+    # The former parsing of the Caas replies
+    configurations = []
+    dom = minidom.parseString(configuration_xml)
+    for config in dom.getElementsByTagName('Configuration'):
+        configuration = {'roles': []}
+        for action_node in config.getElementsByTagName('action'):
+            action_name = action_node.getAttribute('name')
+            if action_name == '':
+                return None
+            configuration['action_name'] = action_name
+            for role_node in action_node.getElementsByTagName('role'):
+                role = {}
+                for node in role_node.childNodes:
+                    if node.nodeType == node.TEXT_NODE:
+                        role[role_node.getAttribute('name')] = role_node.firstChild.nodeValue
+                configuration['roles'].append(role)
+        configurations.append(configuration)
+    return configurations
+
+class CaasReplyParserTestCase(TestCase):
+
+    def setUp(self):
+        self.client = CaasClient()
+        self.random = random.Random(0)
+
+    def random_reply(self):
+        configurations = []
+        for i in range(self.random.randint(0, 5)):
+            action_name = self.random.choice(['Dialog', 'FakeCall'])
+            roles = ''.join(['<role name="role_%s_d%i">id%i</role>' % (action_name, j, self.random.randint(1, 9))
+                             for j in range(self.random.randint(0, 3))])
+            if self.random.random() < 0.2:
+                roles += '<role name="empty"/>'
+            configurations.append('<Configuration roleCount="%i">\n  <action name="action_%s">%s</action>\n'
+                                  '</Configuration>' % (i, action_name, roles))
+        return '<?xml version="1.0"?>\n<configurations>%s</configurations>' % '\n'.join(configurations)
+
+    def test_good_identical_to_minidom(self):
+        for i in range(200):
+            reply = self.random_reply()
+            self.assertEqual(list(self.client._iter_caas_configurations(reply)), parse_with_minidom(reply))
+
+    def test_good_early_stop(self):
+        reply = ('<configurations><Configuration><action name="action_Dialog"><role name="role_Dialog_d1">id1</role>'
+                 '</action></Configuration><Configuration><action name="action_FakeCall"></action></Configuration>'
+                 '<broken></configurations>')
+        configurations = self.client._iter_caas_configurations(reply)
+        self.assertEqual(configurations.next(),
+                         {'action_name': 'action_Dialog', 'roles': [{'role_Dialog_d1': 'id1'}]})
+        self.assertEqual(configurations.next()['action_name'], 'action_FakeCall')
+        self.assertRaises(CaasReplyParseError, configurations.next)
+
+    def test_good_large_reply(self):
+        def iter_reply():
+            yield '<configurations>'
+            for i in range(20000):
+                yield ('<Configuration><action name="action_Dialog"><role name="role_Dialog_d1">id%i</role>'
+                       '<role name="role_Dialog_d2">id2</role></action></Configuration>' % i)
+            yield '</configurations>'
+
+        class Reply(object):
+            # A file-like object that produces the reply in chunks
+            def __init__(self):
+                self.chunks = iter_reply()
+
+            def read(self, size=-1):
+                return next(self.chunks, '')
+
+        count = 0
+        for configuration in self.client._iter_caas_configurations(Reply()):
+            count += 1
+        self.assertEqual(count, 20000)
+        self.assertEqual(configuration['roles'], [{'role_Dialog_d1': 'id19999'}, {'role_Dialog_d2': 'id2'}])
+
+    def test_bad_reply(self):
+        for reply in ['', '<configurations>', '<Configuration><action name=""/></Configuration>']:
+            self.assertRaises(CaasReplyParseError, list, self.client._iter_caas_configurations(reply))
@@ -0,0 +1,133 @@
+from core.caas_cache import CaasResultCache
+from core.clients import CaasClient, CaasInternalServerError
+from core.http_sessions import HttpSessionPool
+from core.tests.configuration_fanout import StandInCaasHandler
+from core.tests.http_sessions import StandInServer
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+import threading
+import time
+
+class CaasResultCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = CaasResultCache(max_entries=2, ttl=60)
+        self.configurations = [{'action_name': 'action_Dialog', 'roles': [{'role_Dialog_d1': 'id1'}]}]
+
+    def test_good_get_set(self):
+        key = self.cache.make_key(u'<xml>model</xml>')
+        self.assertEqual(key, self.cache.make_key('<xml>model</xml>'))
+        self.assertNotEqual(key, self.cache.make_key(u'<xml>model2</xml>'))
+
+        self.assertEqual(self.cache.get(key), (False, None))
+        self.cache.set(key, self.configurations)
+        self.assertEqual(self.cache.get(key), (True, self.configurations))
+
+        # No configurations is an answer as well
+        self.cache.set('none', None)
+        self.assertEqual(self.cache.get('none'), (True, None))
+
+        stats = self.cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (2, 1, 2))
+
+    def test_good_copied_answers(self):
+        self.cache.set('key', self.configurations)
+        found, configurations = self.cache.get('key')
+        configurations[0]['rank'] = 1
+        self.assertFalse('rank' in self.cache.get('key')[1][0])
+
+    def test_good_lru_eviction(self):
+        self.cache.set('a', [1])
+        self.cache.set('b', [2])
+        self.cache.get('a')
+        self.cache.set('c', [3])
+
+        self.assertEqual(self.cache.get('b'), (False, None))
+        self.assertEqual(self.cache.get('a'), (True, [1]))
+        self.assertEqual(self.cache.get('c'), (True, [3]))
+        self.assertEqual(self.cache.get_stats()['evictions'], 1)
+
+    def test_good_expiration(self):
+        result_cache = CaasResultCache(ttl=0.1)
+        result_cache.set('a', [1])
+        time.sleep(0.15)
+        self.assertEqual(result_cache.get('a'), (False, None))
+        self.assertEqual(result_cache.get_stats()['expirations'], 1)
+
+    def test_good_django_cache_backend(self):
+        result_cache = CaasResultCache(backend=cache)
+        result_cache.set('shared', None)
+
+        # Another process finds the answer in the backend
+        other_cache = CaasResultCache(backend=cache)
+        self.assertEqual(other_cache.get('shared'), (True, None))
+        self.assertEqual(other_cache.get_stats()['backend_hits'], 1)
+        self.assertEqual(other_cache.get('shared'), (True, None))
+        self.assertEqual(other_cache.get_stats()['backend_hits'], 1)
+
+
+class CaasClientResultCacheTestCase(TestCase):
+
+    def setUp(self):
+        StandInCaasHandler.delays = {}
+        StandInCaasHandler.failing = set()
+        StandInCaasHandler.counts = {}
+        self.server = StandInServer(('127.0.0.1', 0), StandInCaasHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.client = CaasClient()
+        self.client.base_url = 'http://127.0.0.1:%i' % self.server.server_address[1]
+        self.client.session_pool = HttpSessionPool('test')
+        self.client.result_cache = CaasResultCache()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        time.sleep(StandInCaasHandler.timeout)
+
+    def test_good_cached_configuration(self):
+        model = 'action(action_Dialog).'
+        configurations = list(self.client.upload_and_get_wcrl_configuration('test', model, 'isWilling(id1,true).'))
+        self.assertEqual(configurations[0]['action_name'], 'action_Dialog')
+
+        self.assertEqual(list(self.client.upload_and_get_wcrl_configuration('test', model, 'isWilling(id1,true).')),
+                         configurations)
+        self.assertEqual(self.client.session_pool.get_stats()['requests'], 1)
+
+        # Changed selections are sent to CaaS
+        self.client.upload_and_get_wcrl_configuration('test', model, 'isWilling(id1,false).')
+        self.assertEqual(self.client.session_pool.get_stats()['requests'], 2)
+        self.assertEqual(self.client.result_cache.get_stats()['hits'], 1)
+
+    def test_bad_failed_request_not_cached(self):
+        StandInCaasHandler.failing = set(['Dialog'])
+        for i in range(2):
+            self.assertRaises(CaasInternalServerError, self.client.upload_and_get_wcrl_configuration,
+                              'test', 'action(action_Dialog).', '')
+        self.assertEqual(self.client.session_pool.get_stats()['requests'], 2)
+
+    def test_good_early_stop_not_cached(self):
+        StandInCaasHandler.counts = {'Dialog': 3}
+        configurations = self.client.upload_and_get_wcrl_configuration('test', 'action(action_Dialog).', '')
+        self.assertEqual(configurations.next()['roles'], [{'role_Dialog_d1': 'id1'}])
+        configurations.close()
+
+        # The rest of the reply was not read, so it is asked again
+        configurations = self.client.upload_and_get_wcrl_configuration('test', 'action(action_Dialog).', '')
+        self.assertEqual(len(list(configurations)), 3)
+        self.assertEqual(self.client.session_pool.get_stats()['requests'], 2)
+        self.assertEqual(self.client.result_cache.get_stats()['hits'], 0)
+
+    def test_good_large_reply_not_cached(self):
+        StandInCaasHandler.counts = {'Dialog': 3}
+        caas_settings = dict(settings.CAAS, RESULT_CACHE=dict(settings.CAAS.get('RESULT_CACHE', {}),
+                                                              MAX_CONFIGURATIONS=2))
+        with override_settings(CAAS=caas_settings):
+            for i in range(2):
+                configurations = self.client.upload_and_get_wcrl_configuration('test', 'action(action_Dialog).', '')
+                self.assertEqual(len(list(configurations)), 3)
+        self.assertEqual(self.client.session_pool.get_stats()['requests'], 2)
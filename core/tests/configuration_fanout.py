@@ -0,0 +1,110 @@
+from BaseHTTPServer import BaseHTTPRequestHandler
+from core.clients import CaasClient, CaasInternalServerError
+from core.configuration_models import WcrlModelGenerator
+from core.tests.http_sessions import StandInServer
+from core.views import _get_separate_configurations
+from core.workers import WorkerPool
+from django.test import TestCase
+import re
+import threading
+import time
+
+class StandInCaasHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = 0.5
+    # Seconds to wait before replying by the action name
+    delays = {}
+    failing = set()
+    # The number of configurations in the reply by the action name
+    counts = {}
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('content-length', 0)))
+        action_name = re.search(r'action\(action_(\w+)\)', body).group(1)
+        time.sleep(self.delays.get(action_name, 0))
+
+        if action_name in self.failing:
+            status, content = 500, 'failure'
+        else:
+            status = 200
+            content = ('<configurations>%s</configurations>' %
+                       ''.join(['<Configuration><action name="action_%s">'
+                                '<role name="role_%s_d1">id%i</role></action></Configuration>'
+                                % (action_name, action_name, i + 1)
+                                for i in range(self.counts.get(action_name, 1))]))
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class ConfigurationFanOutTestCase(TestCase):
+    fixtures = ['schedule_file_api_testdata', 'configuration_snapshot_testdata']
+
+    def setUp(self):
+        StandInCaasHandler.delays = {}
+        StandInCaasHandler.failing = set()
+        StandInCaasHandler.counts = {}
+        self.server = StandInServer(('127.0.0.1', 0), StandInCaasHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.client = CaasClient()
+        self.client.base_url = 'http://127.0.0.1:%i' % self.server.server_address[1]
+        self.client.result_cache = None
+        self.model_generator = WcrlModelGenerator()
+        self.worker_pool = WorkerPool('test', num_workers=4)
+        self.actions = [{'action': name, 'devices': [1, 2], 'roles': ['_anyvalue_', '_anyvalue_']}
+                        for name in ['Dialog', 'FakeCall', 'Conversation']]
+
+    def tearDown(self):
+        self.worker_pool.shutdown()
+        self.server.shutdown()
+        self.server.server_close()
+        time.sleep(StandInCaasHandler.timeout)
+
+    def get_configurations(self, deadline=5):
+        return _get_separate_configurations(self.client, self.model_generator, self.actions, deadline,
+                                            self.worker_pool)
+
+    def test_good_concurrent_requests(self):
+        StandInCaasHandler.delays = {'Dialog': 0.4, 'FakeCall': 0.2, 'Conversation': 0.3}
+
+        started_at = time.time()
+        configurations, complete = self.get_configurations()
+        self.assertTrue(time.time() - started_at < 0.8)
+
+        # The configurations are in the order of the actions
+        self.assertTrue(complete)
+        self.assertEqual([configuration['action_name'] for configuration in configurations],
+                         ['action_Dialog', 'action_FakeCall', 'action_Conversation'])
+
+    def test_good_partial_configurations(self):
+        StandInCaasHandler.delays = {'FakeCall': 1.5}
+
+        started_at = time.time()
+        configurations, complete = self.get_configurations(deadline=0.5)
+        self.assertTrue(time.time() - started_at < 1.0)
+
+        self.assertFalse(complete)
+        self.assertEqual([configuration['action_name'] for configuration in configurations],
+                         ['action_Dialog', 'action_Conversation'])
+
+    def test_good_top_configurations(self):
+        StandInCaasHandler.counts = {'Dialog': 5, 'FakeCall': 1, 'Conversation': 3}
+        configurations, complete = _get_separate_configurations(self.client, self.model_generator,
+                                                                self.actions, 5, self.worker_pool, top=2)
+
+        # The best configurations of each action are kept in the order they arrived in
+        self.assertEqual([(configuration['action_name'], configuration['roles'][0].values()[0])
+                          for configuration in configurations],
+                         [('action_Dialog', 'id1'), ('action_Dialog', 'id2'), ('action_FakeCall', 'id1'),
+                          ('action_Conversation', 'id1'), ('action_Conversation', 'id2')])
+
+    def test_bad_failed_request(self):
+        StandInCaasHandler.failing = set(['FakeCall'])
+        self.assertRaises(CaasInternalServerError, self.get_configurations)
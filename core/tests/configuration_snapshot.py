@@ -0,0 +1,62 @@
+from core.models import Device, DeviceInterface, Interface, Schedule, StateValue
+from core.snapshots import load_configuration_snapshot
+from django.test import TestCase
+
+class ConfigurationSnapshotTestCase(TestCase):
+    fixtures = ['schedule_file_api_testdata', 'configuration_snapshot_testdata']
+    
+    def test_good_snapshot(self):
+        schedules = list(Schedule.objects.all())
+        snapshot = load_configuration_snapshot(schedules)
+        
+        self.assertEqual(snapshot.methods, {'TalkingDevice': [1, 2], 'CalendarSource': [3]})
+        self.assertEqual([device.mac_address for device in snapshot.devices], ['aa:aa:aa:aa:aa:aa', 'bb:bb:bb:bb:bb:bb'])
+        self.assertEqual(snapshot.get_device('cc:cc:cc:cc:cc:cc'), None)
+        
+        action_devices = snapshot.get_action_devices('FakeCall')
+        self.assertEqual([action_device['name'] for action_device in action_devices], ['d1', 'd2'])
+        self.assertTrue(action_devices[0]['is_trigger'])
+        self.assertFalse(action_devices[1]['is_trigger'])
+        self.assertEqual(action_devices[0]['interfaces'], ['CalendarSource', 'TalkingDevice'])
+        self.assertEqual(action_devices[0]['precondition_method_ids'], [3])
+        
+        # The argument eid of eventApproaching
+        device = snapshot.get_device('aa:aa:aa:aa:aa:aa')
+        self.assertEqual(snapshot.get_argument_values(action_devices[0], device), ['1234'])
+    
+    def test_good_selections(self):
+        schedules = list(Schedule.objects.all())
+        snapshot = load_configuration_snapshot(schedules)
+        proximity_devices = [Device.objects.get(mac_address='aa:aa:aa:aa:aa:aa')]
+        
+        # The selections are built without any queries
+        with self.assertNumQueries(0):
+            selections = snapshot.get_selections(proximity_devices)
+        
+        selections = dict([(selection['name'], selection['value']) for selection in selections])
+        self.assertEqual(selections, {'isInProximity_aa_aa_aa_aa_aa_aa': 'true',
+                                      'isWilling_aa_aa_aa_aa_aa_aa': 'true',
+                                      'isSilent_aa_aa_aa_aa_aa_aa': 'false',
+                                      'eventApproaching_aa_aa_aa_aa_aa_aa': 'true',
+                                      'isInProximity_bb_bb_bb_bb_bb_bb': 'false',
+                                      'isWilling_bb_bb_bb_bb_bb_bb': 'true',
+                                      'isSilent_bb_bb_bb_bb_bb_bb': 'false',
+                                      'eventApproaching_bb_bb_bb_bb_bb_bb': 'false'})
+    
+    def test_good_constant_queries(self):
+        schedules = list(Schedule.objects.all())
+        self.assertNumQueries(9, load_configuration_snapshot, schedules)
+        
+        # Add devices with state values, which must not add any queries
+        talking_device = Interface.objects.get(name='TalkingDevice')
+        for i in range(10):
+            # Skip the overridden save methods, so that no signals are sent
+            # and the devices are not registered to the proximity server
+            device = Device(mac_address='00:00:00:00:00:%02i' % i, name='Device %i' % i)
+            super(Device, device).save()
+            device_interface = DeviceInterface(device=device, interface=talking_device)
+            super(DeviceInterface, device_interface).save()
+            state_value = StateValue(device=device, method_id=1, value='True')
+            super(StateValue, state_value).save()
+        
+        self.assertNumQueries(9, load_configuration_snapshot, schedules)
@@ -0,0 +1,104 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from core.clients import CaasClient, CaasNotFoundError, CaasTimeoutError, MirriClient
+from core.http_sessions import HttpSessionPool, get_session_pool
+from django.test import TestCase
+import threading
+import time
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Keep-alive needs HTTP/1.1 and a content length in every response
+    protocol_version = 'HTTP/1.1'
+    # Close idle keep-alive connections, so that the handler threads end
+    timeout = 0.5
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('content-length', 0)))
+        if self.path.startswith('/slow'):
+            time.sleep(float(self.path.split('/')[-1]))
+
+        status = 404 if self.path == '/missing' else 200
+        content = 'echo:' + body
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The clients that time out close their connections
+        pass
+
+
+class HttpSessionPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(('127.0.0.1', 0), StandInHandler)
+        self.port = self.server.server_address[1]
+        self.base_url = 'http://127.0.0.1:%i' % self.port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        time.sleep(StandInHandler.timeout)
+
+    def test_good_connection_reuse(self):
+        pool = HttpSessionPool('test', pool_size=2, timeout=5)
+        for i in range(5):
+            response = pool.request('post', self.base_url + '/echo', data='hello %i' % i)
+            self.assertEqual(response.content, 'echo:hello %i' % i)
+
+        stats = pool.get_stats()
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['connections'], 1)
+        self.assertAlmostEqual(stats['reuse_ratio'], 0.8)
+
+    def test_good_bounded_concurrency(self):
+        pool = HttpSessionPool('test', pool_size=2, timeout=5)
+        responses = []
+
+        def send():
+            responses.append(pool.request('get', self.base_url + '/slow/0.2').status_code)
+
+        threads = [threading.Thread(target=send) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = pool.get_stats()
+        self.assertEqual(responses, [200] * 6)
+        self.assertTrue(stats['connections'] <= 2)
+        self.assertTrue(stats['reuse_ratio'] >= 4 / 6.0)
+        # Four of the requests waited for a free connection
+        self.assertTrue(stats['max_wait'] >= 0.15)
+        self.assertTrue(stats['avg_wait'] > 0)
+
+    def test_bad_timeout(self):
+        client = CaasClient()
+        client.session_pool = HttpSessionPool('test', pool_size=1, timeout=0.2)
+        self.assertRaises(CaasTimeoutError, client._send_request, 'get', self.base_url + '/slow/1')
+        self.assertEqual(client.session_pool.get_stats()['failed'], 1)
+
+    def test_good_clients(self):
+        self.assertTrue(get_session_pool('caas') is CaasClient().session_pool)
+        self.assertTrue(get_session_pool('mirri') is MirriClient().session_pool)
+
+        client = MirriClient()
+        client.base_url = self.base_url
+        self.assertTrue(client.start_action('Dialog', [], []).startswith('echo:'))
+
+        client = CaasClient()
+        self.assertRaises(CaasNotFoundError, client._send_request, 'post', self.base_url + '/missing')
@@ -0,0 +1,78 @@
+from core.configuration_models import KumbangFragmentCache, KumbangModelGenerator
+from core.models import Device, DeviceInterface, Interface, Schedule
+from django.test import TestCase
+
+class KumbangModelTestCase(TestCase):
+    fixtures = ['schedule_file_api_testdata', 'configuration_snapshot_testdata']
+
+    def setUp(self):
+        self.cache = KumbangFragmentCache()
+        self.schedule = Schedule.objects.get(name='calendarReminderSCHTest')
+
+    def generate(self):
+        generator = KumbangModelGenerator(fragment_cache=self.cache)
+        return generator.generate_configuration_model(self.schedule)
+
+    def add_device(self, mac_address, interface_names):
+        # Skip the overridden save methods, so that no signals are sent
+        # and the device is not registered to the proximity server
+        device = Device(mac_address=mac_address, name=mac_address)
+        super(Device, device).save()
+        for interface_name in interface_names:
+            interface = Interface.objects.get(name=interface_name)
+            device_interface = DeviceInterface(device=device, interface=interface)
+            super(DeviceInterface, device_interface).save()
+        return device
+
+    def test_good_model(self):
+        model = self.generate()
+
+        self.assertTrue(model.startswith('Kumbang model schedule_calendarReminderSCHTest\n'))
+        self.assertTrue('attribute type ID = { Trigger_aa_aa_aa_aa_aa_aa, '
+                        'Trigger_bb_bb_bb_bb_bb_bb }\n' in model)
+        self.assertTrue('        // status eventApproaching\n'
+                        '        not (value(eventApproaching_aa_aa_aa_aa_aa_aa) = true) => '
+                        'not instance_of(component-root.action.trigger, '
+                        'Device_aa_aa_aa_aa_aa_aa);\n'
+                        '        // trigger\n' in model)
+        self.assertTrue('component type Device_aa_aa_aa_aa_aa_aa extends '
+                        '(TalkingDevice, CalendarSource) {}\n'
+                        'component type Device_bb_bb_bb_bb_bb_bb extends '
+                        'TalkingDevice {}\n' in model)
+
+    def test_good_cached_model(self):
+        model = self.generate()
+        self.assertEqual(self.generate(), model)
+
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['schedule_misses'], 1)
+        self.assertEqual(stats['schedule_hits'], 1)
+        self.assertEqual(stats['device_misses'], 2)
+        self.assertEqual(stats['device_hits'], 2)
+
+    def test_good_changed_device(self):
+        self.generate()
+        self.add_device('dd:dd:dd:dd:dd:dd', ['TalkingDevice'])
+
+        # Only the new device is rendered
+        model = self.generate()
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['device_misses'], 3)
+        self.assertEqual(stats['device_hits'], 2)
+
+        # The model equals a model generated from scratch
+        self.assertEqual(model, KumbangModelGenerator(KumbangFragmentCache())
+                                    .generate_configuration_model(self.schedule))
+        self.assertTrue('component type Device_dd_dd_dd_dd_dd_dd extends '
+                        'TalkingDevice {}\n' in model)
+
+        # A device that implements another interface is rendered again
+        device = Device.objects.get(mac_address='bb:bb:bb:bb:bb:bb')
+        device_interface = DeviceInterface(device=device,
+                                           interface=Interface.objects.get(name='CalendarSource'))
+        super(DeviceInterface, device_interface).save()
+        model = self.generate()
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['device_misses'], 4)
+        self.assertEqual(stats['device_hits'], 4)
+        self.assertTrue('Boolean eventApproaching_bb_bb_bb_bb_bb_bb;\n' in model)
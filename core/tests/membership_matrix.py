@@ -0,0 +1,111 @@
+from core.membership import MembershipMatrix, get_membership_matrix
+from core.models import Device, DeviceInterface, Interface
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+
+class MembershipMatrixTestCase(TestCase):
+
+    def setUp(self):
+        # Device 1 implements interfaces 10 and 20, device 2 interface 20 and
+        # device 3 interfaces 10, 20 and 30
+        self.matrix = MembershipMatrix.from_pairs([(3, 30), (1, 10), (1, 20), (2, 20), (3, 10), (3, 20)],
+                                                  {10: 'TalkingDevice', 20: 'CalendarSource', 30: 'Phone'})
+
+    def test_good_implements(self):
+        self.assertTrue(self.matrix.implements(1, 10))
+        self.assertFalse(self.matrix.implements(2, 10))
+        self.assertFalse(self.matrix.implements(4, 10))
+        self.assertFalse(self.matrix.implements(1, 40))
+
+    def test_good_interfaces(self):
+        self.assertEqual(self.matrix.get_interface_ids(3), [10, 20, 30])
+        self.assertEqual(self.matrix.get_interface_names(1), ['TalkingDevice', 'CalendarSource'])
+        # The names are in the order the interfaces were added
+        self.assertEqual(self.matrix.get_interface_names(3), ['Phone', 'TalkingDevice', 'CalendarSource'])
+        self.assertEqual(self.matrix.get_interface_ids(4), [])
+
+    def test_good_get_devices(self):
+        self.assertEqual(self.matrix.get_devices([20]), [1, 2, 3])
+        self.assertEqual(self.matrix.get_devices([10, 20]), [1, 3])
+        self.assertEqual(self.matrix.get_devices([30, 10]), [3])
+        self.assertEqual(self.matrix.get_devices([40]), [])
+        self.assertEqual(MembershipMatrix.from_pairs([]).get_devices([10]), [])
+
+    def test_good_filter_devices(self):
+        # The order of the candidates is kept
+        self.assertEqual(self.matrix.filter_devices([3, 4, 2, 1], [10]), [3, 1])
+        self.assertEqual(self.matrix.filter_devices([3, 2], [20]), [3, 2])
+        self.assertEqual(self.matrix.filter_devices([1, 2], [40]), [])
+        self.assertEqual(self.matrix.filter_devices([], [10]), [])
+
+    def test_good_resolve_devices(self):
+        device_ids, candidates = self.matrix.resolve_devices([[30], [10, 20], [], [20], [40]])
+        # Ordered by the first role and then by the primary key
+        self.assertEqual(device_ids, [3, 1, 2])
+        self.assertEqual(candidates, [[3], [1, 3], [], [1, 2, 3], []])
+
+        self.assertEqual(self.matrix.resolve_devices([]), ([], []))
+        self.assertEqual(MembershipMatrix.from_pairs([]).resolve_devices([[10]]), ([], [[]]))
+
+
+class SharedMembershipMatrixTestCase(TransactionTestCase):
+    # The changes are committed, so that the shared matrix is cached
+    fixtures = ['schedule_file_api_testdata', 'configuration_snapshot_testdata']
+
+    def test_good_cached_matrix(self):
+        matrix = get_membership_matrix()
+        self.assertNumQueries(0, get_membership_matrix)
+        self.assertTrue(get_membership_matrix() is matrix)
+
+        talking_device = Interface.objects.get(name='TalkingDevice')
+        calendar_source = Interface.objects.get(name='CalendarSource')
+        aa = Device.objects.get(mac_address='aa:aa:aa:aa:aa:aa')
+        cc = Device.objects.get(mac_address='cc:cc:cc:cc:cc:cc')
+        self.assertEqual(matrix.get_devices([talking_device.id, calendar_source.id]), [aa.id])
+
+        # Skip the overridden save method, so that no configuration signals
+        # are sent
+        device_interface = DeviceInterface(device=cc, interface=talking_device)
+        super(DeviceInterface, device_interface).save()
+        matrix = get_membership_matrix()
+        self.assertTrue(matrix.implements(cc.id, talking_device.id))
+
+        device_interface.delete()
+        self.assertFalse(get_membership_matrix().implements(cc.id, talking_device.id))
+
+    def test_good_interface_and_device_changes(self):
+        talking_device = Interface.objects.get(name='TalkingDevice')
+        aa = Device.objects.get(mac_address='aa:aa:aa:aa:aa:aa')
+        self.assertTrue('TalkingDevice' in get_membership_matrix().get_interface_names(aa.id))
+
+        # A renamed interface is not saved with a DeviceInterface
+        talking_device.name = 'Speaker'
+        super(Interface, talking_device).save()
+        self.assertTrue('Speaker' in get_membership_matrix().get_interface_names(aa.id))
+
+        matrix = get_membership_matrix()
+        aa.delete()
+        self.assertFalse(get_membership_matrix() is matrix)
+        self.assertEqual(get_membership_matrix().get_interface_names(aa.id), [])
+
+    def test_good_rolled_back_change(self):
+        talking_device = Interface.objects.get(name='TalkingDevice')
+        cc = Device.objects.get(mac_address='cc:cc:cc:cc:cc:cc')
+        matrix = get_membership_matrix()
+
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            device_interface = DeviceInterface(device=cc, interface=talking_device)
+            super(DeviceInterface, device_interface).save()
+            # The uncommitted change is seen only by the thread
+            uncommitted_matrix = get_membership_matrix()
+            self.assertTrue(uncommitted_matrix.implements(cc.id, talking_device.id))
+            self.assertFalse(get_membership_matrix() is uncommitted_matrix)
+            transaction.rollback()
+        finally:
+            transaction.leave_transaction_management()
+
+        matrix = get_membership_matrix()
+        self.assertFalse(matrix.implements(cc.id, talking_device.id))
+        self.assertTrue(get_membership_matrix() is matrix)
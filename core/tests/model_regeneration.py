@@ -0,0 +1,43 @@
+from core.clients import ProximityClient
+from core.models import Device, DeviceInterface, Interface
+from django.conf import settings
+from django.test import TestCase
+from mock import patch
+
+# Patch the scheduler that collapses the model regenerations in every test
+@patch('core.signals.model_regeneration_scheduler')
+class ModelRegenerationTestCase(TestCase):
+    fixtures = ['schedule_file_api_testdata']
+    
+    def setUp(self):
+        self.old_setting = settings.PROXIMITY_SERVER['default']
+        settings.PROXIMITY_SERVER['default'] = settings.PROXIMITY_SERVER['test']
+        self.proximity_client = ProximityClient()
+        self.proximity_client.flush()
+        
+    def tearDown(self):
+        settings.PROXIMITY_SERVER['default'] = self.old_setting
+    
+    def test_good_device_interface_add_delete(self, MockScheduler):
+        device = Device.objects.create(mac_address='aa:aa:aa:aa:aa:aa', name='Device one')
+        
+        # The actions of schedule talkingDevicesSCHTest use TalkingDevice
+        device_interface = DeviceInterface.objects.create(device=device, interface=Interface.objects.get(name='TalkingDevice'))
+        self.assertEqual(MockScheduler.schedule.call_count, 1)
+        self.assertEqual(MockScheduler.schedule.call_args[0][0], 1)
+        self.assertEqual(MockScheduler.schedule.call_args[0][2], 1)
+        
+        MockScheduler.reset_mock()
+        device_interface.delete()
+        self.assertEqual(MockScheduler.schedule.call_count, 1)
+        self.assertEqual(MockScheduler.schedule.call_args[0][0], 1)
+    
+    def test_good_unused_interface(self, MockScheduler):
+        device = Device.objects.create(mac_address='aa:aa:aa:aa:aa:aa', name='Device one')
+        
+        # No schedule uses CalendarSource
+        device_interface = DeviceInterface.objects.create(device=device, interface=Interface.objects.get(name='CalendarSource'))
+        self.assertEqual(MockScheduler.schedule.call_count, 0)
+        
+        device_interface.delete()
+        self.assertEqual(MockScheduler.schedule.call_count, 0)
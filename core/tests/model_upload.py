@@ -0,0 +1,97 @@
+from BaseHTTPServer import BaseHTTPRequestHandler
+from core.models import Schedule
+from core.tasks import generate_model, get_model_upload_stats
+from core.tests.http_sessions import StandInServer
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.functional import empty
+from mock import patch
+import shutil
+import tempfile
+import threading
+import time
+
+class StandInKumbangHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timeout = 0.5
+    uploads = []
+
+    def do_POST(self):
+        self.uploads.append(self.rfile.read(int(self.headers.get('content-length', 0))))
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class ModelUploadTestCase(TestCase):
+    fixtures = ['schedule_file_api_testdata', 'configuration_snapshot_testdata']
+
+    def setUp(self):
+        StandInKumbangHandler.uploads = []
+        self.server = StandInServer(('127.0.0.1', 0), StandInKumbangHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.caas_settings = patch.dict(settings.CAAS, {'HOST': '127.0.0.1',
+                                                        'PORT': self.server.server_address[1],
+                                                        'CONFIGURATOR': 'kumbang'})
+        self.caas_settings.start()
+
+        # The generated models are written into a temporary media root
+        self.media_root = tempfile.mkdtemp()
+        self.media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_settings.enable()
+        # The default storage reads MEDIA_ROOT only when it is created
+        default_storage._wrapped = empty
+
+    def tearDown(self):
+        self.media_settings.disable()
+        default_storage._wrapped = empty
+        shutil.rmtree(self.media_root)
+        self.caas_settings.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        time.sleep(StandInKumbangHandler.timeout)
+
+    def generate_model(self):
+        generate_model(Schedule.objects.get(name='calendarReminderSCHTest'))
+        return Schedule.objects.get(name='calendarReminderSCHTest')
+
+    def test_good_unchanged_model_skipped(self):
+        stats = get_model_upload_stats()
+
+        schedule = self.generate_model()
+        self.assertEqual(len(StandInKumbangHandler.uploads), 1)
+        self.assertEqual(len(schedule.configuration_model_digest), 40)
+        model_file_name = schedule.configuration_model_file.name
+
+        # Neither the file is written nor the model sent again
+        schedule = self.generate_model()
+        self.assertEqual(len(StandInKumbangHandler.uploads), 1)
+        self.assertEqual(schedule.configuration_model_file.name, model_file_name)
+
+        new_stats = get_model_upload_stats()
+        self.assertEqual(new_stats['sent'] - stats['sent'], 1)
+        self.assertEqual(new_stats['skipped'] - stats['skipped'], 1)
+
+    def test_good_changed_model_sent(self):
+        schedule = self.generate_model()
+        digest = schedule.configuration_model_digest
+
+        schedule.configuration_model_digest = 'stale'
+        super(Schedule, schedule).save()
+        schedule = self.generate_model()
+        self.assertEqual(len(StandInKumbangHandler.uploads), 2)
+        self.assertEqual(schedule.configuration_model_digest, digest)
+
+    def test_bad_failed_upload_not_stored(self):
+        self.server.shutdown()
+        self.server.server_close()
+        schedule = self.generate_model()
+        self.assertEqual(schedule.configuration_model_digest, '')
@@ -0,0 +1,67 @@
+from core.clients import ProximityClient
+from core.models import Device, load_proximity_mac_addresses, set_proximity_groups
+from django.conf import settings
+from django.test import TestCase
+from mock import patch
+from proximity.device import DeviceHandler
+from proximity.listen import CommandParser
+from proximity.proximity import ProximityManager
+import json
+
+class ProximityBatchTestCase(TestCase):
+    fixtures = ['devices_testdata']
+
+    def setUp(self):
+        self.old_setting = settings.PROXIMITY_SERVER['default']
+        settings.PROXIMITY_SERVER['default'] = settings.PROXIMITY_SERVER['test']
+        self.proximity_client = ProximityClient()
+        self.proximity_client.flush()
+        # The fixture devices are not registered to the proximity server
+        for device in Device.objects.all():
+            device.register_proximity_device()
+
+    def tearDown(self):
+        settings.PROXIMITY_SERVER['default'] = self.old_setting
+
+    def test_good_batch_commands(self):
+        device_handler = DeviceHandler()
+        parser = CommandParser(device_handler, ProximityManager(device_handler))
+        # The neighbours must have been registered before
+        self.assertEqual(parser.parse('multi_set_group, bb; cc; aa, bb; dd, cc, ;'), 'ok')
+        self.assertEqual(parser.parse('multi_get_group, aa, bb, cc, ee'), 'bb;aa;dd;[]')
+        self.assertEqual(parser.parse('multi_get_group'), '')
+
+    def test_good_client_batches(self):
+        self.proximity_client.set_groups({'aa:aa:aa:aa:aa:aa': ['bb:bb:bb:bb:bb:bb'],
+                                          'bb:bb:bb:bb:bb:bb': ['aa:aa:aa:aa:aa:aa'],
+                                          'cc:cc:cc:cc:cc:cc': []})
+        self.assertEqual(self.proximity_client.get_groups(['aa:aa:aa:aa:aa:aa', 'cc:cc:cc:cc:cc:cc']),
+                         {'aa:aa:aa:aa:aa:aa': ['bb:bb:bb:bb:bb:bb'],
+                          'cc:cc:cc:cc:cc:cc': []})
+        self.assertEqual(self.proximity_client.get_groups([]), {})
+
+    def test_good_loaded_groups(self):
+        devices = list(Device.objects.order_by('mac_address'))
+        self.assertTrue(set_proximity_groups({devices[0].mac_address: [devices[1].mac_address]}))
+
+        with patch.object(ProximityClient, 'get_group') as get_group:
+            devices = load_proximity_mac_addresses(Device.objects.order_by('mac_address'))
+            self.assertEqual(devices[0].get_proximity_mac_addresses(), [devices[1].mac_address])
+            self.assertEqual([device.num_proximity_devices for device in devices], [1, 1, 0, 0])
+            self.assertEqual(list(devices[1].proximity_device_group), [devices[0]])
+            self.assertFalse(get_group.called)
+
+        # A device that sets its proximity devices requests the group again
+        devices[2].set_proximity_devices([devices[3].mac_address])
+        self.assertEqual(devices[2].get_proximity_mac_addresses(), [devices[3].mac_address])
+
+    def test_good_device_list(self):
+        self.proximity_client.set_group('aa:aa:aa:aa:aa:aa', ['bb:bb:bb:bb:bb:bb'])
+        with patch.object(ProximityClient, 'get_group') as get_group:
+            response = self.client.get('/api/v2/device/')
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(get_group.called)
+
+        devices = dict([(device['mac_address'], device['proximity_devices'])
+                        for device in json.loads(response.content)['objects']])
+        self.assertEqual(devices['aa:aa:aa:aa:aa:aa'], ['bb:bb:bb:bb:bb:bb'])
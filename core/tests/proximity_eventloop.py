@@ -0,0 +1,97 @@
+from core.proximity_connections import ProximityConnection
+from django.test import TestCase
+from proximity.eventloop import ProximityServer
+from proximity.protocol import HANDSHAKE_SIZE, make_handshake
+import os
+import socket
+import sys
+import threading
+
+class ProximityEventLoopTestCase(TestCase):
+
+    def setUp(self):
+        self.server = ProximityServer(('localhost', 0))
+        self.host, self.port = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _connect(self):
+        connection = ProximityConnection(self.host, self.port, timeout=5)
+        connection.connect()
+        return connection
+
+    def _send_text(self, command):
+        sock = socket.create_connection((self.host, self.port), 5)
+        try:
+            sock.sendall(command)
+            chunks = []
+            chunk = sock.recv(4096)
+            while chunk:
+                chunks.append(chunk)
+                chunk = sock.recv(4096)
+            return ''.join(chunks)
+        finally:
+            sock.close()
+
+    def test_good_framed_commands(self):
+        connection = self._connect()
+        try:
+            self.assertEqual(connection.request(['add_device, aa', 'set_group, bb, aa', 'get_group, aa',
+                                                 'multi_get_group, aa, bb, cc']),
+                             ['ok', 'ok', 'bb', 'bb;aa;[]'])
+        finally:
+            connection.close()
+
+    def test_good_text_commands(self):
+        self.assertEqual(self._send_text('add_device, aa'), 'ok')
+        self.assertEqual(self._send_text('set_group, bb, aa'), 'ok')
+        self.assertEqual(self._send_text('get_group, aa'), 'bb')
+
+    def test_good_concurrent_connections(self):
+        # The connections stay open while the others are served
+        connections = [self._connect() for i in range(100)]
+        try:
+            replies = [connection.request(['set_group, %i, %i' % (i, max(i - 1, 0)), 'get_version'])
+                       for i, connection in enumerate(connections)]
+            self.assertEqual(set([reply[0] for reply in replies]), set(['ok']))
+            self.assertEqual(connections[0].request(['get_group, 99'])[0],
+                             ','.join(sorted([str(i) for i in range(99)])))
+        finally:
+            for connection in connections:
+                connection.close()
+
+    def test_good_group_snapshot(self):
+        parser = self.server.commandParser
+        connection = self._connect()
+        try:
+            connection.request(['add_device, aa', 'add_device, bb', 'get_group, aa'])
+            self.assertEqual(parser.snapshot, {'aa': '[]'})
+
+            # A changed group drops the snapshot
+            self.assertEqual(connection.request(['set_group, aa, bb', 'get_group, aa']), ['ok', 'bb'])
+            self.assertEqual(parser.snapshot, {'aa': 'bb'})
+            self.assertEqual(parser.snapshot_version, self.server.proximityManager.get_version())
+        finally:
+            connection.close()
+
+    def test_bad_commands(self):
+        sock = socket.create_connection((self.host, self.port), 5)
+        try:
+            sock.sendall(make_handshake(99))
+            self.assertEqual(sock.recv(HANDSHAKE_SIZE), make_handshake(0))
+        finally:
+            sock.close()
+
+        # A failing command closes only its connection
+        sys.stderr, stderr = open(os.devnull, 'w'), sys.stderr
+        try:
+            self.assertEqual(self._send_text('set_group'), '')
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        self.assertEqual(self._send_text('add_device, aa'), 'ok')
@@ -0,0 +1,72 @@
+from django.test import TestCase
+from proximity.device import DeviceHandler
+from proximity.listen import CommandParser
+from proximity.proximity import ProximityManager
+import networkx as nx
+import random
+
+class ProximityGroupsTestCase(TestCase):
+
+    def setUp(self):
+        self.device_handler = DeviceHandler()
+        self.proximity_manager = ProximityManager(self.device_handler)
+        self.parser = CommandParser(self.device_handler, self.proximity_manager)
+        self.random = random.Random(0)
+
+    def assertGroupsConsistent(self):
+        graph = self.proximity_manager.proxNet
+        for device in graph.nodes():
+            expected = frozenset(nx.node_connected_component(graph, device))
+            self.assertEqual(self.proximity_manager.get_group(device), expected)
+            self.assertTrue(self.proximity_manager.groups[device.groupId] == expected)
+        self.assertEqual(sum([len(group) for group in self.proximity_manager.groups.values()]),
+                         graph.number_of_nodes())
+
+    def test_good_random_updates(self):
+        device_ids = ['d%i' % i for i in range(30)]
+        for i in range(500):
+            device_id = self.random.choice(device_ids)
+            command = self.random.choice(['set_group', 'set_group', 'set_group', 'get_group', 'add_device'])
+            if command == 'set_group':
+                neighbours = self.random.sample(device_ids, self.random.randint(0, 2))
+                self.parser.parse(','.join([command, device_id] + neighbours))
+            else:
+                self.parser.parse('%s,%s' % (command, device_id))
+            self.assertGroupsConsistent()
+
+    def test_good_version(self):
+        self.parser.parse('add_device, aa')
+        self.parser.parse('add_device, bb')
+        version = int(self.parser.parse('get_version'))
+
+        # Reading the groups and unchanged groups keep the version
+        self.parser.parse('get_group, aa')
+        self.parser.parse('set_group, aa')
+        self.assertEqual(int(self.parser.parse('get_version')), version)
+
+        self.parser.parse('set_group, aa, bb')
+        self.assertEqual(int(self.parser.parse('get_version')), version + 1)
+        self.parser.parse('set_group, aa, bb')
+        self.assertEqual(int(self.parser.parse('get_version')), version + 1)
+
+        # A removed edge splits the group
+        self.parser.parse('set_group, bb')
+        self.assertEqual(int(self.parser.parse('get_version')), version + 2)
+        self.assertEqual(self.parser.parse('get_group, aa'), '[]')
+
+        self.parser.parse('flush')
+        self.assertEqual(int(self.parser.parse('get_version')), version + 3)
+
+    def test_good_removed_edge_within_cycle(self):
+        for device_id in ['aa', 'bb', 'cc']:
+            self.parser.parse('add_device, %s' % device_id)
+        # A device's set_group replaces all of its edges
+        self.parser.parse('set_group, aa, bb, cc')
+        self.parser.parse('set_group, bb, aa, cc')
+        version = self.proximity_manager.get_version()
+
+        # The removed edge aa-bb leaves the group connected through cc
+        self.parser.parse('set_group, aa, cc')
+        self.assertEqual(self.proximity_manager.get_version(), version)
+        self.assertEqual(self.parser.parse('get_group, aa'), 'bb,cc')
+        self.assertGroupsConsistent()
@@ -0,0 +1,81 @@
+from core.clients import ProximityClient
+from core.proximity_connections import get_connection_pool
+from django.conf import settings
+from django.test import TestCase
+from proximity.protocol import (FrameDecoder, HANDSHAKE_SIZE, encode_frame,
+                                make_handshake)
+import socket
+
+class ProximityProtocolTestCase(TestCase):
+
+    def setUp(self):
+        self.old_setting = settings.PROXIMITY_SERVER['default']
+        settings.PROXIMITY_SERVER['default'] = settings.PROXIMITY_SERVER['test']
+        self.proximity_client = ProximityClient()
+        self.proximity_client.flush()
+
+    def tearDown(self):
+        settings.PROXIMITY_SERVER['default'] = self.old_setting
+
+    def test_good_frame_decoder(self):
+        frames = encode_frame('get_group, aa') + encode_frame('') + encode_frame(u'flush')
+        decoder = FrameDecoder()
+        payloads = []
+        # The frames are split at every byte
+        for byte in frames:
+            payloads.extend(decoder.feed(byte))
+        self.assertEqual(payloads, ['get_group, aa', '', 'flush'])
+        self.assertEqual(FrameDecoder().feed(frames + frames[:3]), ['get_group, aa', '', 'flush'])
+
+    def test_good_large_group(self):
+        # The group is far larger than a single packet
+        mac_addresses = ['aa:aa:aa:aa:%02x:%02x' % (i / 256, i % 256) for i in range(500)]
+        for mac_address in mac_addresses:
+            self.proximity_client.add_device(mac_address)
+        self.proximity_client.set_group(mac_addresses[0], mac_addresses[1:])
+
+        self.assertEqual(self.proximity_client.get_group(mac_addresses[0]), mac_addresses[1:])
+        groups = self.proximity_client.get_groups(mac_addresses[:3])
+        self.assertEqual(groups[mac_addresses[2]], [mac_addresses[0], mac_addresses[1]] + mac_addresses[3:])
+
+    def test_good_pipelined_requests(self):
+        pool = get_connection_pool(self.proximity_client.host, self.proximity_client.port)
+        connections = pool.get_stats()['connections']
+
+        self.proximity_client.add_device('aa:aa:aa:aa:aa:aa')
+        self.proximity_client.set_group('bb:bb:bb:bb:bb:bb', ['aa:aa:aa:aa:aa:aa'])
+        self.assertEqual(self.proximity_client.get_groups(['aa:aa:aa:aa:aa:aa', 'bb:bb:bb:bb:bb:bb',
+                                                           'cc:cc:cc:cc:cc:cc']),
+                         {'aa:aa:aa:aa:aa:aa': ['bb:bb:bb:bb:bb:bb'],
+                          'bb:bb:bb:bb:bb:bb': ['aa:aa:aa:aa:aa:aa'],
+                          'cc:cc:cc:cc:cc:cc': []})
+        # The requests reused the persistent connection
+        self.assertEqual(pool.get_stats()['connections'], connections)
+
+    def test_good_text_protocol(self):
+        config = dict(settings.PROXIMITY_SERVER['test'], PROTOCOL='text')
+        settings.PROXIMITY_SERVER['default'] = config
+        client = ProximityClient()
+        self.assertEqual(client.connection_pool, None)
+
+        client.set_group('aa:aa:aa:aa:aa:aa', [])
+        client.set_group('bb:bb:bb:bb:bb:bb', ['aa:aa:aa:aa:aa:aa'])
+        self.assertEqual(client.get_group('aa:aa:aa:aa:aa:aa'), ['bb:bb:bb:bb:bb:bb'])
+        # The framed clients see the same groups
+        self.assertEqual(self.proximity_client.get_group('bb:bb:bb:bb:bb:bb'), ['aa:aa:aa:aa:aa:aa'])
+
+    def test_bad_protocol_version(self):
+        connection = socket.create_connection((self.proximity_client.host, self.proximity_client.port), 5)
+        try:
+            connection.sendall(make_handshake(99))
+            reply = ''
+            while len(reply) < HANDSHAKE_SIZE:
+                chunk = connection.recv(HANDSHAKE_SIZE)
+                if not chunk:
+                    break
+                reply += chunk
+            self.assertEqual(reply, make_handshake(0))
+            # The server closes the connection
+            self.assertEqual(connection.recv(HANDSHAKE_SIZE), '')
+        finally:
+            connection.close()
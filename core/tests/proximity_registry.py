@@ -0,0 +1,61 @@
+from django.test import TestCase
+from proximity.device import Device, DeviceHandler
+from proximity.listen import CommandParser
+from proximity.proximity import ProximityManager
+import threading
+
+class ProximityRegistryTestCase(TestCase):
+
+    def setUp(self):
+        self.device_handler = DeviceHandler()
+        self.parser = CommandParser(self.device_handler, ProximityManager(self.device_handler))
+
+    def test_good_device_index(self):
+        device = self.device_handler.addDevice(Device('aa', []))
+        self.assertTrue(self.device_handler.getDevice('aa') is device)
+        self.assertEqual(self.device_handler.addDevice(Device('aa', [])), 0)
+        self.assertEqual(self.device_handler.getDevice('bb'), 0)
+
+        self.assertEqual(self.device_handler.getOrAddDevice('aa', ['bb']), (device, False))
+        added, created = self.device_handler.getOrAddDevice('bb', ['aa'])
+        self.assertTrue(created)
+        self.assertEqual(added.neighbours, ['aa'])
+
+        self.device_handler.flush()
+        self.assertEqual(self.device_handler.getDevice('aa'), 0)
+
+    def test_good_commands(self):
+        self.assertEqual(self.parser.parse('add_device, aa'), 'ok')
+        self.assertEqual(self.parser.parse('add_device, aa'), 'already exists')
+        self.assertEqual(self.parser.parse('add_device, bb'), 'ok')
+        self.assertEqual(self.parser.parse('get_group, aa'), '[]')
+
+        self.assertEqual(self.parser.parse('set_group, cc, bb, unknown'), 'ok')
+        self.assertEqual(self.parser.parse('set_group, aa, bb'), 'ok')
+        # The group is sorted by the device id
+        self.assertEqual(self.parser.parse('get_group, bb'), 'aa,cc')
+        self.assertEqual(self.parser.parse('get_group, cc'), 'aa,bb')
+
+        self.assertEqual(self.parser.parse('set_group, cc'), 'ok')
+        self.assertEqual(self.parser.parse('get_group, cc'), '[]')
+        self.assertEqual(self.parser.parse('get_group, dd'), '[]')
+
+        self.assertEqual(self.parser.parse('flush'), 'ok')
+        self.assertEqual(self.parser.parse('get_group, aa'), '[]')
+
+    def test_good_concurrent_commands(self):
+        def register(thread):
+            for i in range(200):
+                device_id = '%i_%i' % (thread, i)
+                self.parser.parse('set_group, %s, %i_%i' % (device_id, thread, max(i - 1, 0)))
+                self.parser.parse('get_group, %s' % device_id)
+
+        threads = [threading.Thread(target=register, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.device_handler.devices), 8 * 200)
+        # The devices of every thread form a chain
+        self.assertEqual(len(self.parser.parse('get_group, 3_0').split(',')), 199)
@@ -0,0 +1,68 @@
+from core.recommenders import Recommender, RecommenderException, WeightedPolicy, ProximityCriterion, \
+    RecentUsageCriterion, role_count
+from django.test import TestCase
+import random
+
+def configuration(action_name, *device_ids):
+    return {'action_name': 'action_' + action_name,
+            'roles': [{'role_%s_d%i' % (action_name, i): 'id%i' % device_id}
+                      for i, device_id in enumerate(device_ids)]}
+
+class RecommenderTestCase(TestCase):
+
+    def setUp(self):
+        self.random = random.Random(0)
+        self.configurations = [configuration('Dialog', 1, 2), configuration('Conversation', 1, 2, 3),
+                               configuration('FakeCall', 3), configuration('ConversationOfThree', 4, 5, 6)]
+
+    def test_good_recommend(self):
+        recommender = Recommender(random_state=self.random)
+        selected = recommender.recommend(iter(self.configurations))
+        self.assertTrue(selected['action_name'] in ['action_Conversation', 'action_ConversationOfThree'])
+        self.assertEqual(selected['rank'], 3)
+
+    def test_good_uniform_ties(self):
+        recommender = Recommender(random_state=self.random)
+        counts = {}
+        for i in range(3000):
+            selected = recommender.recommend(configuration('Dialog', j) for j in range(3))
+            device_id = selected['roles'][0]['role_Dialog_d0']
+            counts[device_id] = counts.get(device_id, 0) + 1
+        self.assertEqual(sorted(counts.keys()), ['id0', 'id1', 'id2'])
+        for count in counts.values():
+            self.assertTrue(900 < count < 1100)
+
+    def test_good_recommend_top(self):
+        recommender = Recommender()
+        configurations = [configuration('Dialog', *range(self.random.randint(0, 6))) for i in range(200)]
+        expected = sorted(configurations, key=role_count, reverse=True)[:5]
+
+        top = recommender.recommend_top(iter(configurations), 5)
+        self.assertEqual([c['rank'] for c in top], [role_count(c) for c in expected])
+        # The equally ranked configurations are in the order they arrived in
+        self.assertEqual(top, expected)
+        self.assertEqual(recommender.recommend_top(configurations[:2], 5),
+                         sorted(configurations[:2], key=role_count, reverse=True))
+
+    def test_good_weighted_policy(self):
+        policy = WeightedPolicy([(1, role_count),
+                                 (10, ProximityCriterion([1, 2, 3])),
+                                 (-5, RecentUsageCriterion({'Conversation': 1}))])
+        recommender = Recommender(policy=policy)
+
+        # Dialog: 2 + 10 = 12, Conversation: 3 + 10 - 5 = 8, FakeCall: 1 + 10 = 11,
+        # ConversationOfThree: 3
+        top = recommender.recommend_top(self.configurations, 4)
+        self.assertEqual([c['action_name'] for c in top],
+                         ['action_Dialog', 'action_FakeCall', 'action_Conversation', 'action_ConversationOfThree'])
+        self.assertEqual(recommender.recommend(self.configurations)['action_name'], 'action_Dialog')
+
+    def test_good_default_policy_evaluate(self):
+        ranked = Recommender().getPolicy().evaluate(self.configurations)
+        self.assertEqual([c['rank'] for c in ranked], [3, 3, 2, 1])
+
+    def test_bad_no_configurations(self):
+        self.assertRaises(RecommenderException, Recommender().recommend, [])
+        self.assertEqual(Recommender().recommend_top([], 3), [])
+        self.assertEqual(Recommender().recommend_top(self.configurations, 0), [])
+        self.assertEqual(Recommender().recommend_top(iter(self.configurations), -1), [])
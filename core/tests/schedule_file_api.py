@@ -5,8 +5,8 @@ from django.test.testcases import TestCase
 from mock import patch
 import json
 
-# Patch the GenerateConfigurationModelThread with a mock object in every test
-@patch('core.signals.GenerateConfigurationModelThread', spec_set=True)
+# Patch the worker pool that runs the model generation with a mock object in every test
+@patch('core.signals.get_worker_pool')
 class ScheduleFileAPITestCase(TestCase):
     fixtures = ['schedule_file_api_testdata']
     
@@ -41,9 +41,9 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the upload of the schedule file triggered a signal
         # to generate the configuration model in a thread
         self.assertEqual(MockClass.call_count, 1)
-        self.assertEqual(MockClass.call_args[0][0].name, 'talkingDevicesSCH')
+        self.assertEqual(MockClass.return_value.submit.call_args[0][1].name, 'talkingDevicesSCH')
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 1)
+        self.assertEqual(mock.submit.call_count, 1)
         
         
         # calendarReminderSCH
@@ -62,9 +62,9 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the upload of the schedule file triggered a signal
         # to generate the configuration model in a thread
         self.assertEqual(MockClass.call_count, 1)
-        self.assertEqual(MockClass.call_args[0][0].name, 'calendarReminder')
+        self.assertEqual(MockClass.return_value.submit.call_args[0][1].name, 'calendarReminder')
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 1)
+        self.assertEqual(mock.submit.call_count, 1)
         
         
         # Check the final amount of schedules in the database
@@ -93,7 +93,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         # The schedule file does not contain any schedules
@@ -110,7 +110,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         # The schedule file does not contain any schedule actions
@@ -127,7 +127,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         # The schedule file does not contain a trigger method for the schedule
@@ -144,7 +144,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         # The schedule file does not contain an interface for the trigger method of the schedule
@@ -161,7 +161,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         # The schedule function does not have a return statement
@@ -178,7 +178,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         # The return statement of the schedule function does not contain a list
@@ -195,7 +195,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         # The return statement of the schedule function does not contain a list of variables
@@ -212,7 +212,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         # The schedule contains a duplicate action
@@ -229,7 +229,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         # A schedule already exists
@@ -246,7 +246,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         # Trigger method does not exist
@@ -263,7 +263,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         # Action does not exist
@@ -280,7 +280,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         # Action device does not exist for a specific trigger from position
@@ -297,7 +297,7 @@ class ScheduleFileAPITestCase(TestCase):
         # Check that the configuration model generator thread is not started
         self.assertEqual(MockClass.call_count, 0)
         mock = MockClass.return_value
-        self.assertEqual(mock.start.call_count, 0)
+        self.assertEqual(mock.submit.call_count, 0)
         
         
         
@@ -0,0 +1,73 @@
+from core.configuration_models import WcrlModelGenerator
+from core.models import Device, StateValue, Method
+from django.test import TestCase
+
+class SelectionInputTestCase(TestCase):
+    fixtures = ['schedule_file_api_testdata', 'configuration_snapshot_testdata']
+
+    def setUp(self):
+        self.generator = WcrlModelGenerator()
+
+    def add_devices(self, count):
+        # Skip the overridden save methods, so that no signals are sent
+        # and the devices are not registered to the proximity server
+        is_willing = Method.objects.get(name='isWilling')
+        for i in range(count):
+            mac_address = 'dd:dd:dd:dd:dd:%02x' % i
+            device = Device(mac_address=mac_address, name=mac_address)
+            super(Device, device).save()
+            state_value = StateValue(device=device, method=is_willing, value='True')
+            super(StateValue, state_value).save()
+
+    def test_good_selection_input(self):
+        selection_input = self.generator._get_selection_input({'action': 'Dialog', 'devices': [1, 2, 3],
+                                                               'roles': ['_anyvalue_', '_anyvalue_']})
+        self.assertEqual(selection_input, {'devices': [
+            {'id': 1, 'interfaces': ['TalkingDevice'],
+             'stateValues': [{'method': 'isWilling', 'value': 'True'}, {'method': 'isSilent', 'value': 'False'}]},
+            {'id': 2, 'interfaces': ['TalkingDevice'],
+             'stateValues': [{'method': 'isWilling', 'value': 'True'}]},
+            {'id': 3, 'interfaces': ['TalkingDevice'], 'stateValues': []}]})
+
+    def test_good_pre_matched_role(self):
+        selection_input = self.generator._get_selection_input({'action': 'FakeCall', 'devices': [1, 2],
+                                                               'roles': [1, '_anyvalue_']})
+        self.assertEqual(selection_input, {'devices': [{'role': 'role_FakeCall_d1', 'id': 1}]})
+
+    def test_good_state_value_arguments(self):
+        configurable_action = {'action': 'FakeCall', 'devices': [1, 2], 'roles': ['_anyvalue_', '_anyvalue_']}
+
+        # The state value with arguments is skipped without parameters
+        selection_input = self.generator._get_selection_input(configurable_action)
+        self.assertEqual(selection_input['devices'][0]['stateValues'], [])
+
+        configurable_action['parameters'] = {'eid': '1234'}
+        selection_input = self.generator._get_selection_input(configurable_action)
+        self.assertEqual(selection_input['devices'][0]['stateValues'],
+                         [{'method': 'eventApproaching', 'value': 'True'}])
+
+        configurable_action['parameters'] = {'eid': '4321'}
+        selection_input = self.generator._get_selection_input(configurable_action)
+        self.assertEqual(selection_input['devices'][0]['stateValues'],
+                         [{'method': 'eventApproaching', 'value': 'false'}])
+
+    def test_good_constant_queries(self):
+        configurable_actions = [{'action': 'Dialog', 'devices': [1, 2, 3], 'roles': ['_anyvalue_', '_anyvalue_']},
+                                {'action': 'FakeCall', 'devices': [1, 2, 3], 'roles': ['_anyvalue_', '_anyvalue_'],
+                                 'parameters': {'eid': '1234'}}]
+        # Four queries per action and two for the state values
+        self.assertNumQueries(10, self.generator._get_selection_input, configurable_actions)
+
+        self.add_devices(20)
+        device_ids = list(Device.objects.values_list('id', flat=True))
+        for configurable_action in configurable_actions:
+            configurable_action['devices'] = device_ids
+        self.assertNumQueries(10, self.generator._get_selection_input, configurable_actions)
+
+        selection_input = self.generator._get_selection_input(configurable_actions)
+        self.assertEqual(len(selection_input['devices']), len(device_ids))
+        self.assertEqual(selection_input['devices'][-1]['stateValues'], [{'method': 'isWilling', 'value': 'True'}])
+
+    def test_bad_unknown_action(self):
+        self.assertEqual(self.generator._get_selection_input({'action': 'Unknown', 'devices': [1], 'roles': []}),
+                         None)
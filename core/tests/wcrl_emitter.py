@@ -0,0 +1,83 @@
+from core.configuration_models import WcrlModelGenerator
+from django.template.loader import render_to_string
+from django.test import TestCase
+import random
+import re
+
+def render_template(template_name, ctx_dict):
+    # The former rendering of the WCRL models
+    result = render_to_string(template_name, ctx_dict)
+    result = re.sub(r'^[^\S\n]+', '', result, flags=re.MULTILINE)
+    result = re.sub(r'\n{2}', '\n', result, flags=re.MULTILINE)
+    result = re.sub(r'^\n{2,}', '\n', result, flags=re.MULTILINE)
+    return result
+
+class WcrlEmitterTestCase(TestCase):
+
+    def setUp(self):
+        self.generator = WcrlModelGenerator()
+        self.random = random.Random(0)
+
+    def emit_model(self, ctx_dict):
+        action_rules = [self.generator._get_action_rules(action) for action in ctx_dict['actions']]
+        return u''.join(self.generator._collapse_blank_lines(self.generator._iter_model_lines(action_rules,
+                                                                                              ctx_dict['devices'])))
+
+    def random_names(self, prefix, maximum):
+        return ['%s%i' % (prefix, i) for i in range(self.random.randint(0, maximum))]
+
+    def random_model_input(self):
+        actions = []
+        for action_name in self.random_names('Action', 3):
+            roles = []
+            for role_name in self.random_names('r', 3):
+                preconditions = [{'interface': self.random.choice(['TalkingDevice', 'CalendarSource']),
+                                  'method': method, 'value': self.random.choice(['true', ''])}
+                                 for method in self.random_names('method', 3)]
+                roles.append({'name': role_name, 'interfaces': self.random_names('Interface', 3),
+                              'preconditions': preconditions})
+            actions.append({'name': action_name, 'roles': roles,
+                            'constr': [(roles[i]['name'], roles[i + 1]['name']) for i in range(len(roles) - 1)]})
+        devices = [{'id': i, 'interfaces': self.random_names('Interface', 3)}
+                   for i in range(self.random.randint(0, 4))]
+        return {'actions': actions, 'devices': devices}
+
+    def random_selection_input(self):
+        devices = []
+        for i in range(self.random.randint(0, 4)):
+            if self.random.random() < 0.3:
+                devices.append({'role': 'role_Action_r%i' % i, 'id': i})
+            else:
+                devices.append({'id': i, 'interfaces': [],
+                                'stateValues': [{'method': method, 'value': self.random.choice(['true', 'false'])}
+                                                for method in self.random_names('method', 3)]})
+        return {'devices': devices}
+
+    def test_good_model_identical_to_template(self):
+        for i in range(200):
+            ctx_dict = self.random_model_input()
+            model = self.emit_model(ctx_dict)
+            self.assertEqual(model, render_template('model_templates/wcrl_model.lp', ctx_dict))
+
+    def test_good_escaped_names(self):
+        ctx_dict = {'actions': [{'name': 'A&B', 'roles': [{'name': 'r<1>', 'interfaces': ['I"1'],
+                                                           'preconditions': [{'interface': "I'1", 'method': 'm',
+                                                                              'value': 'true'}]}],
+                                 'constr': []}],
+                    'devices': [{'id': 1, 'interfaces': ['I&1']}]}
+        model = self.emit_model(ctx_dict)
+        self.assertEqual(model, render_template('model_templates/wcrl_model.lp', ctx_dict))
+
+    def test_good_selections_identical_to_template(self):
+        for i in range(200):
+            ctx_dict = self.random_selection_input()
+            selections = u''.join(self.generator._iter_selections(ctx_dict))
+            self.assertEqual(selections, render_template('model_templates/wcrl_selections.lp', ctx_dict))
+
+    def test_good_collapse_blank_lines(self):
+        for i in range(500):
+            lines = [self.random.choice(['', '', 'x']) for j in range(self.random.randint(0, 8))]
+            text = u'\n'.join(lines)
+            expected = re.sub(r'\n{2}', '\n', text, flags=re.MULTILINE)
+            expected = re.sub(r'^\n{2,}', '\n', expected, flags=re.MULTILINE)
+            self.assertEqual(u''.join(self.generator._collapse_blank_lines(lines)), expected)
@@ -0,0 +1,48 @@
+from core.configuration_models import WcrlModelGenerator, WcrlRuleCache
+from core.models import ActionDevice
+from django.test import TransactionTestCase
+
+class WcrlRuleCacheTestCase(TransactionTestCase):
+    # The fixtures are committed, so that the membership matrix is cached
+    fixtures = ['schedule_file_api_testdata', 'configuration_snapshot_testdata']
+
+    def setUp(self):
+        self.cache = WcrlRuleCache()
+        self.generator = WcrlModelGenerator(rule_cache=self.cache)
+        self.configurable_action = {'action': 'FakeCall', 'devices': [1, 2], 'roles': ['_anyvalue_', '_anyvalue_']}
+
+    def uncached_model(self):
+        ctx_dict = self.generator._get_model_input(self.configurable_action)
+        action_rules = [self.generator._get_action_rules(action) for action in ctx_dict['actions']]
+        return u''.join(self.generator._collapse_blank_lines(self.generator._iter_model_lines(action_rules,
+                                                                                              ctx_dict['devices'])))
+
+    def test_good_cached_rules(self):
+        model = self.generator.generate_configuration_model(self.configurable_action)
+        self.assertEqual(model, self.uncached_model())
+        self.assertTrue('role_FakeCall_d1_device(D) :- ' in model)
+        self.assertTrue('device_TalkingDevice(id2).' in model)
+
+        # Only the device facts are generated, which needs no queries
+        self.assertNumQueries(0, self.generator.generate_configuration_model, self.configurable_action)
+        self.assertEqual(self.generator.generate_configuration_model(self.configurable_action), model)
+        self.assertEqual(self.cache.get_stats(), {'hits': 2, 'misses': 1})
+
+    def test_good_changed_action_definition(self):
+        self.generator.generate_configuration_model(self.configurable_action)
+
+        action_device = ActionDevice.objects.get(action__name='FakeCall', name='d1')
+        action_device.name = 'caller'
+        action_device.save()
+
+        model = self.generator.generate_configuration_model(self.configurable_action)
+        self.assertEqual(self.cache.get_stats()['misses'], 2)
+        self.assertTrue('role_FakeCall_caller_device(D) :- ' in model)
+        self.assertFalse('role_FakeCall_d1' in model)
+        self.assertEqual(model, self.uncached_model())
+
+    def test_bad_unknown_action(self):
+        model = self.generator.generate_configuration_model({'action': 'Unknown', 'devices': [1], 'roles': []})
+        self.assertFalse('action(action_' in model)
+        self.assertFalse('device_' in model)
+        self.assertEqual(self.cache.get_stats()['misses'], 1)
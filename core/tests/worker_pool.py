@@ -0,0 +1,146 @@
+from core.workers import WorkerPool, WorkerPoolFullError, CoalescingScheduler
+from django.test import TestCase
+from mock import patch
+import threading
+
+class WorkerPoolTestCase(TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool('test', num_workers=2, max_queue_size=2,
+                               queue_timeout=0.1)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_good_submit(self):
+        job = self.pool.submit(lambda x, y: x + y, 1, y=2)
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.result, 3)
+        self.assertEqual(job.exception, None)
+        self.assertTrue(job.queue_wait >= 0)
+        self.assertTrue(job.run_time >= 0)
+
+        stats = self.pool.get_stats()
+        self.assertEqual(stats['submitted'], 1)
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(stats['rejected'], 0)
+
+    def test_good_failing_job(self):
+        def fail():
+            raise ValueError('failed')
+
+        job = self.pool.submit(fail)
+        self.assertTrue(job.wait(5))
+        self.assertTrue(isinstance(job.exception, ValueError))
+
+        # The worker survives the failure and runs the next job
+        job = self.pool.submit(lambda: 'ok')
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.result, 'ok')
+
+        stats = self.pool.get_stats()
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['failed'], 1)
+
+    def test_bad_submit_queue_full(self):
+        release = threading.Event()
+
+        # Occupy both workers and fill the queue
+        jobs = []
+        for i in range(4):
+            jobs.append(self.pool.submit(release.wait))
+
+        self.assertRaises(WorkerPoolFullError, self.pool.submit, release.wait)
+        self.assertEqual(self.pool.get_stats()['rejected'], 1)
+
+        release.set()
+        for job in jobs:
+            self.assertTrue(job.wait(5))
+
+        stats = self.pool.get_stats()
+        self.assertEqual(stats['submitted'], 4)
+        self.assertEqual(stats['completed'], 4)
+        self.assertEqual(stats['queue_size'], 0)
+        self.assertTrue(stats['max_queue_wait'] > 0)
+
+    def test_good_bounded_concurrency(self):
+        lock = threading.Lock()
+        running = {'current': 0, 'max': 0}
+        release = threading.Event()
+
+        def task():
+            with lock:
+                running['current'] += 1
+                running['max'] = max(running['max'], running['current'])
+            release.wait(1)
+            with lock:
+                running['current'] -= 1
+
+        jobs = [self.pool.submit(task) for i in range(4)]
+        release.set()
+        for job in jobs:
+            self.assertTrue(job.wait(5))
+
+        self.assertTrue(running['max'] <= 2)
+
+
+class CoalescingSchedulerTestCase(TestCase):
+
+    def test_good_coalesce(self):
+        lock = threading.Lock()
+        calls = []
+        done = threading.Event()
+
+        def task(key, value):
+            with lock:
+                calls.append((key, value))
+                if len(calls) == 2:
+                    done.set()
+
+        scheduler = CoalescingScheduler(0.2, pool_name='test-coalescing')
+        scheduler.schedule(1, task, 1, 'first')
+        scheduler.schedule(2, task, 2, 'first')
+        scheduler.schedule(1, task, 1, 'second')
+        scheduler.schedule(1, task, 1, 'third')
+        self.assertEqual(scheduler.get_stats()['pending'], 2)
+
+        # The timer submits one job per key after the window
+        self.assertTrue(done.wait(5))
+        self.assertEqual(sorted(calls), [(1, 'third'), (2, 'first')])
+
+        stats = scheduler.get_stats()
+        self.assertEqual(stats['scheduled'], 4)
+        self.assertEqual(stats['coalesced'], 2)
+        self.assertEqual(stats['submitted'], 2)
+        self.assertEqual(stats['pending'], 0)
+
+    def test_good_flush(self):
+        done = threading.Event()
+
+        scheduler = CoalescingScheduler(60, pool_name='test-coalescing')
+        scheduler.schedule('key', done.set)
+        scheduler.flush()
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(scheduler.get_stats()['pending'], 0)
+
+    def test_bad_full_pool(self):
+        pool = WorkerPool('test-full', num_workers=1, max_queue_size=1, queue_timeout=0.1)
+        self.addCleanup(pool.shutdown)
+        started = threading.Event()
+        release = threading.Event()
+        self.addCleanup(release.set)
+        # The worker is busy and the queue is full
+        pool.submit(lambda: (started.set(), release.wait()))
+        self.assertTrue(started.wait(5))
+        pool.submit(release.wait)
+
+        scheduler = CoalescingScheduler(60, pool_name='test-full')
+        scheduler.schedule('key', release.set)
+        with patch('core.workers.get_worker_pool', return_value=pool):
+            scheduler.flush()
+
+        # The dropped job is not counted as submitted
+        stats = scheduler.get_stats()
+        self.assertEqual((stats['submitted'], stats['pending']), (0, 0))
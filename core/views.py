@@ -1,6 +1,7 @@
 from core.clients import CaasClient, CaasConnectionError, CaasTimeoutError, \
-    CaasNotFoundError, CaasInternalServerError
+    CaasNotFoundError, CaasInternalServerError, CaasReplyParseError
 from core.configuration_models import WcrlModelGenerator
+from core.workers import WorkerPoolFullError, get_worker_pool
 from core.forms import UploadInterfaceFileForm, UploadActionFileForm, \
     UploadScheduleFileForm, ConfigurationForm
 from django.http import HttpResponse, HttpResponseBadRequest
@@ -13,10 +14,18 @@ import logging
 import kurre.settings as settings
 from models import Device
 from recommenders import Recommender, RecommenderException
+import time
 
 logger = logging.getLogger(__name__)
 event_handler = EventHandler()
 
+# Seconds a configuration request waits for the separate configurations
+# of its actions, before it settles for the configurations gathered so far
+DEFAULT_CAAS_DEADLINE = 15
+# The number of the best configurations of an action that are kept, when
+# the actions are configured separately
+DEFAULT_TOP_CONFIGURATIONS = 10
+
 @csrf_exempt
 @require_http_methods(['POST'])
 def parse_interfaces(request):
@@ -77,6 +86,84 @@ def parse_schedules(request):
         return HttpResponseBadRequest(json.dumps(form.errors), mimetype='application/json')
 
 
+def _get_top_configurations(client, recommender, top, model_name, model, selections):
+    """Get the best configurations of a model while the Caas reply is read.
+
+    Returns:
+        * A list of at most top configuration dictionaries ordered by the
+          rank from the highest, or None, if Caas found no configurations.
+
+    """
+    configurations = client.upload_and_get_wcrl_configuration(model_name, model, selections)
+    if configurations is None:
+        return None
+    return recommender.recommend_top(configurations, top)
+
+
+def _get_separate_configurations(client, model_generator, actions, deadline,
+                                 worker_pool=None, recommender=None,
+                                 top=DEFAULT_TOP_CONFIGURATIONS):
+    """Get the configurations of actions that are configured separately.
+
+    The models and the selections of the actions are generated in the
+    calling thread, and the CaaS requests are sent and their replies read
+    concurrently through a worker pool. Only the best configurations of
+    each action are kept, while its reply is read. The configurations are
+    merged in the order of the actions, so the result does not depend on
+    the order the replies arrive in.
+
+    Args:
+        * client: A :class:`CaasClient` object.
+        * model_generator: A :class:`WcrlModelGenerator` object.
+        * actions: A list of configurable action dictionaries.
+        * deadline: The maximum time to wait for the configurations in
+          seconds.
+        * worker_pool: The :class:`WorkerPool` object for the requests. The
+          shared ``caas`` worker pool is used by default.
+        * recommender: The :class:`Recommender` object that ranks the
+          configurations.
+        * top: The number of the best configurations kept of an action.
+
+    Returns:
+        * A tuple of a list of the configurations and a boolean, which is
+          False, if the deadline passed before all of the replies arrived.
+          The configurations of the late replies are left out.
+
+    Raises:
+        * The :class:`CaasError` of a failed request, or
+          :class:`WorkerPoolFullError`, if the requests could not be queued.
+
+    """
+    worker_pool = worker_pool or get_worker_pool('caas')
+    recommender = recommender or Recommender()
+    expires_at = time.time() + deadline
+
+    jobs = []
+    for action in actions:
+        # The database is only accessed in this thread
+        wcrl_model = model_generator.generate_configuration_model(action)
+        wcrl_selections = model_generator.generate_configuration_selections(action)
+        jobs.append(worker_pool.submit(_get_top_configurations, client, recommender, top,
+                                       'test', wcrl_model, wcrl_selections))
+
+    configurations = []
+    complete = True
+    for action, job in zip(actions, jobs):
+        if not job.wait(max(expires_at - time.time(), 0)):
+            logger.warning('The configuration of action {0} did not arrive '
+                           'before the deadline'.format(action['action']))
+            complete = False
+            continue
+
+        if job.exception is not None:
+            raise job.exception
+
+        if job.result is not None:
+            configurations += job.result
+
+    return configurations, complete
+
+
 @csrf_exempt
 @require_http_methods(['POST'])
 def get_configuration(request):
@@ -96,6 +183,8 @@ def get_configuration(request):
         # contains preset roles)
         separate_actions = False
         client = CaasClient()
+        # let's create a simple random-largest -recommender
+        recommender = Recommender()
         
         for action in actions:
          #convert device external id:s to internal (wcrl does not support @:s)
@@ -110,27 +199,30 @@ def get_configuration(request):
                 break
             
         if separate_actions:
-            configurations = []
-            i=0
-            for action in actions:
-                wcrl_model = model_generator.generate_configuration_model(action)
-                wcrl_selections = model_generator.generate_configuration_selections(action)
-                
-                try:
-                    configuration = client.upload_and_get_wcrl_configuration('test', wcrl_model, wcrl_selections)
-                except (CaasConnectionError, CaasTimeoutError, CaasNotFoundError, CaasInternalServerError), e:
-                    logger.error('The request to Caas failed: {0}'.format(e))
-                    event_handler.add_event('The request to Caas failed: {0}'.format(e))
-                    return HttpResponseBadRequest()
-
-                if configuration == None:
-                    continue
-                
-                configurations += configuration
+            deadline = getattr(settings, 'CAAS', {}).get('DEADLINE',
+                                                         DEFAULT_CAAS_DEADLINE)
+            top = getattr(settings, 'CAAS', {}).get('TOP_CONFIGURATIONS',
+                                                    DEFAULT_TOP_CONFIGURATIONS)
+            try:
+                configurations, complete = _get_separate_configurations(client, model_generator,
+                                                                        actions, deadline,
+                                                                        recommender=recommender,
+                                                                        top=top)
+            except (CaasConnectionError, CaasTimeoutError, CaasNotFoundError, CaasInternalServerError,
+                    CaasReplyParseError, WorkerPoolFullError), e:
+                logger.error('The request to Caas failed: {0}'.format(e))
+                event_handler.add_event('The request to Caas failed: {0}'.format(e))
+                return HttpResponseBadRequest()
+
+            if not complete:
+                event_handler.add_event('Configuration request passed the deadline of {0} seconds, '
+                                        'using {1} configurations'.format(deadline, len(configurations)))
+            if not configurations:
+                return HttpResponse(status=204)
             
         else:            
-            wcrl_model = model_generator.generate_configuration_model(actions)
-            wcrl_selections = model_generator.generate_configuration_selections(actions)
+            wcrl_model = model_generator.iter_configuration_model(actions)
+            wcrl_selections = model_generator.iter_configuration_selections(actions)
             model_name = 'test'
             
             try:
@@ -140,18 +232,23 @@ def get_configuration(request):
                 event_handler.add_event('The request to Caas failed: {0}'.format(e))
                 return HttpResponseBadRequest()
             else:
-                event_handler.add_event('Configuration request for model {0} with selections {1} sent to Caas'.format(model_name, wcrl_selections))
+                # The selections were streamed to Caas and are not kept
+                event_handler.add_event('Configuration request for model {0} with {1} actions sent to Caas'.format(model_name, len(actions)))
         
         if configurations == None:
             return HttpResponse(status=204)
 
-        # let's create a simple random-largest -recommender
         try:
-            recommender = Recommender()
+            # The reply is read and parsed while the configurations are ranked
             selected = recommender.recommend( configurations )
+        except (CaasConnectionError, CaasTimeoutError, CaasReplyParseError), e:
+            logger.error('The reply of Caas could not be read: {0}'.format(e))
+            event_handler.add_event('The reply of Caas could not be read: {0}'.format(e))
+            return HttpResponseBadRequest()
         except RecommenderException, e:
+            # The reply had no configurations
             logger.debug( 'Caught recommender exception: {0}'.format(e) )
-            selected = random.choice( configurations )[0]
+            return HttpResponse(status=204)
         
         # clear out the added string elements for configuration
         ret = {}
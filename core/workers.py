@@ -0,0 +1,406 @@
+"""This module provides bounded worker pools for running background tasks.
+
+The tasks in :mod:`core.tasks` are started from Django signals, e.g., when a
+state value triggers a configuration or when a schedule is added. Instead of
+starting a new thread for every signal, the tasks are submitted to a worker
+pool that has a fixed number of worker threads and a bounded job queue.
+
+Exported classes:
+    * :class:`Job`: A class for jobs that have been submitted to a worker
+      pool.
+    * :class:`WorkerPool`: A class for bounded worker pools.
+    * :class:`WorkerPoolFullError`: An exception raised when the job queue of
+      a worker pool is full.
+    * :class:`CoalescingScheduler`: A class for collapsing repeated jobs
+      within a time window into one job.
+
+Exported functions:
+    * get_worker_pool: Get a shared worker pool by its name.
+
+"""
+
+from django.conf import settings
+from django.db import close_connection
+import Queue
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NUM_WORKERS = 4
+DEFAULT_MAX_QUEUE_SIZE = 100
+DEFAULT_QUEUE_TIMEOUT = 5
+
+
+class Job(object):
+    """A class for jobs that have been submitted to a worker pool.
+
+    Instance attributes:
+        * func: The callable that is run by the job.
+        * args: A tuple of positional arguments for the callable.
+        * kwargs: A dictionary of keyword arguments for the callable.
+        * submitted_at: The time the job was submitted as seconds since the
+          epoch.
+        * started_at: The time a worker started the job, or None.
+        * finished_at: The time the job finished, or None.
+        * result: The return value of the callable, or None.
+        * exception: The exception raised by the callable, or None.
+
+    Public functions:
+        * wait: Wait for the job to finish.
+
+    """
+
+    def __init__(self, func, args, kwargs):
+        """Initialize the Job."""
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.exception = None
+        self._done = threading.Event()
+
+    def __repr__(self):
+        """Return a string representation of the :class:`Job` object."""
+        return '<Job %s>' % getattr(self.func, '__name__', repr(self.func))
+
+    def _get_queue_wait(self):
+        """Get the time the job waited in the queue in seconds, or None."""
+        if self.started_at is None:
+            return None
+        return self.started_at - self.submitted_at
+
+    queue_wait = property(_get_queue_wait)
+
+    def _get_run_time(self):
+        """Get the time it took to run the job in seconds, or None."""
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    run_time = property(_get_run_time)
+
+    def _run(self):
+        """Run the job and store its result or exception."""
+        self.started_at = time.time()
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except Exception, e:
+            self.exception = e
+            logger.exception('Job %r failed: %s' % (self, e))
+        finally:
+            self.finished_at = time.time()
+
+    def done(self):
+        """Return True, if the job has finished."""
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for the job to finish.
+
+        Args:
+            * timeout: The maximum time to wait in seconds. If None, wait
+              until the job has finished.
+
+        Returns:
+            * True, if the job has finished, otherwise False.
+
+        """
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+
+class WorkerPool(object):
+    """A class for bounded worker pools.
+
+    The worker threads are started lazily, when the first job is submitted.
+    When the job queue is full, :func:`submit` blocks the caller for at most
+    ``queue_timeout`` seconds, which slows down the producers of the jobs,
+    before it gives up and raises a :class:`WorkerPoolFullError`.
+
+    Instance attributes:
+        * name: The name of the worker pool.
+        * num_workers: The number of worker threads.
+        * max_queue_size: The maximum number of jobs waiting in the queue.
+        * queue_timeout: The time in seconds to block a submitter, when the
+          queue is full.
+
+    Public functions:
+        * submit: Submit a job to the worker pool.
+        * get_stats: Get the job metrics of the worker pool.
+        * shutdown: Stop the worker threads.
+
+    """
+
+    def __init__(self, name='default', num_workers=DEFAULT_NUM_WORKERS,
+                 max_queue_size=DEFAULT_MAX_QUEUE_SIZE,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        """Initialize the WorkerPool."""
+        self.name = name
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self._queue = Queue.Queue(max_queue_size)
+        self._workers = []
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'rejected': 0, 'completed': 0,
+                       'failed': 0, 'total_queue_wait': 0.0,
+                       'max_queue_wait': 0.0, 'total_run_time': 0.0,
+                       'max_run_time': 0.0}
+
+    def _start_workers(self):
+        """Start the worker threads, if they have not been started yet."""
+        with self._lock:
+            while len(self._workers) < self.num_workers:
+                worker = threading.Thread(target=self._work,
+                                          name='%s-worker-%i' %
+                                               (self.name, len(self._workers)))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        """Run jobs from the queue until a sentinel is received."""
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+
+            try:
+                job._run()
+            finally:
+                # Every worker thread has its own database connection, which
+                # is closed so that idle workers do not hold on to it.
+                close_connection()
+                self._record(job)
+                job._done.set()
+                self._queue.task_done()
+
+    def _record(self, job):
+        """Update the job metrics with a finished job."""
+        with self._lock:
+            if job.exception is None:
+                self._stats['completed'] += 1
+            else:
+                self._stats['failed'] += 1
+            self._stats['total_queue_wait'] += job.queue_wait
+            self._stats['max_queue_wait'] = max(self._stats['max_queue_wait'],
+                                                job.queue_wait)
+            self._stats['total_run_time'] += job.run_time
+            self._stats['max_run_time'] = max(self._stats['max_run_time'],
+                                              job.run_time)
+
+        logger.debug('Job %r finished in pool %s: queue wait %.3f s, '
+                     'run time %.3f s' %
+                     (job, self.name, job.queue_wait, job.run_time))
+
+    def submit(self, func, *args, **kwargs):
+        """Submit a job to the worker pool.
+
+        Args:
+            * func: The callable to run.
+            * args: Positional arguments for the callable.
+            * kwargs: Keyword arguments for the callable.
+
+        Returns:
+            * A :class:`Job` object.
+
+        Raises:
+            * :class:`WorkerPoolFullError`, if the job queue stayed full for
+              ``queue_timeout`` seconds.
+
+        """
+        self._start_workers()
+
+        job = Job(func, args, kwargs)
+        try:
+            self._queue.put(job, True, self.queue_timeout)
+        except Queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise WorkerPoolFullError('The job queue of worker pool %s is '
+                                      'full (%i jobs)' %
+                                      (self.name, self.max_queue_size))
+
+        with self._lock:
+            self._stats['submitted'] += 1
+
+        return job
+
+    def get_stats(self):
+        """Get the job metrics of the worker pool.
+
+        Returns:
+            * A dictionary containing the number of submitted, rejected,
+              completed and failed jobs, the current queue size and the
+              total, average and maximum queue wait and run times in seconds.
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+
+        finished = stats['completed'] + stats['failed']
+        stats['queue_size'] = self._queue.qsize()
+        stats['avg_queue_wait'] = (stats['total_queue_wait'] / finished
+                                   if finished else 0.0)
+        stats['avg_run_time'] = (stats['total_run_time'] / finished
+                                 if finished else 0.0)
+
+        return stats
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads after the queued jobs have been run.
+
+        Args:
+            * wait: If True, block until the worker threads have stopped.
+
+        """
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+
+        for worker in workers:
+            self._queue.put(None)
+
+        if wait:
+            for worker in workers:
+                worker.join()
+
+
+class WorkerPoolFullError(Exception):
+    """Used to indicate that the job queue of a worker pool is full."""
+    pass
+
+
+class CoalescingScheduler(object):
+    """A class for collapsing repeated jobs within a time window into one job.
+
+    Jobs are scheduled with a key. The first scheduled job starts a timer and
+    all jobs scheduled with the same key before the timer fires are
+    collapsed into one, the latest of them. When the timer fires, one job per
+    key is submitted to a worker pool.
+
+    Instance attributes:
+        * window: The length of the time window in seconds. If the window is
+          0, the jobs are submitted immediately.
+        * pool_name: The name of the worker pool the jobs are submitted to.
+
+    Public functions:
+        * schedule: Schedule a job.
+        * flush: Submit all pending jobs immediately.
+        * get_stats: Get the scheduling metrics.
+
+    """
+
+    def __init__(self, window, pool_name='default'):
+        """Initialize the CoalescingScheduler."""
+        self.window = window
+        self.pool_name = pool_name
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+        self._stats = {'scheduled': 0, 'coalesced': 0, 'submitted': 0}
+
+    def schedule(self, key, func, *args):
+        """Schedule a job.
+
+        Args:
+            * key: A hashable key that identifies the job. A pending job with
+              the same key is replaced.
+            * func: The callable to run.
+            * args: Positional arguments for the callable.
+
+        """
+        with self._lock:
+            self._stats['scheduled'] += 1
+            if key in self._pending:
+                self._stats['coalesced'] += 1
+            self._pending[key] = (func, args)
+
+            if self.window > 0 and self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if self.window <= 0:
+            self.flush()
+
+    def flush(self):
+        """Submit all pending jobs to the worker pool immediately."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending = self._pending
+            self._pending = {}
+            # The jobs are counted as they leave the pending jobs, so the
+            # stats never miss a job between pending and submitted
+            self._stats['submitted'] += len(pending)
+
+        pool = get_worker_pool(self.pool_name)
+        for key, (func, args) in pending.items():
+            try:
+                pool.submit(func, *args)
+            except WorkerPoolFullError, e:
+                logger.error('Coalesced job %r was dropped: %s' % (key, e))
+                with self._lock:
+                    self._stats['submitted'] -= 1
+
+    def get_stats(self):
+        """Get the scheduling metrics.
+
+        Returns:
+            * A dictionary containing the number of scheduled, coalesced and
+              submitted jobs and the number of pending jobs.
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+
+        return stats
+
+
+_worker_pools = {}
+_worker_pools_lock = threading.Lock()
+
+
+def get_worker_pool(name='default'):
+    """Get a shared worker pool by its name.
+
+    The worker pool is created on the first call and configured with the
+    ``WORKER_POOLS`` setting, for instance::
+
+        WORKER_POOLS = {
+            'default': {
+                'NUM_WORKERS': 4,
+                'MAX_QUEUE_SIZE': 100,
+                'QUEUE_TIMEOUT': 5,
+            },
+        }
+
+    Args:
+        * name: The name of the worker pool.
+
+    Returns:
+        * A :class:`WorkerPool` object.
+
+    """
+    with _worker_pools_lock:
+        if name not in _worker_pools:
+            config = getattr(settings, 'WORKER_POOLS', {}).get(name, {})
+            _worker_pools[name] = WorkerPool(
+                    name,
+                    num_workers=config.get('NUM_WORKERS',
+                                           DEFAULT_NUM_WORKERS),
+                    max_queue_size=config.get('MAX_QUEUE_SIZE',
+                                              DEFAULT_MAX_QUEUE_SIZE),
+                    queue_timeout=config.get('QUEUE_TIMEOUT',
+                                             DEFAULT_QUEUE_TIMEOUT))
+
+        return _worker_pools[name]
@@ -0,0 +1,240 @@
+"""This module provides the asynchronous emission of events.
+
+The hot write paths, such as saving the state values of thousands of
+devices, emit their events with :meth:`events.event.EventHandler.emit`
+instead of adding them. An emitted event is sampled and rate limited by its
+category and put on a bounded in-process queue without formatting the
+description or accessing the cache, so emitting never blocks the request.
+The event flusher of the process drains the queue every FLUSH_INTERVAL
+seconds, formats the descriptions and adds the events in batches, see
+:mod:`events.flusher`.
+
+The categories are configured with the ``EVENTS`` setting, for instance::
+
+    EVENTS = {
+        'EMITTER': {
+            'ENABLED': True,
+            'MAX_QUEUE_SIZE': 10000,
+            'MAX_BATCH': 100,
+            'FLUSH_INTERVAL': 0.2,
+            'CATEGORIES': {
+                'state_value': {
+                    'SAMPLE_RATE': 0.5,
+                    'RATE_LIMIT': 50,
+                    'BURST': 100,
+                },
+            },
+        },
+    }
+
+A category keeps the share SAMPLE_RATE of its events and at most
+RATE_LIMIT events per second on average with bursts of BURST events. The
+categories without a configuration use the 'DEFAULT' category, which keeps
+all events by default.
+
+Exported classes:
+    * :class:`EventEmitter`: A class for the asynchronous emission of
+      events.
+
+Exported functions:
+    * get_event_emitter: Get the event emitter of the process.
+
+"""
+
+from datetime import datetime
+from django.conf import settings
+from events.flusher import get_event_flusher
+import Queue
+import logging
+import random
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_QUEUE_SIZE = 10000
+DEFAULT_MAX_BATCH = 100
+DEFAULT_FLUSH_INTERVAL = 0.2
+
+
+class EventEmitter(object):
+    """A class for the asynchronous emission of events.
+
+    Instance attributes:
+        * add_events: The function that adds a list of event dictionaries.
+        * categories: A dictionary of the category settings by the category.
+        * max_batch: The maximum number of events added at a time.
+        * flush_interval: The seconds between the flushes of the queue.
+
+    Public functions:
+        * emit: Queue an event without blocking.
+        * flush: Add the queued events.
+        * get_stats: Get the event counts by the category.
+
+    """
+
+    def __init__(self, add_events, categories=None,
+                 max_queue_size=DEFAULT_MAX_QUEUE_SIZE,
+                 max_batch=DEFAULT_MAX_BATCH,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """Initialize the EventEmitter."""
+        self.add_events = add_events
+        self.categories = categories or {}
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue = Queue.Queue(max_queue_size)
+        # The token buckets of the rate limits by the category
+        self._buckets = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._registered = False
+
+    def _get_config(self, category):
+        return self.categories.get(category, self.categories.get('DEFAULT', {}))
+
+    def _count(self, category, name, count=1):
+        stats = self._stats.setdefault(category, {'queued': 0, 'sampled': 0,
+                                                  'limited': 0, 'dropped': 0,
+                                                  'added': 0})
+        stats[name] += count
+
+    def _take_token(self, category, config, now):
+        rate = config.get('RATE_LIMIT')
+        if rate is None:
+            return True
+        burst = config.get('BURST', rate)
+        tokens, updated_at = self._buckets.get(category, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        if tokens < 1:
+            self._buckets[category] = (tokens, now)
+            return False
+        self._buckets[category] = (tokens - 1, now)
+        return True
+
+    def emit(self, category, message, *args, **fields):
+        """Queue an event without blocking.
+
+        Args:
+            * category: The category of the event, e.g., 'state_value'.
+            * message: The description of the event as a format string.
+            * args: The arguments of the format string, which are formatted
+              when the event is added.
+            * fields: The other structured fields of the event, e.g.,
+              device. See :mod:`events.store`.
+
+        Returns:
+            * True, if the event was queued, or False, if it was sampled
+              out, rate limited or dropped because the queue was full.
+
+        """
+        config = self._get_config(category)
+        now = time.time()
+        with self._lock:
+            if random.random() >= config.get('SAMPLE_RATE', 1.0):
+                self._count(category, 'sampled')
+                return False
+            if not self._take_token(category, config, now):
+                self._count(category, 'limited')
+                return False
+
+        try:
+            self._queue.put_nowait((datetime.now(), category, message, args, fields))
+        except Queue.Full:
+            with self._lock:
+                self._count(category, 'dropped')
+            return False
+
+        with self._lock:
+            self._count(category, 'queued')
+        if not self._registered:
+            # The queue is flushed by the event flusher of the process
+            self._registered = True
+            get_event_flusher().register(self.flush, self.flush_interval)
+        return True
+
+    def _format(self, date, category, message, args, fields):
+        try:
+            description = message % args if args else message
+        except (TypeError, ValueError), e:
+            logger.error('Formatting the event %r failed: %s' % (message, e))
+            description = message
+        event_dict = dict(fields, category=category)
+        event_dict['date'] = date.strftime('%Y-%m-%d %H:%M:%S')
+        event_dict['description'] = description
+        return event_dict
+
+    def flush(self):
+        """Add the queued events.
+
+        Only the events queued so far are added, in batches of at most
+        max_batch events.
+
+        Returns:
+            * The number of added events.
+
+        """
+        added = 0
+        for i in range(0, self._queue.qsize(), self.max_batch):
+            events = []
+            added_by_category = {}
+            for j in range(self.max_batch):
+                try:
+                    date, category, message, args, fields = self._queue.get_nowait()
+                except Queue.Empty:
+                    break
+                events.append(self._format(date, category, message, args, fields))
+                added_by_category[category] = added_by_category.get(category, 0) + 1
+            if not events:
+                break
+
+            self.add_events(events)
+            added += len(events)
+            with self._lock:
+                for category, count in added_by_category.items():
+                    self._count(category, 'added', count)
+        return added
+
+    def get_stats(self):
+        """Get the event counts by the category.
+
+        Returns:
+            * A dictionary of dictionaries containing the numbers of the
+              queued, sampled out, rate limited, dropped and added events by
+              the category.
+
+        """
+        with self._lock:
+            return dict([(category, dict(stats))
+                         for category, stats in self._stats.items()])
+
+
+_event_emitter = None
+_event_emitter_lock = threading.Lock()
+
+
+def get_event_emitter(add_events):
+    """Get the event emitter of the process.
+
+    Args:
+        * add_events: The function that adds a list of event dictionaries.
+
+    Returns:
+        * An :class:`EventEmitter` object, or None, if the asynchronous
+          emission is disabled by the ``EVENTS`` setting.
+
+    """
+    global _event_emitter
+    config = getattr(settings, 'EVENTS', {}).get('EMITTER', {})
+    if not config.get('ENABLED', False):
+        return None
+
+    with _event_emitter_lock:
+        if _event_emitter is None:
+            _event_emitter = EventEmitter(
+                    add_events,
+                    categories=config.get('CATEGORIES', {}),
+                    max_queue_size=config.get('MAX_QUEUE_SIZE', DEFAULT_MAX_QUEUE_SIZE),
+                    max_batch=config.get('MAX_BATCH', DEFAULT_MAX_BATCH),
+                    flush_interval=config.get('FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+        return _event_emitter
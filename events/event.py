@@ -1,23 +1,173 @@
+from collections import deque
 from datetime import datetime
+from django.conf import settings
 from django.core.cache import cache
-from operator import itemgetter
-from threading import Lock
+from events.emitter import get_event_emitter
+from events.flusher import get_event_flusher
+from events.notifier import get_event_notifier
+from events.store import get_event_store
+import threading
 
 import logging
 
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_BATCH_DELAY = 0.5
+# The sequence number is kept as long as the cache allows, since an
+# increment does not extend the timeout. A timeout of 0 would be the
+# default timeout of the cache.
+SEQUENCE_NUMBER_TIMEOUT = 60*60*24*365
+
+def _restart_sequence_number():
+    """Create the sequence number after the events in the store.
+
+    The sequence number restarts after the highest sequence number left in
+    the ring buffer, so the sequence numbers of the stored events are not
+    reused. If another process restarts it first, its sequence number is
+    kept.
+
+    """
+    cache.add('event_seq_num', get_event_store().get_last_sequence_number() + 1,
+              SEQUENCE_NUMBER_TIMEOUT)
+
+def _allocate_sequence_numbers(count=1):
+    """Allocate consecutive sequence numbers for events.
+
+    The numbers are allocated with an atomic increment of the sequence
+    number in the cache, so the processes never get the same numbers
+    without any locking. The increment is atomic with memcached, but not
+    with the local memory cache.
+
+    Returns:
+        * The first of the allocated sequence numbers.
+
+    """
+    try:
+        next_seq_num = cache.incr('event_seq_num', count)
+    except ValueError:
+        # The sequence number has expired or been evicted
+        _restart_sequence_number()
+        next_seq_num = cache.incr('event_seq_num', count)
+    return next_seq_num - count
+
+def _add_events(events):
+    """Add events with a single allocation of sequence numbers.
+
+    Args:
+        * events: A list of event dictionaries containing the date and the
+          description.
+
+    """
+    first_seq_num = _allocate_sequence_numbers(len(events))
+    get_event_store().append(first_seq_num, events)
+    get_event_notifier().publish(first_seq_num + len(events))
+
+class EventBuffer(object):
+    """A class for adding the events of a process in batches.
+
+    The buffered events are added with a single allocation of sequence
+    numbers and a single set_many, when the buffer has max_events events or
+    when the oldest event has waited max_delay seconds.
+
+    Public functions:
+        * add: Buffer an event.
+        * flush: Add the buffered events.
+
+    """
+
+    def __init__(self, max_events=DEFAULT_BATCH_SIZE, max_delay=DEFAULT_BATCH_DELAY):
+        """Initialize the EventBuffer."""
+        self.max_events = max_events
+        self.max_delay = max_delay
+        # Appending to and popping from a deque are thread-safe
+        self._events = deque()
+        self._registered = False
+
+    def add(self, event_dict):
+        """Buffer an event."""
+        self._events.append(event_dict)
+        if not self._registered:
+            # The buffer is flushed by the event flusher of the process
+            self._registered = True
+            get_event_flusher().register(self.flush, self.max_delay)
+        if len(self._events) >= self.max_events:
+            self.flush()
+
+    def flush(self):
+        """Add the buffered events.
+
+        Returns:
+            * The number of added events.
+
+        """
+        events = []
+        # Only the events buffered so far are taken, so that a flush ends
+        # while other threads keep adding events
+        for i in range(len(self._events)):
+            try:
+                events.append(self._events.popleft())
+            except IndexError:
+                break
+        if not events:
+            return 0
+
+        _add_events(events)
+        return len(events)
+
+_event_buffer = None
+_event_buffer_lock = threading.Lock()
+
+def get_event_buffer():
+    """Get the event buffer of the process.
+
+    The events are buffered, if they are enabled by the ``EVENTS`` setting,
+    for instance::
+
+        EVENTS = {
+            'BATCH': {
+                'ENABLED': True,
+                'MAX_EVENTS': 50,
+                'MAX_DELAY': 0.5,
+            },
+        }
+
+    Returns:
+        * An :class:`EventBuffer` object, or None, if the batching is
+          disabled.
+
+    """
+    global _event_buffer
+    config = getattr(settings, 'EVENTS', {}).get('BATCH', {})
+    if not config.get('ENABLED', False):
+        return None
+
+    with _event_buffer_lock:
+        if _event_buffer is None:
+            _event_buffer = EventBuffer(config.get('MAX_EVENTS', DEFAULT_BATCH_SIZE),
+                                        config.get('MAX_DELAY', DEFAULT_BATCH_DELAY))
+        return _event_buffer
+
 class EventHandler():
     
     def __init__(self):
-        # TODO
-        cache.add('event_seq_num', 1, 60*60*24)
-        self.memChdLock = Lock()    # write lock for memcached
+        if cache.get('event_seq_num') is None:
+            _restart_sequence_number()
+
 
+    def add_event(self, description, date=None, **fields):
+        """Add an event.
 
-    def add_event(self, description, date=None):
-        event_dict = {}
+        Args:
+            * description: The description of the event.
+            * date: The datetime of the event, or None for the current time.
+            * fields: The structured fields of the event, i.e., category,
+              device, schedule, action and duration. See
+              :mod:`events.store`.
+
+        """
+        event_dict = dict(fields)
         
         if date == None:
             date = datetime.now()
@@ -25,28 +175,82 @@ class EventHandler():
         event_dict['date'] = date.strftime('%Y-%m-%d %H:%M:%S')
         event_dict['description'] = description
     
-        self.memChdLock.acquire()
-        seq_num = cache.get('event_seq_num', 1)
-        key = 'event_%i' % seq_num
-        ret = cache.add(key, event_dict)
-
-        cache.incr('event_seq_num')
-        self.memChdLock.release()        
+        event_buffer = get_event_buffer()
+        if event_buffer is not None:
+            event_buffer.add(event_dict)
+            return True
+        
+        # The sequence number is allocated first, so that concurrent
+        # processes never write the same key
+        seq_num = _allocate_sequence_numbers()
+        get_event_store().append(seq_num, [event_dict])
         
+        # Wake the clients waiting for events
+        get_event_notifier().publish(seq_num + 1)
         
         return True
     
+    def emit(self, category, message, *args, **fields):
+        """Add an event without blocking.
+
+        The event is sampled, rate limited and added asynchronously by the
+        event emitter of the process, if it is enabled by the
+        EVENTS['EMITTER'] setting, and else added at once. See
+        :mod:`events.emitter`.
+
+        Args:
+            * category: The category of the event, e.g., 'state_value'.
+            * message: The description of the event as a format string.
+            * args: The arguments of the format string.
+            * fields: The other structured fields of the event.
+
+        """
+        event_emitter = get_event_emitter(_add_events)
+        if event_emitter is not None:
+            return event_emitter.emit(category, message, *args, **fields)
+        
+        return self.add_event(message % args if args else message,
+                              category=category, **fields)
+    
     def get_event(self, seq_num):
-        key = 'event_%i' % seq_num
-        return cache.get(key)
+        return get_event_store().get(seq_num)
     
-    def get_events(self, start_seq_num, end_seq_num):        
-        keys = []
-        for i in range(start_seq_num, end_seq_num):
-            key = 'event_%i' % i
-            keys.append(key)
+    def get_event_range(self, start_seq_num, end_seq_num, **filters):
+        """Get at most a window of the events with their sequence numbers.
+
+        The events can be filtered by the device and the category, e.g.,
+        device='00:11:22:33:44:55'.
+
+        Returns:
+            * A tuple of a list of (sequence number, event) tuples ordered by
+              the sequence number, the sequence number to continue from, and
+              the sequence number before which events have been dropped, or
+              None, if no events have been dropped. See
+              :meth:`events.store.EventStore.get_range`.
 
-        return map( itemgetter(1), sorted(cache.get_many(keys).items()) )
+        """
+        return get_event_store().get_range(start_seq_num, end_seq_num, **filters)
+    
+    def get_numbered_events(self, start_seq_num, end_seq_num):
+        """Get the events with their sequence numbers.
+
+        Returns:
+            * A list of (sequence number, event) tuples ordered by the
+              sequence number. The dropped events are left out.
+
+        """
+        numbered_events = []
+        while start_seq_num < end_seq_num:
+            events, next_seq_num, dropped_before = self.get_event_range(start_seq_num, end_seq_num)
+            numbered_events.extend(events)
+            if next_seq_num == start_seq_num:
+                # The next event has not been stored yet
+                break
+            start_seq_num = next_seq_num
+        return numbered_events
+    
+    def get_events(self, start_seq_num, end_seq_num):        
+        return [event for seq_num, event in self.get_numbered_events(start_seq_num, end_seq_num)]
     
     def get_current_sequence_number(self):
         return cache.get('event_seq_num', 1)
@@ -0,0 +1,135 @@
+"""This module provides the background flusher of the events.
+
+The event buffer and the event emitter of a process add their events in
+batches. Their flush functions are called at their intervals from a single
+daemon thread of the process, and once more before the process exits, so
+a process runs one flusher thread however many of them are in use.
+
+Exported classes:
+    * :class:`EventFlusher`: A class for calling flush functions
+      periodically from one thread.
+
+Exported functions:
+    * get_event_flusher: Get the event flusher of the process.
+
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class EventFlusher(object):
+    """A class for calling flush functions periodically from one thread.
+
+    The thread is started, when the first flush function is registered. It
+    sleeps at most the shortest interval at a time, so a function registered
+    later is first called at most that much late.
+
+    Public functions:
+        * register: Call a flush function periodically.
+        * flush: Call all of the flush functions.
+        * stop: Stop the thread.
+
+    """
+
+    def __init__(self):
+        """Initialize the EventFlusher."""
+        # The lists of the interval and the next call by the flush function
+        self._schedules = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+    def register(self, flush, interval):
+        """Call a flush function periodically.
+
+        Registering the same function again changes its interval.
+
+        Args:
+            * flush: A callable without arguments.
+            * interval: The seconds between the calls.
+
+        """
+        with self._lock:
+            self._schedules[flush] = [interval, time.time() + interval]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='event-flusher')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _take_due(self, now):
+        # Schedule the next calls of the due flush functions
+        with self._lock:
+            if self._stopped:
+                return None, 0
+            due = []
+            for flush, schedule in self._schedules.items():
+                if schedule[1] <= now:
+                    schedule[1] = now + schedule[0]
+                    due.append(flush)
+            wait = min([min(schedule[0], schedule[1] - now)
+                        for schedule in self._schedules.values()])
+            return due, wait
+
+    def _run(self):
+        # The daemon thread may outlive the module globals at exit
+        clock = time.time
+        sleep = time.sleep
+        error = logger.error
+        while True:
+            due, wait = self._take_due(clock())
+            if due is None:
+                break
+            for flush in due:
+                try:
+                    flush()
+                except Exception, e:
+                    error('Flushing the events failed: %s' % e)
+            if not due:
+                sleep(wait)
+
+    def flush(self):
+        """Call all of the flush functions."""
+        with self._lock:
+            flushes = self._schedules.keys()
+        for flush in flushes:
+            try:
+                flush()
+            except Exception, e:
+                logger.error('Flushing the events failed: %s' % e)
+
+    def stop(self):
+        """Stop the thread.
+
+        The thread exits after the flush functions that are being called.
+        The functions are not called after this, unless :meth:`flush` is.
+
+        """
+        with self._lock:
+            self._stopped = True
+
+
+_event_flusher = None
+_event_flusher_lock = threading.Lock()
+
+
+def get_event_flusher():
+    """Get the event flusher of the process.
+
+    Returns:
+        * An :class:`EventFlusher` object.
+
+    """
+    global _event_flusher
+    with _event_flusher_lock:
+        if _event_flusher is None:
+            _event_flusher = EventFlusher()
+            # The batched events are added before the process exits
+            atexit.register(_event_flusher.flush)
+        return _event_flusher
@@ -0,0 +1,158 @@
+"""This module provides the publish/subscribe notifier of the events.
+
+:meth:`events.event.EventHandler.add_event` publishes the sequence number of
+the events to the notifier, and the event views wait on the notifier
+instead of sleeping and polling the cache. The waiters are woken as soon as
+an event is added in the same process. The events added by other
+processes are noticed by reading the sequence number from the cache at most
+once per ``check_interval`` seconds, shared by all waiters of the process
+instead of a read per client. A shared sequence number lower than the
+published one means that the sequence number has been restarted, and the
+waiters are woken with the restarted sequence number.
+
+Exported classes:
+    * :class:`EventNotifier`: A class for waking the waiters of new events.
+
+Exported functions:
+    * get_event_notifier: Get the event notifier of the process.
+
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+import threading
+import time
+
+DEFAULT_CHECK_INTERVAL = 1.0
+
+
+class EventNotifier(object):
+    """A class for waking the waiters of new events.
+
+    The sequence number is the number of the next event, so the events
+    before it have been added.
+
+    Instance attributes:
+        * check_interval: The interval in seconds at which the shared
+          sequence number is read.
+        * waiters: The number of threads waiting for events.
+
+    Public functions:
+        * publish: Publish a new sequence number.
+        * wait: Wait until the sequence number passes a sequence number, or
+          it is restarted.
+
+    """
+
+    def __init__(self, get_sequence_number=None,
+                 check_interval=DEFAULT_CHECK_INTERVAL):
+        """Initialize the EventNotifier.
+
+        Args:
+            * get_sequence_number: A callable returning the sequence number
+              shared by the processes, or None.
+            * check_interval: The interval in seconds at which the shared
+              sequence number is read.
+
+        """
+        self.check_interval = check_interval
+        self.waiters = 0
+        self._get_sequence_number = get_sequence_number
+        self._condition = threading.Condition()
+        self._seq_num = None
+        self._checked_at = None
+        # The number of times the sequence number has been restarted
+        self._restarts = 0
+
+    def publish(self, seq_num):
+        """Publish a new sequence number and wake the waiters.
+
+        Args:
+            * seq_num: The sequence number of the next event.
+
+        """
+        with self._condition:
+            if self._seq_num is None or seq_num > self._seq_num:
+                self._seq_num = seq_num
+                self._condition.notify_all()
+
+    def _check(self, now):
+        # The shared sequence number is read by one waiter per interval
+        if (self._get_sequence_number is None or
+                (self._checked_at is not None and
+                 now - self._checked_at < self.check_interval)):
+            return
+        self._checked_at = now
+        seq_num = self._get_sequence_number()
+        if seq_num is None or seq_num == self._seq_num:
+            return
+        if self._seq_num is not None and seq_num < self._seq_num:
+            # The published sequence numbers never pass the shared one, so
+            # it has been restarted
+            self._restarts += 1
+        self._seq_num = seq_num
+        self._condition.notify_all()
+
+    def wait(self, seq_num, timeout):
+        """Wait until the sequence number passes a sequence number, or it is
+        restarted.
+
+        Args:
+            * seq_num: The sequence number of the first event waited for.
+            * timeout: The maximum time to wait in seconds.
+
+        Returns:
+            * The new sequence number, which is lower than seq_num, if the
+              sequence number was restarted, or seq_num, if no events were
+              added within the timeout.
+
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            self.waiters += 1
+            restarts = self._restarts
+            try:
+                while True:
+                    now = time.time()
+                    self._check(now)
+                    if self._seq_num is not None and (self._seq_num > seq_num or
+                                                      self._restarts != restarts):
+                        return self._seq_num
+                    if now >= deadline:
+                        return seq_num
+                    wait = deadline - now
+                    if self._get_sequence_number is not None:
+                        wait = min(wait, self.check_interval)
+                    self._condition.wait(wait)
+            finally:
+                self.waiters -= 1
+
+
+_event_notifier = None
+_event_notifier_lock = threading.Lock()
+
+
+def get_event_notifier():
+    """Get the event notifier of the process.
+
+    The notifier is created on the first call and configured with the
+    ``EVENTS`` setting, for instance::
+
+        EVENTS = {
+            'CHECK_INTERVAL': 1.0,
+        }
+
+    Returns:
+        * An :class:`EventNotifier` object.
+
+    """
+    global _event_notifier
+    with _event_notifier_lock:
+        if _event_notifier is None:
+            config = getattr(settings, 'EVENTS', {})
+            _event_notifier = EventNotifier(
+                    lambda: cache.get('event_seq_num'),
+                    check_interval=config.get('CHECK_INTERVAL',
+                                              DEFAULT_CHECK_INTERVAL))
+
+        return _event_notifier
@@ -0,0 +1,353 @@
+"""This module provides the bounded event store of the event log.
+
+The events are stored in a ring buffer of ``capacity`` slots in the cache.
+The event with the sequence number n is stored in the slot n % capacity
+together with its sequence number, so appending an event overwrites the
+event capacity events before it, and a read notices the overwritten and
+the expired events from the sequence numbers of the slots. The
+descriptions are truncated to ``max_description_length`` characters, so
+the store takes a bounded amount of cache memory regardless of the number
+of events.
+
+A range read returns at most ``max_range`` events, and it reports the
+sequence number before which the requested events had been dropped, so
+that a client with a stale sequence number gets a bounded reply and can
+tell that it missed events.
+
+Besides the date and the description, an event may have the structured
+fields in ``FIELDS``. The events are indexed by the fields in
+``INDEXED_FIELDS``, i.e., by the device and the category, so that a range
+read filtered by them reads only the matching events. An index is a ring
+buffer of ``index_capacity`` sequence numbers in the cache with a position
+counter incremented atomically like the sequence number of the events.
+
+Exported classes:
+    * :class:`EventStore`: A class for the ring buffer of the events.
+
+Exported functions:
+    * get_event_store: Get the event store configured by the settings.
+
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+import cPickle as pickle
+import hashlib
+import threading
+
+DEFAULT_CAPACITY = 1000
+DEFAULT_MAX_RANGE = 200
+DEFAULT_MAX_DESCRIPTION_LENGTH = 1000
+DEFAULT_INDEX_CAPACITY = 100
+DEFAULT_INDEX_TIMEOUT = 60*60*24
+
+# The structured fields of the events and the fields the events are
+# indexed by
+FIELDS = ('category', 'device', 'schedule', 'action', 'duration')
+TEXT_FIELDS = ('category', 'device', 'schedule', 'action')
+INDEXED_FIELDS = ('device', 'category')
+MAX_FIELD_LENGTH = 100
+
+# The longest sequence number, date and duration of a slot
+_SLOT_TEMPLATE = dict([(field, u'') for field in TEXT_FIELDS],
+                      seq_num=2 ** 62, date='0000-00-00 00:00:00',
+                      description=u'', duration=0.0)
+
+
+def _to_unicode(description):
+    # The descriptions are, e.g., exceptions or byte strings
+    if isinstance(description, unicode):
+        return description
+    if isinstance(description, str):
+        return description.decode('utf-8', 'replace')
+    try:
+        return unicode(description)
+    except UnicodeDecodeError:
+        return str(description).decode('utf-8', 'replace')
+
+
+def _normalize_field(field, value):
+    if field == 'duration':
+        return float(value)
+    return _to_unicode(value)[:MAX_FIELD_LENGTH]
+
+
+def _allocate_positions(key, count, timeout):
+    # The positions of an index are allocated like the sequence numbers
+    try:
+        next_position = cache.incr(key, count)
+    except ValueError:
+        cache.add(key, 0, timeout)
+        next_position = cache.incr(key, count)
+    return next_position - count
+
+
+class EventStore(object):
+    """A class for the ring buffer of the events.
+
+    Instance attributes:
+        * capacity: The number of events kept.
+        * max_range: The maximum number of events returned by a range read.
+        * max_description_length: The maximum length of the descriptions.
+        * index_capacity: The number of events kept in each index.
+        * index_timeout: The seconds the indexes are kept in the cache
+          after they are last updated.
+
+    Public functions:
+        * append: Store events under their sequence numbers.
+        * get: Get an event by its sequence number.
+        * get_range: Get the events in a range of sequence numbers.
+        * get_last_sequence_number: Get the highest sequence number stored.
+        * get_stats: Get the memory use of the store.
+
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, max_range=DEFAULT_MAX_RANGE,
+                 max_description_length=DEFAULT_MAX_DESCRIPTION_LENGTH,
+                 index_capacity=DEFAULT_INDEX_CAPACITY,
+                 index_timeout=DEFAULT_INDEX_TIMEOUT):
+        """Initialize the EventStore."""
+        self.capacity = capacity
+        self.max_range = max_range
+        self.max_description_length = max_description_length
+        self.index_capacity = index_capacity
+        self.index_timeout = index_timeout
+
+    def _key(self, seq_num):
+        return 'event_slot_%i' % (seq_num % self.capacity)
+
+    def _index_key(self, field, value):
+        # The values may contain characters memcached does not allow in keys
+        value = _normalize_field(field, value)
+        return 'event_index_%s' % hashlib.md5('%s:%s' % (field, value.encode('utf-8'))).hexdigest()
+
+    def _make_slot(self, seq_num, event_dict):
+        description = _to_unicode(event_dict['description'])
+        if len(description) > self.max_description_length:
+            description = description[:self.max_description_length - 3] + u'...'
+        slot = {'seq_num': seq_num, 'date': event_dict['date'],
+                'description': description}
+        for field in FIELDS:
+            if event_dict.get(field) is not None:
+                slot[field] = _normalize_field(field, event_dict[field])
+        return slot
+
+    def _to_event(self, slot):
+        event_dict = dict(slot)
+        del event_dict['seq_num']
+        return event_dict
+
+    def append(self, first_seq_num, events):
+        """Store events under their sequence numbers.
+
+        Args:
+            * first_seq_num: The sequence number of the first event.
+            * events: A list of event dictionaries containing the date, the
+              description and any of the structured fields.
+
+        """
+        slots = {}
+        indexed_seq_nums = {}
+        # A batch longer than the capacity overwrites its own events
+        for i, event_dict in enumerate(events[-self.capacity:]):
+            seq_num = first_seq_num + max(len(events) - self.capacity, 0) + i
+            slots[self._key(seq_num)] = self._make_slot(seq_num, event_dict)
+            for field in INDEXED_FIELDS:
+                if event_dict.get(field) is not None:
+                    key = self._index_key(field, event_dict[field])
+                    indexed_seq_nums.setdefault(key, []).append(seq_num)
+        cache.set_many(slots)
+
+        index_slots = {}
+        for key, seq_nums in indexed_seq_nums.items():
+            position = _allocate_positions(key, len(seq_nums), self.index_timeout)
+            for i, seq_num in enumerate(seq_nums):
+                index_slots['%s_%i' % (key, (position + i) % self.index_capacity)] = seq_num
+        if index_slots:
+            cache.set_many(index_slots, self.index_timeout)
+
+    def get(self, seq_num):
+        """Get an event by its sequence number.
+
+        Returns:
+            * An event dictionary containing the date, the description and
+              the structured fields of the event.
+            * None, if the event has been dropped.
+
+        """
+        slot = cache.get(self._key(seq_num))
+        if slot is None or slot['seq_num'] != seq_num:
+            return None
+        return self._to_event(slot)
+
+    def get_range(self, start_seq_num, end_seq_num, **filters):
+        """Get the events in a range of sequence numbers.
+
+        Only the capacity last events before end_seq_num are kept, and at
+        most max_range events are returned from the start of the range, so
+        the caller continues from the returned sequence number.
+
+        The sequence number of an event is allocated before the event is
+        stored, so the read stops at an event that has not been stored yet,
+        i.e., a slot that still holds an older event, or an empty slot after
+        a stored event. The caller continues from the returned sequence
+        number, when the event has been stored.
+
+        Args:
+            * start_seq_num: The sequence number of the first event.
+            * end_seq_num: The sequence number after the last event.
+            * filters: The values of the indexed fields the events must
+              have, e.g., device='00:11:22:33:44:55'.
+
+        Returns:
+            * A tuple of a list of (sequence number, event dictionary)
+              tuples, the sequence number to continue from, and the sequence
+              number before which events have been dropped, or None, if no
+              events in the range have been dropped.
+
+        Raises:
+            * ValueError, if a filter is not an indexed field.
+
+        """
+        for field in filters:
+            if field not in INDEXED_FIELDS:
+                raise ValueError('The events are not indexed by %s' % field)
+        filters = dict([(field, _normalize_field(field, value))
+                        for field, value in filters.items() if value is not None])
+
+        start = max(start_seq_num, end_seq_num - self.capacity)
+        dropped_before = start if start > start_seq_num else None
+        if filters:
+            seq_nums, index_dropped_before = self._get_indexed_seq_nums(start, end_seq_num, filters)
+            if index_dropped_before is not None and index_dropped_before > start:
+                dropped_before = index_dropped_before
+            if len(seq_nums) > self.max_range:
+                seq_nums = seq_nums[:self.max_range]
+                end = seq_nums[-1] + 1
+            else:
+                end = end_seq_num
+        else:
+            end = min(end_seq_num, start + self.max_range)
+            seq_nums = range(start, end)
+        if start >= end:
+            return [], max(start_seq_num, end), None
+
+        slots = cache.get_many([self._key(seq_num) for seq_num in seq_nums])
+
+        events = []
+        stored = False
+        for seq_num in seq_nums:
+            slot = slots.get(self._key(seq_num))
+            if slot is not None and slot['seq_num'] == seq_num:
+                stored = True
+                if all([slot.get(field) == value for field, value in filters.items()]):
+                    events.append((seq_num, self._to_event(slot)))
+            elif slot is not None and slot['seq_num'] > seq_num:
+                # The slot was overwritten during the read
+                dropped_before = seq_num + 1
+            elif slot is None and not stored:
+                # The oldest events have expired from the cache
+                dropped_before = seq_num + 1
+            else:
+                # The event has not been stored yet
+                end = seq_num
+                break
+        return events, end, dropped_before
+
+    def _get_indexed_seq_nums(self, start_seq_num, end_seq_num, filters):
+        # The device index is read, if the events are filtered by the
+        # device, since it has fewer events than the category index
+        field = [field for field in INDEXED_FIELDS if field in filters][0]
+        key = self._index_key(field, filters[field])
+        end_position = cache.get(key)
+        if end_position is None:
+            return [], None
+
+        start_position = max(end_position - self.index_capacity, 0)
+        slots = cache.get_many(['%s_%i' % (key, position % self.index_capacity)
+                                for position in range(start_position, end_position)])
+        indexed_seq_nums = sorted(slots.values())
+
+        # The index has dropped the events before its oldest event
+        dropped_before = None
+        if indexed_seq_nums and (start_position > 0 or len(indexed_seq_nums) < end_position):
+            dropped_before = indexed_seq_nums[0]
+        return ([seq_num for seq_num in indexed_seq_nums
+                 if start_seq_num <= seq_num < end_seq_num], dropped_before)
+
+    def get_last_sequence_number(self):
+        """Get the highest sequence number stored.
+
+        All of the slots are read, so this is meant for restarting the
+        sequence number of the events.
+
+        Returns:
+            * The highest sequence number in the ring buffer, or 0, if it is
+              empty.
+
+        """
+        slots = cache.get_many([self._key(i) for i in range(self.capacity)])
+        return max([slot['seq_num'] for slot in slots.values()] or [0])
+
+    def get_stats(self):
+        """Get the memory use of the store.
+
+        Returns:
+            * A dictionary containing the capacity, the number of stored
+              events, the bytes they take when pickled, and the maximum
+              bytes the events can take. The indexes take at most
+              index_capacity sequence numbers per device and category.
+
+        """
+        slots = cache.get_many([self._key(i) for i in range(self.capacity)])
+        stored_bytes = sum([len(pickle.dumps(slot, pickle.HIGHEST_PROTOCOL))
+                            for slot in slots.values()])
+        # A character takes at most 4 bytes in UTF-8
+        slot_bytes = (len(pickle.dumps(_SLOT_TEMPLATE, pickle.HIGHEST_PROTOCOL)) +
+                      4 * (self.max_description_length + len(TEXT_FIELDS) * MAX_FIELD_LENGTH))
+        return {'capacity': self.capacity,
+                'events': len(slots),
+                'bytes': stored_bytes,
+                'max_bytes': self.capacity * slot_bytes}
+
+
+_event_store = None
+_event_store_lock = threading.Lock()
+
+
+def get_event_store():
+    """Get the event store configured by the settings.
+
+    The event store is created on the first call and configured with the
+    ``EVENTS`` setting, for instance::
+
+        EVENTS = {
+            'STORE': {
+                'CAPACITY': 1000,
+                'MAX_RANGE': 200,
+                'MAX_DESCRIPTION_LENGTH': 1000,
+                'INDEX_CAPACITY': 100,
+                'INDEX_TIMEOUT': 60*60*24,
+            },
+        }
+
+    Returns:
+        * An :class:`EventStore` object.
+
+    """
+    global _event_store
+    with _event_store_lock:
+        if _event_store is None:
+            config = getattr(settings, 'EVENTS', {}).get('STORE', {})
+            _event_store = EventStore(
+                    capacity=config.get('CAPACITY', DEFAULT_CAPACITY),
+                    max_range=config.get('MAX_RANGE', DEFAULT_MAX_RANGE),
+                    max_description_length=config.get(
+                            'MAX_DESCRIPTION_LENGTH',
+                            DEFAULT_MAX_DESCRIPTION_LENGTH),
+                    index_capacity=config.get('INDEX_CAPACITY',
+                                              DEFAULT_INDEX_CAPACITY),
+                    index_timeout=config.get('INDEX_TIMEOUT',
+                                             DEFAULT_INDEX_TIMEOUT))
+
+        return _event_store
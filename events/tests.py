@@ -5,7 +5,21 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.memcached import BaseMemcachedCache
 from django.test import TestCase
+from events.emitter import EventEmitter, get_event_emitter
+from events.flusher import EventFlusher, get_event_flusher
+from events.event import SEQUENCE_NUMBER_TIMEOUT, EventHandler, _allocate_sequence_numbers, \
+    get_event_buffer
+from events.notifier import EventNotifier, get_event_notifier
+from events.store import EventStore
+from mock import patch
+import json
+import multiprocessing
+import threading
+import time
 
 
 class SimpleTest(TestCase):
@@ -14,3 +28,502 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class EventNotifierTestCase(TestCase):
+
+    def _later(self, func, delay=0.1):
+        timer = threading.Timer(delay, func)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def test_good_publish(self):
+        notifier = EventNotifier()
+        self._later(lambda: notifier.publish(2))
+
+        start_time = time.time()
+        self.assertEqual(notifier.wait(1, 5), 2)
+        self.assertTrue(time.time() - start_time < 1)
+        self.assertEqual(notifier.waiters, 0)
+
+        # An old sequence number does not go back
+        notifier.publish(1)
+        self.assertEqual(notifier.wait(1, 0), 2)
+
+    def test_good_timeout(self):
+        notifier = EventNotifier()
+        start_time = time.time()
+        self.assertEqual(notifier.wait(5, 0.1), 5)
+        self.assertTrue(time.time() - start_time >= 0.1)
+
+    def test_good_shared_sequence_number(self):
+        # Another process adds an event
+        shared = {'seq_num': 1}
+        notifier = EventNotifier(lambda: shared['seq_num'], check_interval=0.05)
+        self._later(lambda: shared.update(seq_num=3))
+
+        start_time = time.time()
+        self.assertEqual(notifier.wait(1, 5), 3)
+        self.assertTrue(time.time() - start_time < 1)
+
+    def test_good_restarted_sequence_number(self):
+        shared = {'seq_num': 10}
+        notifier = EventNotifier(lambda: shared['seq_num'], check_interval=0.05)
+        self.assertEqual(notifier.wait(5, 0), 10)
+
+        # Another process restarts the sequence number
+        self._later(lambda: shared.update(seq_num=3))
+        start_time = time.time()
+        self.assertEqual(notifier.wait(10, 5), 3)
+        self.assertTrue(time.time() - start_time < 1)
+
+        # The waiters continue from the restarted sequence number
+        shared['seq_num'] = 4
+        notifier.publish(4)
+        self.assertEqual(notifier.wait(3, 0), 4)
+
+
+class EventViewsTestCase(TestCase):
+
+    def setUp(self):
+        self.event_handler = EventHandler()
+
+    def test_good_numbered_events(self):
+        start = self.event_handler.get_current_sequence_number()
+        for i in range(12):
+            self.event_handler.add_event('Event %i' % i)
+
+        events = self.event_handler.get_numbered_events(start, start + 12)
+        self.assertEqual([seq_num for seq_num, event in events], range(start, start + 12))
+        self.assertEqual([event['description'] for event in self.event_handler.get_events(start, start + 12)],
+                         ['Event %i' % i for i in range(12)])
+
+    def test_good_long_poll(self):
+        latest = self.event_handler.get_current_sequence_number()
+        timer = threading.Timer(0.2, self.event_handler.add_event, args=('Device added',))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        start_time = time.time()
+        response = self.client.post('/event_log/events/', {'latest': latest},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        # The request returns as soon as the event is added
+        self.assertTrue(time.time() - start_time < 3)
+        content = json.loads(response.content)
+        self.assertEqual([event['msg'] for event in content['events']], ['Device added'])
+        self.assertEqual(content['latest'], latest + 1)
+
+    def test_good_stream(self):
+        latest = self.event_handler.get_current_sequence_number()
+        self.event_handler.add_event('First')
+        self.event_handler.add_event('Second')
+
+        with patch.dict(settings.EVENTS, {'STREAM_DURATION': 0.3, 'HEARTBEAT_INTERVAL': 0.1}):
+            # The stream resumes after the first event
+            response = self.client.get('/event_log/stream/', HTTP_LAST_EVENT_ID=str(latest + 1))
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            content = response.content
+
+        messages = [message for message in content.split('\n\n') if message]
+        self.assertEqual(messages[0], 'retry: 1000')
+        self.assertEqual(messages[1].split('\n')[0], 'id: %i' % (latest + 2))
+        self.assertEqual(json.loads(messages[1].split('\n')[1][len('data: '):])['msg'], 'Second')
+        self.assertTrue(': keep-alive' in messages[2:])
+
+
+class EventSequenceTestCase(TestCase):
+
+    def setUp(self):
+        self.event_handler = EventHandler()
+
+    def test_good_expired_sequence_number(self):
+        self.event_handler.add_event('Before expiry')
+        seq_num = self.event_handler.get_current_sequence_number()
+        cache.delete('event_seq_num')
+
+        with patch.object(cache, 'add', wraps=cache.add) as add:
+            self.event_handler.add_event('After expiry')
+        # The sequence number is kept as long as the cache allows
+        self.assertEqual(add.call_args[0][2], SEQUENCE_NUMBER_TIMEOUT)
+
+        # The sequence numbers of the stored events are not reused
+        self.assertEqual(self.event_handler.get_current_sequence_number(), seq_num + 1)
+        self.assertEqual(self.event_handler.get_event(seq_num - 1)['description'], 'Before expiry')
+        self.assertEqual(self.event_handler.get_event(seq_num)['description'], 'After expiry')
+
+    @patch('events.event._event_buffer', None)
+    def test_good_batches(self):
+        batch = {'ENABLED': True, 'MAX_EVENTS': 3, 'MAX_DELAY': 60}
+        start = self.event_handler.get_current_sequence_number()
+        with patch.dict(settings.EVENTS, {'BATCH': batch}):
+            with patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+                self.event_handler.add_event('First')
+                self.event_handler.add_event('Second')
+                # The events wait in the buffer
+                self.assertEqual(self.event_handler.get_current_sequence_number(), start)
+
+                self.event_handler.add_event('Third')
+                self.assertEqual(set_many.call_count, 1)
+
+                self.event_handler.add_event('Fourth')
+                self.assertEqual(get_event_buffer().flush(), 1)
+                self.assertEqual(get_event_buffer().flush(), 0)
+                self.assertEqual(set_many.call_count, 2)
+
+        self.assertEqual([event['description'] for event in self.event_handler.get_events(start, start + 4)],
+                         ['First', 'Second', 'Third', 'Fourth'])
+        self.assertEqual(self.event_handler.get_current_sequence_number(), start + 4)
+
+
+class EventStoreTestCase(TestCase):
+
+    def setUp(self):
+        self.event_handler = EventHandler()
+        self.store = EventStore(capacity=5, max_range=3, max_description_length=10)
+        # The sequence numbers of the other tests are not overwritten
+        self.start = self.event_handler.get_current_sequence_number() + 10 ** 6
+
+    def _event(self, description):
+        return {'date': '2012-01-01 12:00:00', 'description': description}
+
+    def test_good_ring_buffer(self):
+        self.store.append(self.start, [self._event('Event %i' % i) for i in range(8)])
+        self.assertEqual(self.store.get(self.start + 2), None)
+        self.assertEqual(self.store.get(self.start + 7)['description'], 'Event 7')
+
+        # The overwritten events are reported and the read is capped
+        events, next_seq_num, dropped_before = self.store.get_range(self.start, self.start + 8)
+        self.assertEqual([seq_num - self.start for seq_num, event in events], [3, 4, 5])
+        self.assertEqual(next_seq_num, self.start + 6)
+        self.assertEqual(dropped_before, self.start + 3)
+
+        events, next_seq_num, dropped_before = self.store.get_range(next_seq_num, self.start + 8)
+        self.assertEqual([event['description'] for seq_num, event in events], ['Event 6', 'Event 7'])
+        self.assertEqual((next_seq_num, dropped_before), (self.start + 8, None))
+
+        self.assertEqual(self.store.get_range(self.start + 8, self.start + 8), ([], self.start + 8, None))
+
+    def test_good_expired_events(self):
+        self.store.append(self.start, [self._event('Event %i' % i) for i in range(4)])
+        cache.delete('event_slot_%i' % ((self.start + 1) % 5))
+        events, next_seq_num, dropped_before = self.store.get_range(self.start + 1, self.start + 4)
+        self.assertEqual([seq_num - self.start for seq_num, event in events], [2, 3])
+        self.assertEqual(dropped_before, self.start + 2)
+
+    def test_good_unstored_event(self):
+        # The slots are not overwritten by the other tests
+        start = self.start + 100
+        cache.set('event_seq_num', start, SEQUENCE_NUMBER_TIMEOUT)
+        with patch('events.store._event_store', self.store):
+            self.event_handler.add_event('Before')
+            # Another process has allocated a sequence number, but not
+            # stored its event yet
+            seq_num = _allocate_sequence_numbers()
+            self.event_handler.add_event('After')
+
+            events, next_seq_num, dropped_before = self.store.get_range(start, seq_num + 2)
+            self.assertEqual([event['description'] for number, event in events], ['Before'])
+            self.assertEqual((next_seq_num, dropped_before), (seq_num, None))
+
+            # The slot still holds the event of the previous lap
+            self.store.append(seq_num - 5, [self._event('Old')])
+            self.assertEqual(self.store.get_range(seq_num, seq_num + 2), ([], seq_num, None))
+
+            self.store.append(seq_num, [self._event('Late')])
+            events, next_seq_num, dropped_before = self.store.get_range(seq_num, seq_num + 2)
+            self.assertEqual([event['description'] for number, event in events], ['Late', 'After'])
+            self.assertEqual((next_seq_num, dropped_before), (seq_num + 2, None))
+
+    def test_good_memory_bound(self):
+        self.store.append(self.start, [self._event(u'\xe4' * 100), self._event(ValueError('Failed'))])
+        self.assertEqual(self.store.get(self.start)['description'], u'\xe4' * 7 + u'...')
+        self.assertEqual(self.store.get(self.start + 1)['description'], u'Failed')
+
+        stats = self.store.get_stats()
+        self.assertEqual(stats['capacity'], 5)
+        self.assertTrue(stats['events'] >= 2)
+        self.assertTrue(0 < stats['bytes'] <= stats['max_bytes'])
+
+    def test_good_stale_long_poll(self):
+        with patch('events.store._event_store', self.store):
+            start = self.event_handler.get_current_sequence_number()
+            for i in range(8):
+                self.event_handler.add_event('Event %i' % i)
+
+            response = self.client.post('/event_log/events/', {'latest': start},
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        content = json.loads(response.content)
+        self.assertEqual([event['msg'] for event in content['events']], ['Event 3', 'Event 4', 'Event 5'])
+        self.assertEqual(content['latest'], start + 6)
+        self.assertEqual(content['dropped_before'], start + 3)
+
+    def test_good_stale_stream(self):
+        with patch('events.store._event_store', self.store):
+            start = self.event_handler.get_current_sequence_number()
+            for i in range(8):
+                self.event_handler.add_event('Event %i' % i)
+
+            with patch.dict(settings.EVENTS, {'STREAM_DURATION': 0.1, 'HEARTBEAT_INTERVAL': 0.1}):
+                content = self.client.get('/event_log/stream/', {'latest': start}).content
+
+        messages = [message for message in content.split('\n\n') if message]
+        self.assertEqual(messages[1], 'event: dropped\ndata: {"before": %i}' % (start + 3))
+        # The stream continues with the next window
+        self.assertEqual([message.split('\n')[0] for message in messages[2:7]],
+                         ['id: %i' % (start + i) for i in range(4, 9)])
+
+    def test_good_structured_events(self):
+        device, other = 'aa:%i' % self.start, 'bb:%i' % self.start
+        self.store.append(self.start, [dict(self._event('Updated'), category='state_value', device=device),
+                                       dict(self._event('Other'), category='state_value', device=other),
+                                       dict(self._event('Sent'), category='action', device=device,
+                                            action='Play', duration=1)])
+        self.assertEqual(self.store.get(self.start + 2),
+                         dict(self._event('Sent'), category='action', device=device, action='Play', duration=1.0))
+
+        events, next_seq_num, dropped_before = self.store.get_range(self.start, self.start + 3, device=device)
+        self.assertEqual([event['description'] for seq_num, event in events], ['Updated', 'Sent'])
+        self.assertEqual((next_seq_num, dropped_before), (self.start + 3, None))
+        events = self.store.get_range(self.start, self.start + 3, device=device, category='state_value')[0]
+        self.assertEqual([seq_num - self.start for seq_num, event in events], [0])
+        self.assertEqual(self.store.get_range(self.start, self.start + 3, device='cc:%i' % self.start),
+                         ([], self.start + 3, None))
+        self.assertRaises(ValueError, self.store.get_range, self.start, self.start + 3, action='Play')
+
+    def test_good_filtered_window(self):
+        device = 'aa:%i' % self.start
+        store = EventStore(capacity=20, max_range=2, index_capacity=3)
+        store.append(self.start, [dict(self._event('Event %i' % i), device=(device if i % 2 else None))
+                                  for i in range(10)])
+
+        # The index keeps the three last events of the device
+        events, next_seq_num, dropped_before = store.get_range(self.start, self.start + 10, device=device)
+        self.assertEqual([seq_num - self.start for seq_num, event in events], [5, 7])
+        self.assertEqual((next_seq_num, dropped_before), (self.start + 8, self.start + 5))
+
+        events, next_seq_num, dropped_before = store.get_range(next_seq_num, self.start + 10, device=device)
+        self.assertEqual([seq_num - self.start for seq_num, event in events], [9])
+        self.assertEqual((next_seq_num, dropped_before), (self.start + 10, None))
+
+    def test_good_range_view(self):
+        device = 'aa:%i' % self.start
+        with patch('events.store._event_store', EventStore()):
+            start = self.event_handler.get_current_sequence_number()
+            self.event_handler.add_event('Updated', category='state_value', device=device)
+            self.event_handler.add_event('Other', category='state_value')
+            self.event_handler.add_event('Sent', category='action', device=device, duration=0.5)
+
+            content = json.loads(self.client.get('/event_log/range/', {'start': start, 'device': device}).content)
+            self.assertEqual(self.client.get('/event_log/range/', {'start': 'x'}).status_code, 400)
+
+        self.assertEqual([(event['seq'], event['msg']) for event in content['events']],
+                         [(start, 'Updated'), (start + 2, 'Sent')])
+        self.assertEqual(content['events'][1]['duration'], 0.5)
+        self.assertEqual((content['next'], content['dropped_before']), (start + 3, None))
+
+    def test_good_filtered_long_poll(self):
+        device = 'aa:%i' % self.start
+        latest = self.event_handler.get_current_sequence_number()
+        self.event_handler.add_event('Other', category='state_value')
+        self.event_handler.add_event('Updated', category='state_value', device=device)
+
+        response = self.client.post('/event_log/events/?device=%s' % device, {'latest': latest},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        content = json.loads(response.content)
+        self.assertEqual(content['events'], [{'msg': 'Updated', 'date': content['events'][0]['date'],
+                                              'category': 'state_value', 'device': device}])
+        self.assertEqual(content['latest'], latest + 2)
+
+
+class EventFlusherTestCase(TestCase):
+
+    def test_good_shared_thread(self):
+        flusher = EventFlusher()
+        self.addCleanup(flusher.stop)
+        calls = {'fast': 0, 'slow': 0}
+        done = threading.Event()
+
+        def fast():
+            calls['fast'] += 1
+            if calls['fast'] == 3:
+                done.set()
+
+        flusher.register(fast, 0.05)
+        flusher.register(lambda: calls.update(slow=calls['slow'] + 1), 60)
+        # Each function is called at its own interval
+        self.assertTrue(done.wait(5))
+        self.assertEqual(calls['slow'], 0)
+
+        flusher.flush()
+        self.assertEqual(calls['slow'], 1)
+
+    @patch('events.flusher._event_flusher', None)
+    @patch('events.emitter._event_emitter', None)
+    @patch('events.event._event_buffer', None)
+    def test_good_buffer_and_emitter(self):
+        event_handler = EventHandler()
+        events = {'BATCH': {'ENABLED': True, 'MAX_EVENTS': 50, 'MAX_DELAY': 0.05},
+                  'EMITTER': {'ENABLED': True, 'FLUSH_INTERVAL': 0.05}}
+        with patch.dict(settings.EVENTS, events):
+            start = event_handler.get_current_sequence_number()
+            self.addCleanup(get_event_flusher().stop)
+            event_handler.add_event('Buffered')
+            event_handler.emit('state_value', 'Emitted')
+            self.assertEqual(get_event_notifier().wait(start + 1, 5), start + 2)
+
+            # The buffer and the emitter are flushed by the same thread
+            self.assertEqual(sorted(get_event_flusher()._schedules.keys()),
+                             sorted([get_event_buffer().flush, get_event_emitter(None).flush]))
+        self.assertEqual(sorted([event['description'] for event in event_handler.get_events(start, start + 2)]),
+                         ['Buffered', 'Emitted'])
+
+    @patch('events.flusher.logger')
+    def test_bad_failed_flush(self, logger):
+        flusher = EventFlusher()
+        self.addCleanup(flusher.stop)
+        done = threading.Event()
+
+        def fail():
+            done.set()
+            raise ValueError('Failed')
+
+        flusher.register(fail, 0.05)
+        self.assertTrue(done.wait(5))
+        # The thread keeps running after an error
+        done.clear()
+        self.assertTrue(done.wait(5))
+        self.assertTrue(logger.error.call_count >= 1)
+
+
+class EventEmitterTestCase(TestCase):
+
+    def setUp(self):
+        self.added = []
+        self.add_events = lambda events: self.added.extend(events)
+
+    @patch('events.emitter.logger')
+    def test_good_deferred_formatting(self, logger):
+        emitter = EventEmitter(self.add_events, flush_interval=60)
+        self.assertTrue(emitter.emit('state_value', u'%s updated to %s', 'aa', 5, device='aa'))
+        self.assertTrue(emitter.emit('state_value', 'No arguments'))
+        self.assertTrue(emitter.emit('state_value', '%s %s', 'Too few arguments'))
+        # The events are added only by the flush
+        self.assertEqual(self.added, [])
+
+        self.assertEqual(emitter.flush(), 3)
+        self.assertEqual([event['description'] for event in self.added],
+                         [u'aa updated to 5', 'No arguments', '%s %s'])
+        self.assertEqual(logger.error.call_count, 1)
+        self.assertEqual((self.added[0]['category'], self.added[0]['device']), ('state_value', 'aa'))
+        self.assertEqual(emitter.get_stats()['state_value']['added'], 3)
+
+    def test_good_sampling(self):
+        emitter = EventEmitter(self.add_events, {'state_value': {'SAMPLE_RATE': 0.0}}, flush_interval=60)
+        for i in range(10):
+            self.assertFalse(emitter.emit('state_value', 'Sampled out'))
+        self.assertTrue(emitter.emit('device', 'Kept'))
+        emitter.flush()
+
+        self.assertEqual([event['description'] for event in self.added], ['Kept'])
+        self.assertEqual(emitter.get_stats()['state_value']['sampled'], 10)
+
+    def test_good_rate_limit(self):
+        categories = {'DEFAULT': {'RATE_LIMIT': 10, 'BURST': 3}}
+        emitter = EventEmitter(self.add_events, categories, flush_interval=60)
+        with patch('time.time', return_value=1000.0):
+            self.assertEqual([emitter.emit('state_value', 'Event') for i in range(5)],
+                             [True, True, True, False, False])
+        # The bucket refills at the rate limit
+        with patch('time.time', return_value=1000.2):
+            self.assertEqual([emitter.emit('state_value', 'Event') for i in range(3)],
+                             [True, True, False])
+
+        stats = emitter.get_stats()['state_value']
+        self.assertEqual((stats['queued'], stats['limited']), (5, 3))
+
+    def test_good_full_queue(self):
+        emitter = EventEmitter(self.add_events, max_queue_size=2, max_batch=1, flush_interval=60)
+        self.assertEqual([emitter.emit('device', 'Event %i', i) for i in range(3)], [True, True, False])
+        self.assertEqual(emitter.get_stats()['device']['dropped'], 1)
+
+        # The batches are added one at a time
+        self.assertEqual(emitter.flush(), 2)
+        self.assertEqual([event['description'] for event in self.added], ['Event 0', 'Event 1'])
+
+    @patch('events.emitter._event_emitter', None)
+    def test_good_background_flush(self):
+        event_handler = EventHandler()
+        start = event_handler.get_current_sequence_number()
+        config = {'ENABLED': True, 'FLUSH_INTERVAL': 0.05}
+        with patch.dict(settings.EVENTS, {'EMITTER': config}):
+            event_handler.emit('state_value', u'%s initialized', 'aa')
+            # The flusher thread adds the event and wakes the waiting clients
+            self.assertEqual(get_event_notifier().wait(start, 5), start + 1)
+
+        self.assertEqual(event_handler.get_event(start)['description'], u'aa initialized')
+
+    def test_good_disabled_emitter(self):
+        event_handler = EventHandler()
+        start = event_handler.get_current_sequence_number()
+        with patch.dict(settings.EVENTS, {'EMITTER': {'ENABLED': False}}):
+            event_handler.emit('state_value', u'%s initialized', 'bb')
+            self.assertEqual(event_handler.get_event(start)['description'], u'bb initialized')
+
+
+def _add_events(writer, num_events):
+    event_handler = EventHandler()
+    for i in range(num_events):
+        event_handler.add_event('%s %i' % (writer, i))
+
+def _add_process_events(writer, num_events):
+    # The connections of the parent process are not shared
+    cache.close()
+    threads = [threading.Thread(target=_add_events, args=('%s-%i' % (writer, i), num_events))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cache.close()
+
+
+class EventSequenceStressTestCase(TestCase):
+    """Adds events from many threads and processes at once.
+
+    The sequence numbers are allocated atomically only by memcached, so the
+    test is skipped with the other cache backends.
+
+    """
+
+    def setUp(self):
+        if not isinstance(cache, BaseMemcachedCache):
+            self.skipTest('The atomic increment needs memcached')
+        cache.set('event_stress_probe', 1)
+        if cache.get('event_stress_probe') != 1:
+            self.skipTest('memcached is not running')
+        self.event_handler = EventHandler()
+
+    @patch('events.store._event_store', EventStore(capacity=5000))
+    def test_good_concurrent_events(self):
+        num_events = 100
+        start = self.event_handler.get_current_sequence_number()
+
+        cache.close()
+        processes = [multiprocessing.Process(target=_add_process_events, args=('process-%i' % i, num_events))
+                     for i in range(4)]
+        threads = [threading.Thread(target=_add_events, args=('thread-%i' % i, num_events))
+                   for i in range(8)]
+        for worker in processes + threads:
+            worker.start()
+        for worker in processes + threads:
+            worker.join()
+
+        expected = ['%s %i' % (writer, i)
+                    for writer in ['process-%i-%i' % (p, t) for p in range(4) for t in range(4)] +
+                                  ['thread-%i' % t for t in range(8)]
+                    for i in range(num_events)]
+        end = self.event_handler.get_current_sequence_number()
+        events = self.event_handler.get_events(start, end)
+        # No event was lost or written twice
+        self.assertEqual(end - start, len(expected))
+        self.assertEqual(sorted([event['description'] for event in events]), sorted(expected))
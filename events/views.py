@@ -1,13 +1,34 @@
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 from django.views.decorators.csrf import ensure_csrf_cookie
 from events.event import EventHandler
+from events.notifier import get_event_notifier
+from events.store import DEFAULT_MAX_RANGE, FIELDS, INDEXED_FIELDS
 import json
 import time
 
+DEFAULT_LONG_POLL_TIMEOUT = 20
+DEFAULT_STREAM_DURATION = 300
+DEFAULT_HEARTBEAT_INTERVAL = 15
+# Seconds to wait before reading again an event, which has been numbered
+# but not stored yet
+STORE_RETRY_INTERVAL = 0.05
 
 
+def _get_filters(request):
+    # The events are filtered by the indexed fields in the query
+    return dict([(str(field), request.REQUEST[field])
+                 for field in INDEXED_FIELDS if request.REQUEST.get(field)])
+
+def _event_message(event):
+    message = {'msg': event['description'], 'date': event['date']}
+    for field in FIELDS:
+        if field in event:
+            message[field] = event[field]
+    return message
+
 def index(request):
     return render_to_response('event_log.html', context_instance=RequestContext(request))
 
@@ -16,31 +37,139 @@ def events(request):
     
     if request.is_ajax() and request.method == 'POST':
         event_handler = EventHandler()
+        notifier = get_event_notifier()
+        filters = _get_filters(request)
+        timeout = getattr(settings, 'EVENTS', {}).get('LONG_POLL_TIMEOUT', DEFAULT_LONG_POLL_TIMEOUT)
         
         if 'latest' not in request.POST or request.POST['latest'] == 'null':
             latest_seq_num = event_handler.get_current_sequence_number()
         else:
             latest_seq_num = int(request.POST['latest'])
         
-        start_timestamp = time.time()
+        deadline = time.time() + timeout
         event_messages = {'events': [], 'latest': latest_seq_num}
-        while start_timestamp + 20 > time.time():
-            cur_seq_num =  event_handler.get_current_sequence_number()
+        while deadline > time.time():
+            # The notifier wakes the request as soon as an event is added
+            cur_seq_num = notifier.wait(latest_seq_num, deadline - time.time())
             
             if latest_seq_num < cur_seq_num:
-                events = event_handler.get_events(latest_seq_num, cur_seq_num)
+                # A stale client gets at most a window of the events
+                events, next_seq_num, dropped_before = event_handler.get_event_range(latest_seq_num, cur_seq_num, **filters)
+                if next_seq_num == latest_seq_num:
+                    # The next event has not been stored yet
+                    time.sleep(STORE_RETRY_INTERVAL)
+                    continue
+                latest_seq_num = next_seq_num
                 
-                for event in events:
-                    event_messages['events'].append({'msg': event['description'], 'date': event['date']})
+                for seq_num, event in events:
+                    event_messages['events'].append(_event_message(event))
                 
-                if len(event_messages['events']) > 0:
-                    event_messages['latest'] = cur_seq_num
+                event_messages['latest'] = latest_seq_num
+                if dropped_before is not None:
+                    event_messages['dropped_before'] = dropped_before
+                if len(event_messages['events']) > 0 or dropped_before is not None:
                     break
-                
-            time.sleep(3)
-    
+            
+            elif cur_seq_num < latest_seq_num:
+                # The sequence number was restarted, so the client continues
+                # from the restarted one
+                event_messages['latest'] = cur_seq_num
+                break
+        
         data = json.dumps(event_messages)
         
         return HttpResponse(data, 'application/json')
     else:
         return HttpResponse('Invalid request')
+
+def _stream_events(event_handler, latest_seq_num, filters, duration, heartbeat_interval):
+    notifier = get_event_notifier()
+    # The browser reconnects after the stream ends
+    yield 'retry: 1000\n\n'
+
+    deadline = time.time() + duration
+    while deadline > time.time():
+        timeout = min(heartbeat_interval, deadline - time.time())
+        cur_seq_num = notifier.wait(latest_seq_num, timeout)
+
+        if latest_seq_num < cur_seq_num:
+            # A stale client gets the events a window at a time
+            while latest_seq_num < cur_seq_num:
+                events, next_seq_num, dropped_before = event_handler.get_event_range(latest_seq_num, cur_seq_num, **filters)
+                if dropped_before is not None:
+                    yield 'event: dropped\ndata: %s\n\n' % json.dumps({'before': dropped_before})
+                for seq_num, event in events:
+                    data = json.dumps(_event_message(event))
+                    # The id is the sequence number the stream resumes from
+                    yield 'id: %i\ndata: %s\n\n' % (seq_num + 1, data)
+                if next_seq_num == latest_seq_num:
+                    # The next event has not been stored yet
+                    time.sleep(STORE_RETRY_INTERVAL)
+                    break
+                latest_seq_num = next_seq_num
+        else:
+            if cur_seq_num < latest_seq_num:
+                # The sequence number was restarted
+                latest_seq_num = cur_seq_num
+            # A comment keeps the proxies from closing an idle stream
+            yield ': keep-alive\n\n'
+
+def stream(request):
+    """Stream the events as server-sent events.
+
+    The stream starts after the event given by the Last-Event-ID header,
+    which the browser sends when it reconnects, or the latest parameter, or
+    else at the current sequence number. The stream ends after
+    EVENTS['STREAM_DURATION'] seconds, and the browser reconnects. The
+    events can be filtered by the device and category parameters.
+
+    """
+    event_handler = EventHandler()
+    config = getattr(settings, 'EVENTS', {})
+
+    latest = request.META.get('HTTP_LAST_EVENT_ID', request.GET.get('latest'))
+    try:
+        latest_seq_num = int(latest)
+    except (TypeError, ValueError):
+        latest_seq_num = event_handler.get_current_sequence_number()
+
+    response = HttpResponse(_stream_events(event_handler,
+                                           latest_seq_num,
+                                           _get_filters(request),
+                                           config.get('STREAM_DURATION', DEFAULT_STREAM_DURATION),
+                                           config.get('HEARTBEAT_INTERVAL', DEFAULT_HEARTBEAT_INTERVAL)),
+                            content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+
+    return response
+
+def event_range(request):
+    """Get the events in a range of sequence numbers as JSON.
+
+    The range is given by the start and end parameters, which default to the
+    last EVENTS['STORE']['MAX_RANGE'] events, and the events can be filtered
+    by the device and category parameters. The reply contains at most a
+    window of the events with their sequence numbers, the sequence number
+    the next read continues from, and the sequence number before which
+    events have been dropped, if any.
+
+    """
+    event_handler = EventHandler()
+    max_range = getattr(settings, 'EVENTS', {}).get('STORE', {}).get('MAX_RANGE', DEFAULT_MAX_RANGE)
+    try:
+        end_seq_num = int(request.GET.get('end', event_handler.get_current_sequence_number()))
+        start_seq_num = int(request.GET.get('start', end_seq_num - max_range))
+    except ValueError:
+        return HttpResponseBadRequest('The start and end must be sequence numbers')
+
+    events, next_seq_num, dropped_before = event_handler.get_event_range(start_seq_num, end_seq_num,
+                                                                         **_get_filters(request))
+    event_messages = {'events': [], 'next': next_seq_num, 'dropped_before': dropped_before}
+    for seq_num, event in events:
+        message = _event_message(event)
+        message['seq'] = seq_num
+        event_messages['events'].append(message)
+
+    return HttpResponse(json.dumps(event_messages), 'application/json')
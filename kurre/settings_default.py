@@ -224,28 +224,138 @@ CACHES = {
     }
 }
 
+# The requests to the proximity server are sent over the 'framed' protocol
+# through a pool of at most POOL_SIZE persistent connections with a TIMEOUT
+# in seconds, or over the 'text' protocol of the older servers with a new
+# connection per request
 PROXIMITY_SERVER = {
     'default': {
         'HOST': 'localhost',
         'PORT': 50007,
+        'PROTOCOL': 'framed',
+        'POOL_SIZE': 4,
+        'TIMEOUT': 10,
     },
     'test': {
         'HOST': 'localhost',
         'PORT': 50008,
+        'PROTOCOL': 'framed',
+        'POOL_SIZE': 4,
+        'TIMEOUT': 10,
     }
 }
 
+# The requests to Mirri and CaaS are sent through a pool of at most
+# POOL_SIZE keep-alive connections with a default TIMEOUT in seconds
 MIRRI = {
     'HOST': 'social.cs.tut.fi',
     'PORT': 8000,
+    'POOL_SIZE': 4,
+    'TIMEOUT': 10,
+    'KEEP_ALIVE': True,
 }
 
 CAAS = {
     'HOST': '',
     'PORT': 80,
-    'CONFIGURATOR': 'wcrl'
+    'CONFIGURATOR': 'wcrl',
+    'POOL_SIZE': 4,
+    'TIMEOUT': 10,
+    'KEEP_ALIVE': True,
+    # Seconds to wait for the separate configurations of the actions in a
+    # configuration request
+    'DEADLINE': 15,
+    # The number of the best configurations kept of each separately
+    # configured action, while its reply is read
+    'TOP_CONFIGURATIONS': 10,
+    # The configuration answers are cached by a digest of the model and the
+    # selections for TTL seconds
+    'RESULT_CACHE': {
+        'ENABLED': True,
+        'MAX_ENTRIES': 256,
+        'TTL': 60,
+        # The answers with more configurations are streamed but not kept
+        'MAX_CONFIGURATIONS': 1000,
+        # Share the answers between the processes through CACHES['default']
+        'USE_DJANGO_CACHE': False,
+    },
+}
+
+# Bounded worker pools used for running the tasks in core.tasks
+WORKER_POOLS = {
+    'default': {
+        'NUM_WORKERS': 4,
+        'MAX_QUEUE_SIZE': 100,
+        # Seconds a submitter is blocked, when the job queue is full
+        'QUEUE_TIMEOUT': 5,
+    },
+    # The CaaS requests of the separately configured actions
+    'caas': {
+        'NUM_WORKERS': 4,
+        'MAX_QUEUE_SIZE': 100,
+        'QUEUE_TIMEOUT': 5,
+    },
+}
+EVENTS = {
+    # The event log clients wait for new events on a notifier, which notices
+    # the events added by other processes within CHECK_INTERVAL seconds
+    'CHECK_INTERVAL': 1.0,
+    # Seconds after which a long poll request returns without events
+    'LONG_POLL_TIMEOUT': 20,
+    # Seconds after which an event stream ends, and the seconds between the
+    # comments sent on a stream without events
+    'STREAM_DURATION': 300,
+    'HEARTBEAT_INTERVAL': 15,
+    # The events of a process are added together, when MAX_EVENTS events
+    # have been buffered or the oldest has waited MAX_DELAY seconds
+    'BATCH': {
+        'ENABLED': False,
+        'MAX_EVENTS': 50,
+        'MAX_DELAY': 0.5,
+    },
+    # The CAPACITY last events are kept in a ring buffer with the
+    # descriptions truncated to MAX_DESCRIPTION_LENGTH characters, which
+    # bounds the cache memory of the event log, and a read gets at most
+    # MAX_RANGE events. The device and category indexes keep the sequence
+    # numbers of their INDEX_CAPACITY last events for INDEX_TIMEOUT seconds
+    # after their last event.
+    'STORE': {
+        'CAPACITY': 1000,
+        'MAX_RANGE': 200,
+        'MAX_DESCRIPTION_LENGTH': 1000,
+        'INDEX_CAPACITY': 100,
+        'INDEX_TIMEOUT': 60*60*24,
+    },
+    # The events of the hot write paths, such as the state value updates,
+    # are queued and added every FLUSH_INTERVAL seconds in batches of
+    # MAX_BATCH events. A full queue drops the events.
+    'EMITTER': {
+        'ENABLED': True,
+        'MAX_QUEUE_SIZE': 10000,
+        'MAX_BATCH': 100,
+        'FLUSH_INTERVAL': 0.2,
+        # Each category keeps the share SAMPLE_RATE of its events and at
+        # most RATE_LIMIT events per second with bursts of BURST events
+        'CATEGORIES': {
+            'state_value': {
+                'SAMPLE_RATE': 1.0,
+                'RATE_LIMIT': 50,
+                'BURST': 200,
+            },
+            'proximity': {
+                'SAMPLE_RATE': 1.0,
+                'RATE_LIMIT': 20,
+                'BURST': 100,
+            },
+        },
+    },
 }
 
+CONFIGURATION_MODELS = {
+    # Seconds within which device interface changes are collapsed into one
+    # regeneration per affected schedule
+    'REGENERATION_WINDOW': 10,
+}
 
 PROFILING = False
 
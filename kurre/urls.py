@@ -22,6 +22,8 @@ urlpatterns = patterns('',
 	url(r'^registration/', include ('registration.urls')),
 	url(r'^event_log/$', 'events.views.index'),
 	url(r'^event_log/events/$', 'events.views.events'),
+	url(r'^event_log/stream/$', 'events.views.stream'),
+	url(r'^event_log/range/$', 'events.views.event_range'),
 	url(r'^login/$', 'django.contrib.auth.views.login', {'template_name': 'login.html'}),
 	url(r'^logout/$', 'registration.views.log_out'),
 			   
@@ -1,45 +1,73 @@
+import logging
 import threading
 
+logger = logging.getLogger(__name__)
+
 class DeviceHandler():
+    """The registry of the devices known to the proximity server.
+
+    The devices are indexed by their ids in a dictionary, so that adding and
+    getting a device takes constant time regardless of the number of
+    devices. The registry is shared by the request handler threads, and
+    every access holds the device lock.
+
+    """
     def __init__(self):
-        self.devices = []
-        self.deviceLock = threading.Lock()
+        self.devices = {}
+        self.deviceLock = threading.RLock()
 
 
     def addDevice( self, device ):
-        for item in self.devices:
-            if item.id == device.id:
-                print( "device ", device.id, " already registered" )
+        with self.deviceLock:
+            if device.id in self.devices:
+                logger.debug( "device %s already registered", device.id )
                 return 0
 
-        self.devices.append( device )
-        print( "device appended, devices: ", self.devices )
+            self.devices[device.id] = device
+        logger.debug( "device appended: %s", device.id )
         return device
 
     def getDevice( self, devId ):
-        for item in self.devices:
-            if item.id == devId:
-                return item
-        return 0
+        with self.deviceLock:
+            return self.devices.get( devId, 0 )
+
+    def getOrAddDevice( self, devId, neighbours ):
+        """Get a device, or add it with the neighbours, if it is not
+        registered.
+
+        Returns:
+            * A tuple of the device and True, if the device was added.
+
+        """
+        with self.deviceLock:
+            device = self.devices.get( devId )
+            if device is not None:
+                return device, False
+            device = Device( devId, neighbours )
+            self.devices[devId] = device
+            return device, True
 
     def clearGroups(self):
-        for device in self.devices:
-            device.groupId = -1
-            device.visited = False
+        with self.deviceLock:
+            for device in self.devices.itervalues():
+                device.groupId = -1
+                device.visited = False
 
     def clearVisited(self):
-        for device in self.devices:
-            device.visited = False
-    
+        with self.deviceLock:
+            for device in self.devices.itervalues():
+                device.visited = False
+
     def flush(self):
-        self.devices = []
-    
+        with self.deviceLock:
+            self.devices = {}
+
 class Device():
     def __init__(self, devId, neighbours ):
         self.id = devId
         self.neighbours = neighbours
         self.groupId = -1
         self.visited = False
-        
+
     def setNeighbours( self, neighbours ):
         self.neighbours = neighbours
@@ -0,0 +1,264 @@
+"""This module provides the event loop server of the proximity server.
+
+The server handles all connections in a single thread with :mod:`asyncore`,
+so the commands are executed one at a time on the loop, and the device
+registry and the proximity graph are never mutated concurrently. The
+connections are polled with poll() instead of select(), so that the server
+is not limited to FD_SETSIZE connections.
+
+The replies to get_group are served from a snapshot of the groups, which
+is dropped whenever the version of the groups changes, so the reads of
+unchanged groups do not walk and sort the groups again.
+
+A connection that starts with the handshake of :mod:`proximity.protocol`
+carries any number of framed, possibly pipelined commands. Any other
+connection carries a single text command, as with the threaded server.
+
+Exported classes:
+    * :class:`SnapshotCommandParser`: A command parser that serves the
+      groups from a snapshot.
+    * :class:`ProximityChannel`: A class for the connections of the event
+      loop server.
+    * :class:`ProximityServer`: A class for the event loop server.
+
+Exported functions:
+    * raise_file_limit: Raise the limit of open files to the hard limit.
+
+"""
+
+from device import DeviceHandler
+from listen import CommandParser
+from protocol import (HANDSHAKE_SIZE, SUPPORTED_VERSIONS, FrameDecoder,
+                      encode_frame, is_handshake_prefix, make_handshake,
+                      parse_handshake)
+from proximity import ProximityManager
+import asyncore
+import resource
+import socket
+import sys
+import threading
+
+RECV_SIZE = 65536
+DEFAULT_BACKLOG = 1024
+
+
+def raise_file_limit():
+    """Raise the limit of open files to the hard limit.
+
+    Every connection takes a file descriptor, so the soft limit, which is
+    often 1024, caps the number of concurrent connections.
+
+    Returns:
+        * The new limit of open files as an integer.
+
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        soft = hard
+    return soft
+
+
+class SnapshotCommandParser(CommandParser):
+    """A command parser that serves the groups from a snapshot.
+
+    The parser is used only from the thread of the event loop.
+
+    Instance attributes:
+        * snapshot_version: The version of the groups in the snapshot.
+        * snapshot: A dictionary of the get_group replies by the device ids.
+
+    """
+
+    def __init__(self, deviceHandler, proximityManager):
+        """Initialize the SnapshotCommandParser."""
+        CommandParser.__init__(self, deviceHandler, proximityManager)
+        self.snapshot_version = None
+        self.snapshot = {}
+
+    def _get_group(self, dev_id):
+        version = self.proximityManager.get_version()
+        if version != self.snapshot_version:
+            self.snapshot_version = version
+            self.snapshot = {}
+
+        reply = self.snapshot.get(dev_id)
+        if reply is None:
+            reply = CommandParser._get_group(self, dev_id)
+            # Getting the group of an unknown device registers the device,
+            # which changes the version
+            if self.proximityManager.get_version() == version:
+                self.snapshot[dev_id] = reply
+        return reply
+
+
+class ProximityChannel(asyncore.dispatcher):
+    """A class for the connections of the event loop server.
+
+    Instance attributes:
+        * server: The :class:`ProximityServer` object of the connection.
+        * framed: True, if the connection uses the framed protocol, False,
+          if it uses the text protocol, and None until the first bytes have
+          been received.
+
+    """
+
+    def __init__(self, sock, server):
+        """Initialize the ProximityChannel."""
+        asyncore.dispatcher.__init__(self, sock, map=server.map)
+        self.server = server
+        self.framed = None
+        self._received = ''
+        self._decoder = FrameDecoder()
+        self._replies = []
+        self._closing = False
+
+    def readable(self):
+        return not self._closing
+
+    def writable(self):
+        return bool(self._replies)
+
+    def _start(self, data):
+        # The first bytes tell the protocol of the connection
+        if not is_handshake_prefix(data):
+            self.framed = False
+            command = data.strip()
+            if command:
+                self._replies.append(self.server.execute(command))
+            # The text protocol carries a single command
+            self._finish()
+            return ''
+
+        version = parse_handshake(data[:HANDSHAKE_SIZE])
+        if version not in SUPPORTED_VERSIONS:
+            self._replies.append(make_handshake(0))
+            self._finish()
+            return ''
+        self.framed = True
+        self._replies.append(make_handshake(version))
+        return data[HANDSHAKE_SIZE:]
+
+    def _finish(self):
+        self._closing = True
+        if not self._replies:
+            self.close()
+
+    def handle_read(self):
+        data = self.recv(RECV_SIZE)
+        if not data or self._closing:
+            return
+
+        if self.framed is None:
+            self._received += data
+            if (len(self._received) < HANDSHAKE_SIZE and
+                    is_handshake_prefix(self._received)):
+                return
+            data = self._start(self._received)
+            self._received = ''
+
+        if self.framed:
+            for payload in self._decoder.feed(data):
+                self._replies.append(encode_frame(self.server.execute(payload)))
+
+    def handle_write(self):
+        data = ''.join(self._replies)
+        sent = self.send(data)
+        self._replies = [data[sent:]] if sent < len(data) else []
+        if not self._replies and self._closing:
+            self.close()
+
+    def handle_close(self):
+        self.close()
+
+    def handle_error(self):
+        # A failed command closes only its connection
+        exc_type, exc_value = sys.exc_info()[:2]
+        sys.stderr.write('Closing the connection after an error: %s: %s\n' %
+                         (exc_type.__name__, exc_value))
+        self.close()
+
+
+class ProximityServer(asyncore.dispatcher):
+    """A class for the event loop server.
+
+    Instance attributes:
+        * map: The dictionary of the connections of the event loop.
+        * deviceHandler: The :class:`device.DeviceHandler` object.
+        * proximityManager: The :class:`proximity.ProximityManager` object.
+        * commandParser: The :class:`SnapshotCommandParser` object.
+
+    Public functions:
+        * execute: Execute a command.
+        * serve_forever: Run the event loop until the server is shut down.
+        * shutdown: Stop the event loop and wait for it to stop.
+        * server_close: Close the listening socket and the connections.
+
+    """
+
+    def __init__(self, server_address, backlog=DEFAULT_BACKLOG):
+        """Initialize the ProximityServer."""
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(server_address)
+        self.listen(backlog)
+        self.server_address = self.socket.getsockname()
+
+        self.deviceHandler = DeviceHandler()
+        self.proximityManager = ProximityManager(self.deviceHandler)
+        self.commandParser = SnapshotCommandParser(self.deviceHandler,
+                                                   self.proximityManager)
+        self._stop = threading.Event()
+        self._stopped = threading.Event()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            ProximityChannel(pair[0], self)
+
+    def handle_error(self):
+        # A failed accept, e.g., when the process runs out of file
+        # descriptors, must not close the listening socket
+        exc_type, exc_value = sys.exc_info()[:2]
+        sys.stderr.write('Accepting a connection failed: %s: %s\n' %
+                         (exc_type.__name__, exc_value))
+
+    def execute(self, command):
+        """Execute a command.
+
+        Args:
+            * command: The comma separated command as a string.
+
+        Returns:
+            * The reply as a string.
+
+        """
+        return self.commandParser.parse(command)
+
+    def serve_forever(self, poll_interval=0.5):
+        """Run the event loop until the server is shut down.
+
+        Args:
+            * poll_interval: The interval in seconds at which the shutdown
+              is checked.
+
+        """
+        self._stop.clear()
+        self._stopped.clear()
+        try:
+            while not self._stop.is_set():
+                asyncore.loop(poll_interval, use_poll=True, map=self.map,
+                              count=1)
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        """Stop the event loop and wait for it to stop."""
+        self._stop.set()
+        self._stopped.wait()
+
+    def server_close(self):
+        """Close the listening socket and the connections."""
+        asyncore.close_all(map=self.map)
@@ -1,91 +1,110 @@
 from device import *
 from proximity import ProximityManager
+from protocol import (HANDSHAKE_SIZE, SUPPORTED_VERSIONS, FrameDecoder,
+                      encode_frame, is_handshake_prefix, make_handshake,
+                      parse_handshake)
 import SocketServer
 import argparse
+import logging
 import os
 import socket
 import sys
 from profiler.decorators import profile
 
-# Echo server program
-
-#from db import *
+logger = logging.getLogger(__name__)
 
-class MyServer(SocketServer.ThreadingTCPServer):
-    def __init__(self, server_address, RequestHandlerClass,dbAddr):
-        SocketServer.ThreadingTCPServer.__init__(self,server_address,RequestHandlerClass)
-        self.deviceHandler = DeviceHandler()
-        #self.dataBase = DbConn(dbAddr)
-        self.proximityManager = ProximityManager( self.deviceHandler )
+# Echo server program
 
-@profile
-class MyTCPHandler(SocketServer.BaseRequestHandler):
-    """
-    The RequestHandler class for our server.
-    It is instantiated once per connection to the server, and must
-    override the handle() method to implement communication to the
-    client.
-    """
-    def handle(self):
-        # self.request is the TCP socket connected to the client
+RECV_SIZE = 65536
 
-        self.data = self.request.recv(1024).strip()
-        if not self.data:
-            return
-        
-        #print("{} wrote:".format(self.client_address[0]))         
-        print(self.data)
+#from db import *
 
-        reply = self.parse(self.data)
+class CommandParser():
+    """Executes the commands of the proximity server.
 
-        print "replying", reply
-        self.request.send(reply)
+    The parser is shared by the request handler threads. The device registry
+    and the proximity graph lock themselves, so the commands can be executed
+    concurrently.
 
+    """
+    def __init__(self, deviceHandler, proximityManager):
+        self.deviceHandler = deviceHandler
+        self.proximityManager = proximityManager
+
+    def _set_group( self, dev_id, neighbours ):
+        logger.debug( "device %s updating its prox info, neighbours: %s", dev_id, neighbours )
+        device, created = self.deviceHandler.getOrAddDevice( dev_id, neighbours )
+        if created:
+            logger.debug( "device not found! created a new one with neighbours %s", neighbours )
+            self.proximityManager.addDevice( device )
+        else:
+            device.setNeighbours( neighbours )
+            self.proximityManager.update( device )
+
+    def _get_group( self, dev_id ):
+        logger.debug( "getting device %s proximity group", dev_id )
+        device, created = self.deviceHandler.getOrAddDevice( dev_id, [] )
+        if created:
+            self.proximityManager.addDevice( device )
+            
+        group = self.proximityManager.get_group( device )
+        # The ids are sorted, so that the reply does not depend on the
+        # order of the graph
+        ids = sorted( [item.id for item in group if item is not device] )
+        return ("[]", ",".join( ids ))[len(ids) != 0]
 
     def parse( self, data ):
         msg = data.replace(" ", "").split( "," )
-        print msg
+        logger.debug( "command %s", msg )
         cmd = msg.pop(0)
             
         if cmd == "set_group":
             dev_id = msg.pop(0)
-            device = self.server.deviceHandler.getDevice( dev_id )
-            print "device", dev_id, "updating its prox info, neighbours:", msg
-            if not device:
-                print "device not found! creating a new one with neighbours", msg
-                self.server.deviceHandler.addDevice( Device( dev_id, msg ) )
-            else:
-                device.setNeighbours( msg )
-            self.server.proximityManager.update( device )
+            self._set_group( dev_id, msg )
             return "ok"
 
         elif cmd == "get_group":
             dev_id = msg.pop(0)
-            device = self.server.deviceHandler.getDevice( dev_id )
-            print "getting device", dev_id, "proximity group"
+            return self._get_group( dev_id )
+
+        elif cmd == "multi_set_group":
+            # The devices are separated by semicolons, and each device is
+            # followed by its neighbours, e.g.,
+            # multi_set_group, aa, bb, cc; dd; ee, aa
+            entries = [entry.split( "," ) for entry in ",".join( msg ).split( ";" )]
+            # The groups are updated as a whole
+            with self.proximityManager.lock:
+                for entry in entries:
+                    entry = [item for item in entry if item]
+                    if entry:
+                        self._set_group( entry[0], entry[1:] )
+            return "ok"
+
+        elif cmd == "multi_get_group":
+            # The groups are separated by semicolons in the order of the
+            # devices, and they are taken from the same version of the groups
+            with self.proximityManager.lock:
+                return ";".join( [self._get_group( dev_id ) for dev_id in msg if dev_id] )
 
-            if not device:
-                device = self.server.deviceHandler.addDevice( Device( dev_id, [] ) )
-                self.server.proximityManager.addDevice( device )
-                
-            group = self.server.proximityManager.get_group( device )
-            group.remove(device)
-            return ("[]", ",".join( [item.id for item in group ] ))[len(group) != 0]
+        elif cmd == "get_version":
+            # The version of the proximity groups changes, whenever any group
+            # changes
+            return str( self.proximityManager.get_version() )
 
         elif cmd == "add_device":
             dev_id = msg.pop(0)
-            ret = self.server.deviceHandler.addDevice( Device(dev_id, []) )
+            ret = self.deviceHandler.addDevice( Device(dev_id, []) )
             if ret == 0:
                 return "already exists"
             else:
-                self.server.proximityManager.addDevice( ret )
+                self.proximityManager.addDevice( ret )
                 return "ok"
 
         
         elif cmd == "flush":
-            print "flush"
-            self.server.deviceHandler.flush()
-            self.server.proximityManager.flush()
+            logger.debug( "flush" )
+            self.deviceHandler.flush()
+            self.proximityManager.flush()
             return "ok"
         
         elif cmd == "shutdown":
@@ -95,6 +114,84 @@ class MyTCPHandler(SocketServer.BaseRequestHandler):
             return "Unrecognized command!"
 
 
+class MyServer(SocketServer.ThreadingTCPServer):
+    # The framed connections are persistent, so their threads must not keep
+    # the server running
+    daemon_threads = True
+
+    def __init__(self, server_address, RequestHandlerClass,dbAddr):
+        SocketServer.ThreadingTCPServer.__init__(self,server_address,RequestHandlerClass)
+        self.deviceHandler = DeviceHandler()
+        #self.dataBase = DbConn(dbAddr)
+        self.proximityManager = ProximityManager( self.deviceHandler )
+        self.commandParser = CommandParser( self.deviceHandler, self.proximityManager )
+
+@profile
+class MyTCPHandler(SocketServer.BaseRequestHandler):
+    """
+    The RequestHandler class for our server.
+    It is instantiated once per connection to the server, and must
+    override the handle() method to implement communication to the
+    client.
+    """
+    def handle(self):
+        # self.request is the TCP socket connected to the client
+
+        data = self.request.recv(RECV_SIZE)
+        # A framed connection starts with the handshake, whose bytes may
+        # arrive in several packets
+        while data and len(data) < HANDSHAKE_SIZE and is_handshake_prefix(data):
+            chunk = self.request.recv(RECV_SIZE)
+            if not chunk:
+                return
+            data += chunk
+        if not data:
+            return
+
+        if is_handshake_prefix(data):
+            self.handle_framed(data)
+        else:
+            self.handle_text(data)
+
+    def handle_text(self, data):
+        # The text protocol carries a single command per connection
+        self.data = data.strip()
+        if not self.data:
+            return
+        
+        #print("{} wrote:".format(self.client_address[0]))         
+        logger.debug(self.data)
+
+        reply = self.parse(self.data)
+
+        logger.debug("replying %s", reply)
+        self.request.sendall(reply)
+
+    def handle_framed(self, data):
+        version = parse_handshake(data[:HANDSHAKE_SIZE])
+        if version not in SUPPORTED_VERSIONS:
+            self.request.sendall(make_handshake(0))
+            return
+        self.request.sendall(make_handshake(version))
+
+        decoder = FrameDecoder()
+        payloads = decoder.feed(data[HANDSHAKE_SIZE:])
+        while True:
+            # The replies to the pipelined requests are sent together
+            if payloads:
+                replies = [encode_frame(self.parse(payload)) for payload in payloads]
+                self.request.sendall("".join(replies))
+
+            data = self.request.recv(RECV_SIZE)
+            if not data:
+                return
+            payloads = decoder.feed(data)
+
+
+    def parse( self, data ):
+        return self.server.commandParser.parse( data )
+
+
 
 if __name__ == "__main__":
     if not sys.path.count(os.getcwd()):
@@ -0,0 +1,141 @@
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from proximity.device import Device, DeviceHandler
+from proximity.listen import CommandParser
+from proximity.proximity import ProximityManager
+import logging
+import random
+import time
+
+class LinearDeviceHandler(DeviceHandler):
+    # The previous device registry, which scanned a list of the devices on
+    # every lookup
+    def __init__(self, devices):
+        DeviceHandler.__init__(self)
+        self.devices = devices
+
+    def addDevice(self, device):
+        if self.getDevice(device.id) != 0:
+            return 0
+        self.devices.append(device)
+        return device
+
+    def getDevice(self, devId):
+        for item in self.devices:
+            if item.id == devId:
+                return item
+        return 0
+
+    def getOrAddDevice(self, devId, neighbours):
+        device = self.getDevice(devId)
+        if device != 0:
+            return device, False
+        return self.addDevice(Device(devId, neighbours)), True
+
+def mac_address(i):
+    return ':'.join(['%02x' % ((i >> shift) & 0xff) for shift in (40, 32, 24, 16, 8, 0)])
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+            make_option('--devices',
+                        '-d',
+                        action='store',
+                        dest='devices',
+                        default='10000,100000',
+                        help='comma separated numbers of devices (default 10000,100000)'),
+            make_option('--commands',
+                        '-c',
+                        action='store',
+                        type=int,
+                        dest='commands',
+                        default=20000,
+                        help='number of set_group and get_group commands (default 20000)'),
+            make_option('--baseline-commands',
+                        '-b',
+                        action='store',
+                        type=int,
+                        dest='baseline_commands',
+                        default=200,
+                        help='number of commands run against the linear registry (default 200)'),
+            make_option('--group-size',
+                        '-g',
+                        action='store',
+                        type=int,
+                        dest='group_size',
+                        default=10,
+                        help='number of devices near each other (default 10)'),
+            make_option('--seed',
+                        '-s',
+                        action='store',
+                        type=int,
+                        dest='seed',
+                        default=0,
+                        help='random seed of the synthetic commands (default 0)'),
+            )
+    help = "Benchmarks the command throughput of the proximity server over synthetic devices."
+    can_import_settings = True
+
+    def _make_commands(self, generator, num_devices, num_commands, group_size):
+        commands = []
+        for i in range(num_commands):
+            device = generator.randrange(num_devices)
+            if generator.random() < 0.5:
+                # The neighbours are devices near the device
+                group = device - device % group_size
+                neighbours = [mac_address(generator.randrange(group, min(group + group_size, num_devices)))
+                              for j in range(generator.randint(0, 3))]
+                commands.append(','.join(['set_group', mac_address(device)] + neighbours))
+            else:
+                commands.append('get_group,' + mac_address(device))
+        return commands
+
+    def _run(self, parser, commands):
+        # The commands log their progress, which is not benchmarked
+        proximity_logger = logging.getLogger('proximity')
+        level = proximity_logger.level
+        proximity_logger.setLevel(logging.INFO)
+        try:
+            start_time = time.time()
+            for command in commands:
+                parser.parse(command)
+            return time.time() - start_time
+        finally:
+            proximity_logger.setLevel(level)
+
+    def handle(self, *args, **options):
+        try:
+            device_counts = [int(count) for count in options.get('devices').split(',')]
+        except ValueError:
+            raise CommandError('The numbers of devices must be integers.')
+        num_commands = options.get('commands')
+        num_baseline_commands = options.get('baseline_commands')
+        group_size = options.get('group_size')
+        if min(device_counts) < 1 or num_commands < 1 or group_size < 1:
+            raise CommandError('The numbers of devices and commands and the group size must be positive.')
+
+        for num_devices in device_counts:
+            generator = random.Random(options.get('seed'))
+            self.stdout.write('%i devices\n' % num_devices)
+
+            device_handler = DeviceHandler()
+            parser = CommandParser(device_handler, ProximityManager(device_handler))
+            add_commands = ['add_device,' + mac_address(i) for i in range(num_devices)]
+            elapsed = self._run(parser, add_commands)
+            self.stdout.write('  add_device: %.0f commands/s\n' % (num_devices / max(elapsed, 1e-6)))
+
+            commands = self._make_commands(generator, num_devices, num_commands, group_size)
+            elapsed = self._run(parser, commands)
+            throughput = num_commands / max(elapsed, 1e-6)
+            self.stdout.write('  set_group/get_group: %.0f commands/s\n' % throughput)
+
+            if num_baseline_commands > 0:
+                # The linear registry gets the same devices without the
+                # quadratic registration
+                devices = device_handler.devices.values()
+                linear_handler = LinearDeviceHandler(devices)
+                linear_parser = CommandParser(linear_handler, parser.proximityManager)
+                elapsed = self._run(linear_parser, commands[:num_baseline_commands])
+                baseline_throughput = min(num_baseline_commands, num_commands) / max(elapsed, 1e-6)
+                self.stdout.write('  set_group/get_group with the linear registry: %.0f commands/s\n'
+                                  % baseline_throughput)
+                self.stdout.write('  Speedup %.1fx\n' % (throughput / max(baseline_throughput, 1e-6)))
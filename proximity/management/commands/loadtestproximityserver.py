@@ -0,0 +1,214 @@
+from core.proximity_connections import ProximityConnection
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from proximity.eventloop import raise_file_limit
+from proximity.management.commands.benchmarkproximityserver import mac_address
+from proximity.protocol import (HANDSHAKE_SIZE, VERSION, FrameDecoder,
+                                encode_frame, make_handshake, parse_handshake)
+import asyncore
+import errno
+import random
+import socket
+import time
+
+def percentile(values, percent):
+    """Get a percentile of sorted values by the nearest rank."""
+    if not values:
+        return 0.0
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+class LoadTestConnection(asyncore.dispatcher):
+    # A device connection that sends its commands one at a time and records
+    # the latency of every reply
+    def __init__(self, address, commands, results, connection_map):
+        asyncore.dispatcher.__init__(self, map=connection_map)
+        self.commands = commands
+        self.results = results
+        self.received = ''
+        self.decoder = FrameDecoder()
+        self.outgoing = make_handshake()
+        self.handshaken = False
+        self.sent_at = None
+        self.failed = False
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect(address)
+
+    def handle_connect(self):
+        pass
+
+    def writable(self):
+        return not self.connected or bool(self.outgoing)
+
+    def handle_write(self):
+        sent = self.send(self.outgoing)
+        self.outgoing = self.outgoing[sent:]
+
+    def _send_next(self):
+        if not self.commands:
+            self.results['completed'] += 1
+            self.close()
+            return
+        self.outgoing += encode_frame(self.commands.pop())
+        self.sent_at = time.time()
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if not data:
+            return
+        if not self.handshaken:
+            self.received += data
+            if len(self.received) < HANDSHAKE_SIZE:
+                return
+            if parse_handshake(self.received[:HANDSHAKE_SIZE]) != VERSION:
+                raise CommandError('The server does not support the protocol version %i' % VERSION)
+            data = self.received[HANDSHAKE_SIZE:]
+            self.handshaken = True
+            self._send_next()
+
+        for reply in self.decoder.feed(data):
+            self.results['latencies'].append(time.time() - self.sent_at)
+            self._send_next()
+
+    def _fail(self):
+        # A connection may be closed after an error
+        if not self.failed:
+            self.failed = True
+            self.results['failed'] += 1
+        self.close()
+
+    def handle_close(self):
+        self._fail()
+
+    def handle_error(self):
+        self._fail()
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+            make_option('--host',
+                        action='store',
+                        dest='host',
+                        default='localhost',
+                        help='server host (default localhost)'),
+            make_option('--port',
+                        '-p',
+                        action='store',
+                        type=int,
+                        dest='port',
+                        default=50007,
+                        help='server port (default 50007)'),
+            make_option('--connections',
+                        '-n',
+                        action='store',
+                        type=int,
+                        dest='connections',
+                        default=2000,
+                        help='number of concurrent device connections (default 2000)'),
+            make_option('--commands',
+                        '-c',
+                        action='store',
+                        type=int,
+                        dest='commands',
+                        default=20,
+                        help='number of commands per connection (default 20)'),
+            make_option('--devices',
+                        '-d',
+                        action='store',
+                        type=int,
+                        dest='devices',
+                        default=10000,
+                        help='number of registered devices (default 10000)'),
+            make_option('--group-size',
+                        '-g',
+                        action='store',
+                        type=int,
+                        dest='group_size',
+                        default=10,
+                        help='number of devices near each other (default 10)'),
+            make_option('--read-ratio',
+                        '-r',
+                        action='store',
+                        type=float,
+                        dest='read_ratio',
+                        default=0.8,
+                        help='share of get_group commands (default 0.8)'),
+            make_option('--seed',
+                        '-s',
+                        action='store',
+                        type=int,
+                        dest='seed',
+                        default=0,
+                        help='random seed of the synthetic commands (default 0)'),
+            )
+    help = ("Load tests a running proximity server with concurrent device connections "
+            "and reports the command latencies. The server is flushed first.")
+    can_import_settings = True
+
+    def _make_commands(self, generator, device, num_devices, num_commands, group_size, read_ratio):
+        commands = []
+        group = device - device % group_size
+        for i in range(num_commands):
+            if generator.random() < read_ratio:
+                commands.append('get_group,' + mac_address(device))
+            else:
+                neighbours = [mac_address(generator.randrange(group, min(group + group_size, num_devices)))
+                              for j in range(generator.randint(0, 3))]
+                commands.append(','.join(['set_group', mac_address(device)] + neighbours))
+        return commands
+
+    def _register_devices(self, address, num_devices):
+        connection = ProximityConnection(address[0], address[1], timeout=60)
+        try:
+            connection.connect()
+            connection.request(['flush'])
+            for start in range(0, num_devices, 1000):
+                connection.request(['add_device,' + mac_address(i)
+                                    for i in range(start, min(start + 1000, num_devices))])
+        except socket.error, e:
+            raise CommandError('The connection to the proximity server at %s:%i failed: %s' % (address + (e,)))
+        finally:
+            connection.close()
+
+    def handle(self, *args, **options):
+        address = (options.get('host'), options.get('port'))
+        num_connections = options.get('connections')
+        num_commands = options.get('commands')
+        num_devices = options.get('devices')
+        group_size = options.get('group_size')
+        if min(num_connections, num_commands, num_devices, group_size) < 1:
+            raise CommandError('The numbers of connections, commands and devices and the group size must be positive.')
+
+        # Every connection takes a file descriptor
+        file_limit = raise_file_limit()
+        if num_connections + 16 > file_limit:
+            raise CommandError('The limit of open files (%i) is too low for %i connections.' % (file_limit, num_connections))
+
+        self._register_devices(address, num_devices)
+        self.stdout.write('%i devices registered\n' % num_devices)
+
+        generator = random.Random(options.get('seed'))
+        results = {'latencies': [], 'completed': 0, 'failed': 0}
+        connection_map = {}
+        for i in range(num_connections):
+            device = generator.randrange(num_devices)
+            commands = self._make_commands(generator, device, num_devices, num_commands,
+                                           group_size, options.get('read_ratio'))
+            try:
+                LoadTestConnection(address, commands, results, connection_map)
+            except socket.error, e:
+                if e.errno not in (errno.EMFILE, errno.ENFILE):
+                    raise
+                raise CommandError('Out of file descriptors after %i connections.' % i)
+
+        start_time = time.time()
+        asyncore.loop(timeout=1, use_poll=True, map=connection_map)
+        elapsed = time.time() - start_time
+
+        latencies = sorted(results['latencies'])
+        self.stdout.write('%i connections, %i completed, %i failed\n' %
+                          (num_connections, results['completed'], results['failed']))
+        self.stdout.write('%i commands in %.2f s, %.0f commands/s\n' %
+                          (len(latencies), elapsed, len(latencies) / max(elapsed, 1e-6)))
+        self.stdout.write('Latency p50 %.2f ms, p99 %.2f ms, max %.2f ms\n' %
+                          (percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+                           percentile(latencies, 100) * 1000))
@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand, CommandError
 from optparse import make_option
+from proximity.eventloop import ProximityServer, raise_file_limit
 from proximity.listen import MyServer, MyTCPHandler
+import logging
 import socket
 import sys
 
@@ -13,6 +15,20 @@ class Command(BaseCommand):
                         dest='port',
                         default=50007,
                         help='server port (default 50007)'),
+            make_option('--server',
+                        action='store',
+                        type='choice',
+                        choices=['eventloop', 'threaded'],
+                        dest='server',
+                        default='eventloop',
+                        help='eventloop serves all connections in one thread, threaded '
+                             'starts a thread per connection (default eventloop)'),
+            make_option('--quiet',
+                        '-q',
+                        action='store_true',
+                        dest='quiet',
+                        default=False,
+                        help='do not log the commands'),
             )
     help = "A server that stores proximity device information."
     can_import_settings = True
@@ -22,10 +38,19 @@ class Command(BaseCommand):
     
         try:
             # Create the server
-            server = MyServer((HOST, options.get('port')), MyTCPHandler, "localhost")
-            self.stdout.write('Proximity server is running at %s:%s\n' % (HOST, options.get('port')))
+            if options.get('server') == 'eventloop':
+                # Every connection takes a file descriptor
+                raise_file_limit()
+                server = ProximityServer((HOST, options.get('port')))
+            else:
+                server = MyServer((HOST, options.get('port')), MyTCPHandler, "localhost")
+            self.stdout.write('Proximity server (%s) is running at %s:%s\n' % (options.get('server'), HOST, options.get('port')))
             self.stdout.write('Quit the server with CONTROL-C.\n')
             
+            if options.get('quiet'):
+                # The commands are logged at the debug level
+                logging.getLogger('proximity').setLevel(logging.INFO)
+            
             # Activate the server; this will keep running until you
             # interrupt the program with Ctrl-C
             server.serve_forever()
@@ -0,0 +1,152 @@
+"""This module provides the framed protocol of the proximity server.
+
+A framed connection starts with a handshake of the magic bytes ``PRX`` and
+the protocol version as a single byte. The server replies with the same
+handshake, or with the version 0, if it does not support the version, and
+closes the connection. After the handshake, the requests and the replies
+are frames of a 4-byte big-endian length and the payload, so that they are
+not limited in size and a connection can carry any number of them. The
+payloads are the comma separated commands and replies of the text
+protocol. The server replies to the frames in order, so a client can send
+several requests before reading the replies.
+
+A connection that does not start with the handshake is a text protocol
+connection carrying a single command.
+
+Exported classes:
+    * :class:`FrameDecoder`: A class for splitting a byte stream into frames.
+    * :class:`ProtocolError`: An exception for protocol violations.
+
+Exported functions:
+    * is_handshake_prefix: Check whether data may start a handshake.
+    * make_handshake: Make the handshake of a protocol version.
+    * parse_handshake: Get the protocol version of a handshake.
+    * encode_frame: Encode a payload as a frame.
+
+"""
+
+import struct
+
+MAGIC = 'PRX'
+VERSION = 1
+SUPPORTED_VERSIONS = (1,)
+HANDSHAKE_SIZE = len(MAGIC) + 1
+
+_header = struct.Struct('!I')
+HEADER_SIZE = _header.size
+
+
+class ProtocolError(Exception):
+    """Used to indicate that the peer violated the framed protocol."""
+    pass
+
+
+def is_handshake_prefix(data):
+    """Check whether data may start a handshake.
+
+    Args:
+        * data: The first bytes received from a connection.
+
+    Returns:
+        * True, if the data starts with the magic bytes or is a prefix of
+          them.
+
+    """
+    size = min(len(data), len(MAGIC))
+    return data[:size] == MAGIC[:size]
+
+
+def make_handshake(version=VERSION):
+    """Make the handshake of a protocol version."""
+    return MAGIC + chr(version)
+
+
+def parse_handshake(data):
+    """Get the protocol version of a handshake.
+
+    Args:
+        * data: The HANDSHAKE_SIZE first bytes of a connection.
+
+    Returns:
+        * The protocol version as an integer.
+
+    Raises:
+        * :class:`ProtocolError`, if the data is not a handshake.
+
+    """
+    if len(data) != HANDSHAKE_SIZE or not data.startswith(MAGIC):
+        raise ProtocolError('Invalid handshake %r' % data)
+    return ord(data[-1])
+
+
+def encode_frame(payload):
+    """Encode a payload as a frame.
+
+    Args:
+        * payload: The payload as a string. A unicode payload is encoded in
+          UTF-8.
+
+    Returns:
+        * The frame as a string.
+
+    """
+    if isinstance(payload, unicode):
+        payload = payload.encode('utf-8')
+    return _header.pack(len(payload)) + payload
+
+
+class FrameDecoder(object):
+    """A class for splitting a byte stream into frames.
+
+    The received data is fed to the decoder as it arrives, and the decoder
+    buffers the incomplete frames until the rest of them is fed.
+
+    Public functions:
+        * feed: Feed received data to the decoder.
+
+    """
+
+    def __init__(self):
+        """Initialize the FrameDecoder."""
+        self._chunks = []
+        self._buffered = 0
+        self._size = None
+
+    def feed(self, data):
+        """Feed received data to the decoder.
+
+        Args:
+            * data: The received data as a string.
+
+        Returns:
+            * A list of the payloads of the frames completed by the data.
+
+        """
+        if data:
+            self._chunks.append(data)
+            self._buffered += len(data)
+
+        payloads = []
+        while True:
+            if self._size is None:
+                if self._buffered < HEADER_SIZE:
+                    break
+                buffer = self._join()
+                self._size = _header.unpack(buffer[:HEADER_SIZE])[0]
+                self._reset(buffer[HEADER_SIZE:])
+            if self._buffered < self._size:
+                break
+            buffer = self._join()
+            payloads.append(buffer[:self._size])
+            self._reset(buffer[self._size:])
+            self._size = None
+        return payloads
+
+    def _join(self):
+        # The chunks are joined only when a header or a payload is complete,
+        # so that a large frame is not copied on every chunk
+        return ''.join(self._chunks)
+
+    def _reset(self, rest):
+        self._chunks = [rest] if rest else []
+        self._buffered = len(rest)
@@ -1,38 +1,126 @@
 import networkx as nx
+import threading
 
 class ProximityManager():
+    """Maintains the proximity groups of the devices.
+
+    The devices are the nodes and the proximities the edges of a graph, and a
+    proximity group is a connected component of the graph. Instead of
+    searching the component on every request, the components are kept in
+    ``groups`` by their group id, which is also stored in the ``groupId`` of
+    the devices. An added edge merges the smaller group into the larger one,
+    and the group of a device whose edges are removed is rebuilt from the
+    graph. ``version`` is incremented, whenever any group changes, so that
+    the clients can tell whether the groups they have cached are still
+    valid.
+
+    """
     def __init__(self, deviceManager):
-        self.groups = []
+        self.groups = {}
         self.deviceManager = deviceManager
         self.visited = []
         self.gid = 0
+        self.version = 0
 
         self.proxNet = nx.Graph()
+        # The graph is shared by the request handler threads
+        self.lock = threading.RLock()
+
+
+    def _new_group(self, devices):
+        self.gid += 1
+        self.groups[self.gid] = devices
+        for device in devices:
+            device.groupId = self.gid
+
+    def _add_node(self, device):
+        if device not in self.proxNet:
+            self.proxNet.add_node( device )
+            self._new_group( set( [device] ) )
+            self.version += 1
+
+    def _add_edge(self, device, neighbour):
+        self.proxNet.add_edge( device, neighbour )
+        if device.groupId != neighbour.groupId:
+            # Merge the smaller group into the larger one
+            small, large = sorted( [device.groupId, neighbour.groupId],
+                                   key=lambda gid: len( self.groups[gid] ) )
+            members = self.groups.pop( small )
+            for member in members:
+                member.groupId = large
+            self.groups[large].update( members )
+            self.version += 1
+
+    def _rebuild_group(self, device):
+        # Removed edges may have split the group of the device
+        gid = device.groupId
+        members = self.groups[gid]
+        component = set( nx.node_connected_component( self.proxNet, device ) )
+        if len( component ) == len( members ):
+            return
 
+        del self.groups[gid]
+        remaining = members
+        while remaining:
+            self._new_group( component )
+            remaining = remaining - component
+            if remaining:
+                component = set( nx.node_connected_component( self.proxNet,
+                                                              iter( remaining ).next() ) )
+        self.version += 1
 
     def get_group(self, device ):
-        return nx.node_connected_component( self.proxNet, device )
+        """Get the proximity group of a device.
+
+        Returns:
+            * A frozenset of the devices in the group, including the device.
 
+        """
+        with self.lock:
+            # A device that another thread has just registered may not be in
+            # the graph yet
+            if device not in self.proxNet:
+                return frozenset( [device] )
+            # The group is copied, because another thread may change it
+            return frozenset( self.groups[device.groupId] )
+
+    def get_version(self):
+        with self.lock:
+            return self.version
 
     def update(self, dev = 0 ):
         if not dev:
             return
         else:
-            print dev, dev.neighbours, nx.edges( self.proxNet, dev )
-            print self.proxNet.nodes(), self.proxNet.edges()
-            self.proxNet.remove_edges_from( nx.edges( self.proxNet, dev ) )
-
-            registered = []
+            # The neighbours are looked up from the device index, so an
+            # update takes O(neighbours) time
+            registered = set()
             for item in dev.neighbours:
                 neighbour = self.deviceManager.getDevice( item )
                 if neighbour != 0:
-                    registered.append( neighbour )
-                    
-            self.proxNet.add_edges_from( [(dev, item) for item in registered] )
+                    registered.add( neighbour )
+
+            with self.lock:
+                self._add_node( dev )
+
+                # Only the changed edges are removed and added
+                current = set( self.proxNet.neighbors( dev ) )
+                removed = current - registered
+                self.proxNet.remove_edges_from( [(dev, item) for item in removed] )
+                for item in registered - current:
+                    self._add_node( item )
+                    self._add_edge( dev, item )
+
+                if removed:
+                    self._rebuild_group( dev )
 
     def addDevice( self, device ):
-        self.proxNet.add_node( device )
-        self.update( device )
+        with self.lock:
+            self._add_node( device )
+            self.update( device )
 
     def flush( self ):
-        self.proxNet.clear()
+        with self.lock:
+            self.proxNet.clear()
+            self.groups = {}
+            self.version += 1
@@ -37,13 +37,16 @@ $(document).ajaxSend(function(event, xhr, settings) {
 });
 
 $(document).ready(function() {
-    connect(null);
+    // The browsers without server-sent events fall back to long polling
+    if (window.EventSource) {
+        stream();
+    } else {
+        connect(null);
+    }
 });
 
-function callComplete(response) {
-    latest = response.latest;
-
-    if (response.events.length > 0) {
+function showEvents(events) {
+    if (events.length > 0) {
         var at_bottom = null
         if ($(window).scrollTop() + $(window).height() == $(document).height()) {
             at_bottom = true;
@@ -51,7 +54,7 @@ function callComplete(response) {
             at_bottom = false;
         }
 
-        $.each(response.events, function() {
+        $.each(events, function() {
             var event_item = $('<li><span class="date">' + this.date + ' - </span><span class="description">' + this.msg + '</span></li>').hide().fadeIn('slow');
             $('ul#log').append(event_item);
         });
@@ -62,10 +65,36 @@ function callComplete(response) {
 	        }, 2000);
         }
     }
+};
+
+function showDropped(before) {
+    var dropped_item = $('<li class="dropped">Events before ' + before + ' are no longer available</li>');
+    $('ul#log').append(dropped_item);
+};
+
+function callComplete(response) {
+    latest = response.latest;
+
+    if (response.dropped_before !== undefined) {
+        showDropped(response.dropped_before);
+    }
+    showEvents(response.events);
 
     connect(latest);
 };
 
 function connect(seq_num) {
-    $.post('events/', {latest: seq_num}, callComplete, 'json');
+    // The device and category filters of the page apply to the events
+    $.post('events/' + window.location.search, {latest: seq_num}, callComplete, 'json');
+};
+
+function stream() {
+    // The browser reconnects and resumes from the last event by itself
+    var source = new EventSource('stream/' + window.location.search);
+    source.onmessage = function(message) {
+        showEvents([JSON.parse(message.data)]);
+    };
+    source.addEventListener('dropped', function(message) {
+        showDropped(JSON.parse(message.data).before);
+    }, false);
 };